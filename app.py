@@ -1,9 +1,14 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from celery import states, group
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
-from celery.result import AsyncResult
-import subprocess
+import anyio
 import os
+import json
+import uuid
+import asyncio
 import logging
 import requests
 
@@ -12,7 +17,19 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(level
 logger = logging.getLogger(__name__)
 
 from celery_worker import celery_app, process_ffmpeg_task
-from reddit_tasks import process_reddit_intro_task
+from reddit_tasks import process_reddit_intro_task, ingest_background_task
+from background_library_utils import background_library
+from render_cache_utils import RENDER_CACHE_ENABLED, compute_render_fingerprint, render_cache
+from webhook_tasks import queue_webhook
+from events_utils import task_event_hub, publish_task_event
+from font_utils import font_registry
+from task_status_utils import project_task_status, afetch_task_meta, aget_task_statuses
+from batch_utils import create_batch, get_batch_status, send_batch_webhook
+from routing_utils import LANES, JobCost, estimate_job_cost, lane_for_cost, record_estimates
+from prediction_utils import runtime_predictor
+from backlog_utils import backlog_monitor, describe_backlog
+from metrics_utils import metrics, render_metrics
+from prometheus_client import CONTENT_TYPE_LATEST
 
 app = FastAPI(title="FFmpeg Compose API", description="API for processing FFmpeg commands")
 
@@ -24,6 +41,38 @@ class FFmpegOptions(BaseModel):
     options: Dict[str, Any] = Field(default_factory=dict, description="FFmpeg command options")    
     output_file: str = Field(..., description="Output file path")
     webhook_url: Optional[str] = Field(default=None, description="Webhook URL to call upon task completion")
+    download_concurrency: Optional[int] = Field(default=None, ge=1, description="Maximum number of remote inputs downloaded at once for this job")
+    stream_inputs: bool = Field(default=False, description="Feed streamable remote inputs to FFmpeg while they download instead of downloading them first")
+    stream_output: Optional[bool] = Field(default=None, description="Upload pipeable outputs to storage while FFmpeg encodes. Defaults to the worker's STREAM_OUTPUT_ENABLED setting (off)")
+    use_render_cache: bool = Field(default=True, description="Return a previously rendered identical output instead of encoding again")
+    segment_duration: Optional[float] = Field(default=None, gt=0, description="Split long single-input jobs into keyframe-aligned segments of roughly this many seconds and encode them in parallel across workers")
+    segment_safe: Optional[bool] = Field(default=None, description="Declare the filter graph safe (or unsafe) to encode in segments, overriding the SEGMENT_SAFE_FILTERS check")
+
+
+class BatchComposeRequest(BaseModel):
+    """Pydantic model for submitting many compose jobs at once"""
+    jobs: List[FFmpegOptions] = Field(..., min_length=1, max_length=1000, description="Compose jobs, each as accepted by /compose")
+    webhook_url: Optional[str] = Field(default=None, description="Webhook URL called once when every job of the batch has finished")
+
+
+class TaskStatusBatchRequest(BaseModel):
+    """Pydantic model for batch task status lookups"""
+    task_ids: List[str] = Field(..., min_length=1, max_length=1000, description="IDs of the tasks to look up")
+    fields: Optional[List[str]] = Field(default=None, description="Status keys to return for each task besides task_id, e.g. [\"status\", \"progress\"]. All keys when omitted")
+
+
+# Upper bound on threads running blocking work (font scans, MinIO, broker publishes) for the async handlers
+API_THREADPOOL_SIZE = int(os.environ.get('API_THREADPOOL_SIZE', '40'))
+
+
+@app.on_event("startup")
+async def limit_threadpool():
+    anyio.to_thread.current_default_thread_limiter().total_tokens = API_THREADPOOL_SIZE
+
+
+@app.on_event("startup")
+async def build_font_registry():
+    await run_in_threadpool(font_registry.entries)
 
 
 @app.get("/")
@@ -31,33 +80,29 @@ async def root():
     return {"message": "FFmpeg Compose API is running"}
 
 @app.get("/caption_fonts")
-async def list_caption_fonts():
-    """Endpoint to list available caption fonts"""
+async def list_caption_fonts(request: Request):
+    """Endpoint to list available caption fonts
+
+    Served from the font registry with an ETag, so clients can revalidate
+    with If-None-Match and get a 304 while the installed fonts are unchanged.
+    """
     try:
-        result = subprocess.run(['fc-list'], capture_output=True, text=True, check=True)
-        font_names = set()
-
-        for line in result.stdout.splitlines():
-            if ':' not in line:
-                continue
-
-            name_part = line.split(':', 2)[1].strip()
-            for name in name_part.split(','):
-                cleaned_name = name.strip()
-                if cleaned_name:
-                    font_names.add(cleaned_name)
-
-        return {"fonts": sorted(font_names)}
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Error listing caption fonts: {str(e)}")
-        raise HTTPException(status_code=500, detail="Error listing caption fonts")
+        entries = await run_in_threadpool(font_registry.entries)
+        headers = {"ETag": font_registry.etag, "Cache-Control": "no-cache"}
+        if request.headers.get("if-none-match") == font_registry.etag:
+            return Response(status_code=304, headers=headers)
+
+        return JSONResponse({
+            "fonts": sorted({entry.family for entry in entries}),
+            "details": [entry.to_dict() for entry in entries],
+        }, headers=headers)
     except Exception as e:
         logger.error(f"Unexpected error listing caption fonts: {str(e)}")
         raise HTTPException(status_code=500, detail="Unexpected error listing caption fonts")
-        
+
 
 @app.post("/compose")
-async def compose_ffmpeg(options: FFmpegOptions):
+async def compose_ffmpeg(options: FFmpegOptions, background_tasks: BackgroundTasks):
     """Endpoint to compose and execute FFmpeg commands.
     Example JSON Payload:
     ```json
@@ -77,121 +122,346 @@ async def compose_ffmpeg(options: FFmpegOptions):
     ```
     """
     try:
-        # Submit the task to Celery
-        task = process_ffmpeg_task.delay(
-            input_files=options.input_files,
-            output_file=options.output_file,
-            options=options.options,
-            global_options=options.global_options,
-            webhook_url=options.webhook_url
+        render_fingerprint, cached_result = await _lookup_render_cache(options)
+        if cached_result:
+            task_id = await run_in_threadpool(_record_cached_result, options, cached_result, background_tasks)
+            return {"task_id": task_id, "status": "SUCCESS", "cached": True, "output_url": cached_result['output_url']}
+
+        # Route the job to a lane by its estimated cost and submit it to Celery
+        job_cost = await _estimate_job_cost(options)
+        lane = LANES[job_cost.lane]
+        rejection = await _admit({lane.name: job_cost.predicted_seconds})
+        if rejection is not None:
+            return rejection
+        task_id = str(uuid.uuid4())
+        await run_in_threadpool(record_estimates, {task_id: job_cost})
+        await run_in_threadpool(
+            process_ffmpeg_task.apply_async,
+            kwargs=_compose_task_kwargs(options, render_fingerprint),
+            task_id=task_id, queue=lane.queue
         )
-        
-        return {"task_id": task.id, "status": "PROCESSING"}
+
+        backlog_monitor.add(lane.name, job_cost.predicted_seconds)
+
+        return {"task_id": task_id, "status": "PROCESSING", "queue": lane.name, "estimate": job_cost.to_dict()}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/tasks/{task_id}", status_code=200)
-async def get_task_status(task_id: str):
-    """Get the status of a task with progress information"""
-    # Create AsyncResult object for the task
-    task_result = AsyncResult(task_id, app=celery_app)
-    
-    # Initialize result dictionary
-    result = {
-        "task_id": task_id,
-        "status": task_result.status,
+@app.post("/compose/batch")
+async def compose_ffmpeg_batch(request: BatchComposeRequest, background_tasks: BackgroundTasks):
+    """Endpoint to submit many compose jobs at once as a single Celery group.
+
+    Each job takes the same options as /compose. Jobs served from the render
+    cache finish immediately; the rest are enqueued together under the batch ID.
+    Follow the batch at /batches/{batch_id}.
+    """
+    try:
+        batch_id = str(uuid.uuid4())
+        lookups = await asyncio.gather(*(_lookup_render_cache(job) for job in request.jobs))
+        estimates = await asyncio.gather(*(
+            _estimate_job_cost(job) for job, (_, cached_result) in zip(request.jobs, lookups) if not cached_result
+        ))
+        lane_seconds = {}
+        for job_cost in estimates:
+            lane_seconds[job_cost.lane] = lane_seconds.get(job_cost.lane, 0.0) + job_cost.predicted_seconds
+        rejection = await _admit(lane_seconds)
+        if rejection is not None:
+            return rejection
+        estimates = iter(estimates)
+
+        task_ids = []
+        cached_task_ids = []
+        signatures = []
+        job_costs = {}
+        for job, (render_fingerprint, cached_result) in zip(request.jobs, lookups):
+            if cached_result:
+                task_id = await run_in_threadpool(_record_cached_result, job, cached_result, background_tasks)
+                cached_task_ids.append(task_id)
+            else:
+                task_id = str(uuid.uuid4())
+                job_cost = job_costs[task_id] = next(estimates)
+                lane = LANES[job_cost.lane]
+                signatures.append(process_ffmpeg_task.s(**_compose_task_kwargs(job, render_fingerprint)).set(
+                    task_id=task_id, queue=lane.queue
+                ))
+            task_ids.append(task_id)
+
+        # Record the batch before enqueueing so no task can finish ahead of it
+        completed = await run_in_threadpool(create_batch, batch_id, task_ids, request.webhook_url, cached_task_ids)
+        if job_costs:
+            await run_in_threadpool(record_estimates, job_costs)
+        if signatures:
+            await run_in_threadpool(group(signatures).apply_async, task_id=batch_id)
+            for lane_name, seconds in lane_seconds.items():
+                backlog_monitor.add(lane_name, seconds)
+        if completed and request.webhook_url:
+            background_tasks.add_task(send_batch_webhook, batch_id)
+
+        logger.info(f"Batch {batch_id} submitted: {len(signatures)} queued, {len(cached_task_ids)} served from render cache")
+        return {
+            "batch_id": batch_id,
+            "task_ids": task_ids,
+            "status": "COMPLETED" if completed else "PROCESSING",
+            "cached": len(cached_task_ids),
+            "status_url": f"/batches/{batch_id}",
+            "estimates": {task_id: job_cost.to_dict() for task_id, job_cost in job_costs.items()},
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/queue/backlog", status_code=200)
+async def get_queue_backlog():
+    """Queued and running work per lane, its predicted drain time and the runtime model in use
+
+    Meant for autoscalers: scale a lane's workers on its drain_seconds.
+    """
+    try:
+        return await run_in_threadpool(describe_backlog)
+    except Exception as e:
+        logger.error(f"Failed to compute the queue backlog: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to compute the queue backlog")
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics aggregated across every worker"""
+    return Response(await run_in_threadpool(render_metrics), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/batches/{batch_id}", status_code=200)
+async def get_batch_status_endpoint(batch_id: str, include_tasks: bool = True):
+    """Get the aggregated status and progress of a batch"""
+    result = await run_in_threadpool(get_batch_status, batch_id, include_tasks)
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"Batch with ID {batch_id} not found")
+    return result
+
+
+async def _lookup_render_cache(options: FFmpegOptions):
+    """Return the job's render fingerprint and its cached render, if any"""
+    if not (options.use_render_cache and RENDER_CACHE_ENABLED):
+        return None, None
+    try:
+        render_fingerprint = await run_in_threadpool(
+            compute_render_fingerprint,
+            options.input_files, options.output_file, options.options, options.global_options
+        )
+    except Exception as e:
+        logger.error(f"Render fingerprint failed, encoding without the cache: {str(e)}")
+        return None, None
+    if not render_fingerprint:
+        return None, None
+    try:
+        cached = await run_in_threadpool(render_cache.lookup, render_fingerprint)
+        if cached:
+            # Served under the name the job asked for, like a fresh encode
+            cached['output_url'] = await run_in_threadpool(render_cache.copy_to, cached, os.path.basename(options.output_file))
+    except Exception as e:
+        # The fingerprint is kept, so the fresh encode still gets stored
+        logger.error(f"Render cache lookup failed, encoding instead: {str(e)}")
+        cached = None
+    metrics.cache_lookup('render', hit=bool(cached))
+    if not cached:
+        return render_fingerprint, None
+    return render_fingerprint, {
+        'success': True,
+        'output_url': cached['output_url'],
+        'message': 'Served from render cache',
+        'render_fingerprint': render_fingerprint,
+        'cached': True,
     }
-    
-    # Check if the task exists in the backend
-    # Note: Celery doesn't provide a direct way to check if a task exists
-    # A task with status PENDING could be either a non-existent task or a task that hasn't started yet
-    # We'll use a heuristic approach to determine if a task likely doesn't exist
-    
-    # If the task is PENDING and has no task_name, it's likely that the task doesn't exist
-    # This is not 100% reliable but provides a reasonable check
-    if task_result.state == 'PENDING' and not hasattr(task_result, 'task_name'):
-        # Check if this task ID was ever submitted through our API
-        # You could implement a more robust solution by tracking task IDs in a database
+
+
+async def _estimate_job_cost(options: FFmpegOptions) -> JobCost:
+    """Estimate a job's cost for routing and predict its runtime; jobs that can't be estimated go to the default lane
+
+    Only cached probe results are used, so admission never waits on ffprobe
+    or the sources; the worker's own probes fill the cache for later jobs.
+    """
+    try:
+        job_cost = await run_in_threadpool(
+            estimate_job_cost, options.input_files, options.options, options.global_options, cached_only=True
+        )
+    except Exception as e:
+        logger.error(f"Could not estimate job cost, using the default lane: {str(e)}")
+        job_cost = JobCost(cost=None, lane=lane_for_cost(None).name)
+    job_cost.predicted_seconds = await run_in_threadpool(runtime_predictor.predict, job_cost)
+    return job_cost
+
+
+async def _admit(lane_seconds: Dict[str, float]) -> Optional[JSONResponse]:
+    """Admission control: a 429 response when the predicted work would push a lane's backlog past the threshold"""
+    retry_after = None
+    for lane_name, seconds in lane_seconds.items():
         try:
-            # Try to get more information about the task
-            # If the task doesn't exist, this won't provide any additional information
-            if not task_result.info:
-                logger.warning(f"Task with ID {task_id} not found or no longer exists in the backend")
-                raise HTTPException(status_code=404, detail=f"Task with ID {task_id} not found")
+            wait = await run_in_threadpool(backlog_monitor.admit, lane_name, seconds)
         except Exception as e:
-            # If there's an exception while trying to get task info, it likely doesn't exist
-            if "Task with ID" in str(e):
-                raise e
-            logger.error(f"Error checking task {task_id}: {str(e)}")
-            raise HTTPException(status_code=404, detail=f"Task with ID {task_id} not found")
-    
-    # Include progress information if available
-    if task_result.state == 'PROGRESS' and task_result.info:
-        if 'progress' in task_result.info:
-            result["progress"] = task_result.info['progress']
-            # Log progress information for debugging
-            logger.info(f"Task {task_id} progress: {task_result.info['progress']}")
-    
-    # Handle different task states
-    if task_result.ready():
-        if task_result.successful():
-            result["result"] = task_result.result
-            # If the task is successful but doesn't have progress info in the result
-            # add a completed progress indicator
-            if 'progress' not in result and task_result.result and isinstance(task_result.result, dict):
-                if 'progress' in task_result.result:
-                    result["progress"] = task_result.result['progress']
-        else:
-            result["error"] = str(task_result.result)
-            # Add failed status to progress if available
-            if 'progress' not in result:
-                result["progress"] = {
-                    'status': 'failed',
-                    'progress_percent': 0.0
-                }
-    elif task_result.state == 'PENDING':
-        # Task hasn't started yet
-        result["progress"] = {
-            'status': 'pending',
-            'progress_percent': 0.0
-        }
-    
+            logger.error(f"Backlog unavailable, admitting without admission control: {str(e)}")
+            return None
+        if wait is not None:
+            retry_after = max(retry_after or 0, wait)
+    if retry_after is None:
+        return None
+    logger.warning(f"Rejecting {sum(lane_seconds.values()):.0f}s of predicted work, backlog above threshold for {retry_after}s")
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Backlog too long, retry later", "retry_after": retry_after},
+        headers={"Retry-After": str(retry_after)}
+    )
+
+
+def _record_cached_result(options: FFmpegOptions, result: Dict[str, Any], background_tasks: BackgroundTasks) -> str:
+    """Record a finished task so clients polling /tasks/{task_id} see the cached result"""
+    task_id = str(uuid.uuid4())
+    celery_app.backend.store_result(task_id, result, 'SUCCESS')
+    publish_task_event(task_id, 'SUCCESS', result)
+    logger.info(f"Render cache hit {result['render_fingerprint']}, returning {result['output_url']}")
+    if options.webhook_url:
+        payload = {'task_id': task_id, 'status': 'SUCCESS', 'result': result}
+        background_tasks.add_task(queue_webhook, options.webhook_url, payload, task_id)
+    return task_id
+
+
+def _compose_task_kwargs(options: FFmpegOptions, render_fingerprint: Optional[str]) -> Dict[str, Any]:
+    return dict(
+        input_files=options.input_files,
+        output_file=options.output_file,
+        options=options.options,
+        global_options=options.global_options,
+        webhook_url=options.webhook_url,
+        download_concurrency=options.download_concurrency,
+        stream_inputs=options.stream_inputs,
+        stream_output=options.stream_output,
+        render_fingerprint=render_fingerprint,
+        segment_duration=options.segment_duration,
+        segment_safe=options.segment_safe
+    )
+
+
+@app.get("/tasks/{task_id}", status_code=200)
+async def get_task_status(task_id: str):
+    """Get the status of a task with progress information"""
+    # Single non-blocking backend read
+    meta = await afetch_task_meta(task_id)
+
+    # Celery doesn't provide a direct way to check if a task exists: a task
+    # that is PENDING without any info is treated as unknown
+    result = project_task_status(task_id, meta['status'], meta.get('result'))
+    if result is None:
+        logger.warning(f"Task with ID {task_id} not found or no longer exists in the backend")
+        raise HTTPException(status_code=404, detail=f"Task with ID {task_id} not found")
+
+    if 'progress' in result and result["status"] == 'PROGRESS':
+        # Log progress information for debugging
+        logger.info(f"Task {task_id} progress: {result['progress']}")
+
     return result
 
 
+@app.post("/tasks/status", status_code=200)
+async def get_task_statuses_batch(request: TaskStatusBatchRequest):
+    """Get the status of many tasks with a single backend round trip"""
+    try:
+        return await aget_task_statuses(request.task_ids, request.fields)
+    except Exception as e:
+        logger.error(f"Error fetching task statuses: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+SSE_KEEPALIVE_SECONDS = 15
+
+
+async def _task_events(task_id: str):
+    """Yield the task's last event followed by live events until it reaches a final state"""
+    queue = await task_event_hub.subscribe(task_id)
+    try:
+        # subscribe() returns once the subscription is active, so nothing published after
+        # this read is lost; the final state is re-read on every keepalive in case the
+        # listener was reconnecting when it was published
+        last_event = await task_event_hub.last_event(task_id)
+        seen = 0.0
+        if last_event is not None:
+            yield last_event
+            if last_event['state'] in states.READY_STATES:
+                return
+            seen = last_event['timestamp']
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                try:
+                    event = await task_event_hub.last_event(task_id)
+                except Exception as e:
+                    logger.warning(f"Could not re-read the last event of task {task_id}: {str(e)}")
+                    event = None
+                if event is None or event['timestamp'] <= seen:
+                    yield None
+                    continue
+            yield event
+            if event['state'] in states.READY_STATES:
+                return
+            seen = max(seen, event['timestamp'])
+    finally:
+        task_event_hub.unsubscribe(task_id, queue)
+
+
+@app.get("/tasks/{task_id}/events")
+async def stream_task_events(task_id: str):
+    """Server-Sent Events stream of a task's progress and final state"""
+    async def event_stream():
+        async for event in _task_events(task_id):
+            if event is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"event: {event['state'].lower()}\ndata: {json.dumps(event, default=str)}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@app.websocket("/tasks/{task_id}/ws")
+async def task_events_websocket(websocket: WebSocket, task_id: str):
+    """WebSocket stream of a task's progress and final state"""
+    await websocket.accept()
+    try:
+        async for event in _task_events(task_id):
+            if event is not None:
+                await websocket.send_json(event)
+        await websocket.close()
+    except WebSocketDisconnect:
+        logger.info(f"WebSocket subscriber for task {task_id} disconnected")
+
+
 @app.delete("/tasks/{task_id}", status_code=200)
 async def stop_task(task_id: str):
     """Stop a running task"""
-    # Create AsyncResult object for the task
-    task_result = AsyncResult(task_id, app=celery_app)
-    
+    meta = await afetch_task_meta(task_id)
+    state, info = meta['status'], meta.get('result')
+
     # Check if the task exists
-    if task_result.state == 'PENDING' and not hasattr(task_result, 'task_name'):
-        try:
-            if not task_result.info:
-                logger.warning(f"Task with ID {task_id} not found or no longer exists in the backend")
-                raise HTTPException(status_code=404, detail=f"Task with ID {task_id} not found")
-        except Exception as e:
-            if "Task with ID" in str(e):
-                raise e
-            logger.error(f"Error checking task {task_id}: {str(e)}")
-            raise HTTPException(status_code=404, detail=f"Task with ID {task_id} not found")
-    
+    if state == states.PENDING and not info:
+        logger.warning(f"Task with ID {task_id} not found or no longer exists in the backend")
+        raise HTTPException(status_code=404, detail=f"Task with ID {task_id} not found")
+
     # Check if the task is already completed
-    if task_result.ready():
+    if state in states.READY_STATES:
         return {
             "task_id": task_id,
-            "status": task_result.status,
+            "status": state,
             "message": "Task already completed, cannot be stopped"
         }
-    
+
     pid = None
-    if task_result.info and isinstance(task_result.info, dict) and 'pid' in task_result.info:
-        pid = task_result.info['pid']
-    
-    # Revoke the task
-    task_result.revoke(terminate=True, signal='SIGTERM')
+    if info and isinstance(info, dict) and 'pid' in info:
+        pid = info['pid']
+
+    # Revoke the task, and the segment tasks and concat callback of a segmented encode,
+    # with a single broadcast published off the event loop
+    revoke_ids = [task_id]
+    if info and isinstance(info, dict):
+        revoke_ids += [child_id for child_id in info.get('segment_task_ids', []) + [info.get('chord_id')] if child_id]
+    await run_in_threadpool(celery_app.control.revoke, revoke_ids, terminate=True, signal='SIGTERM')
     logger.info(f"Task {task_id} has been stopped")
 
     if pid:
@@ -222,13 +492,23 @@ class RedditIntroOptions(BaseModel):
     padding: int = Field(default=5, description="Padding for the title")
     audio_url: Optional[str] = Field(default=None, description="URL of the audio file. It will overwrite the duration of the video if provided")
     background_video_url: Optional[str] = Field(default=None, description="URL of the background video")
+    background_id: Optional[str] = Field(default=None, description="ID of a background from the background library. Unknown IDs are rejected with 404. A random library background is used when neither this nor background_video_url is given")
     webhook_url: Optional[str] = Field(default=None, description="Webhook URL to call upon task completion")
 
 @app.post("/reddit_intro")
 async def generate_reddit_intro(options: RedditIntroOptions):
     """Endpoint to generate the Reddit intro video"""
+    if options.background_id:
+        try:
+            background = await run_in_threadpool(background_library.get, options.background_id)
+        except Exception as e:
+            logger.error(f"Error reading background {options.background_id}: {str(e)}")
+            raise HTTPException(status_code=500, detail="Error reading the background library")
+        if background is None:
+            raise HTTPException(status_code=404, detail=f"Background with ID {options.background_id} not found")
     try:
-        task = process_reddit_intro_task.delay(
+        task = await run_in_threadpool(
+            process_reddit_intro_task.delay,
             subreddit=options.subreddit,
             title=options.title,
             resolution_x=options.resolution_x,
@@ -239,12 +519,63 @@ async def generate_reddit_intro(options: RedditIntroOptions):
             padding=options.padding,
             audio_url=options.audio_url,
             background_video_url=options.background_video_url,
-            webhook_url=options.webhook_url                 
+            webhook_url=options.webhook_url,
+            background_id=options.background_id
         )        
         return {"task_id": task.id, "status": "PROCESSING"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+class BackgroundIngestOptions(BaseModel):
+    url: str = Field(..., description="URL of the background video to add to the library")
+    name: Optional[str] = Field(default=None, description="Display name, defaults to the file name")
+    resolutions: Optional[List[str]] = Field(default=None, description="Proxy resolutions as WIDTHxHEIGHT. Defaults to the worker's BACKGROUND_PROXY_RESOLUTIONS")
+
+@app.post("/backgrounds")
+async def ingest_background(options: BackgroundIngestOptions):
+    """Endpoint to add a background video to the library
+
+    The video is transcoded once per resolution to a scaled, cropped proxy
+    with short GOPs, which reddit intros then seek into locally.
+    """
+    for resolution in options.resolutions or []:
+        width, _, height = resolution.partition('x')
+        if not (width.isdigit() and height.isdigit()):
+            raise HTTPException(status_code=422, detail=f"Invalid resolution {resolution}, expected WIDTHxHEIGHT")
+    try:
+        task = await run_in_threadpool(
+            ingest_background_task.delay,
+            url=options.url,
+            name=options.name,
+            resolutions=options.resolutions
+        )
+        return {"task_id": task.id, "status": "PROCESSING"}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/backgrounds")
+async def list_backgrounds():
+    """Endpoint to list the backgrounds in the library"""
+    try:
+        entries = await run_in_threadpool(background_library.list)
+    except Exception as e:
+        logger.error(f"Error listing backgrounds: {str(e)}")
+        raise HTTPException(status_code=500, detail="Error listing backgrounds")
+    return {"backgrounds": [
+        {
+            "id": entry["id"],
+            "name": entry["name"],
+            "source_url": entry["source_url"],
+            "duration": entry["duration"],
+            "created_at": entry["created_at"],
+            "proxies": {
+                resolution: {"size": proxy["size"], "duration": proxy["duration"], "keyframes": proxy["keyframe_count"]}
+                for resolution, proxy in entry["proxies"].items()
+            },
+        }
+        for entry in entries
+    ]}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("app:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,245 @@
+import os
+import json
+import time
+import random
+import bisect
+import hashlib
+import logging
+import tempfile
+import subprocess
+import redis
+
+from typing import List, Dict, Any, Optional, Tuple
+from minio.error import S3Error
+
+from minioclient_utils import minio_client, bucket_name
+from probe_utils import probe_media, probe_keyframe_times
+from redis_utils import redis_client
+
+logger = logging.getLogger(__name__)
+
+BACKGROUND_LIBRARY_DIR = os.environ.get('BACKGROUND_LIBRARY_DIR', os.path.join(tempfile.gettempdir(), 'ffmpeg-backgrounds'))
+BACKGROUND_PROXY_RESOLUTIONS = [
+    r.strip() for r in os.environ.get('BACKGROUND_PROXY_RESOLUTIONS', '1080x1920,1920x1080').split(',') if r.strip()
+]
+BACKGROUND_PROXY_FPS = int(os.environ.get('BACKGROUND_PROXY_FPS', '60'))
+# Seconds between forced keyframes, i.e. the granularity of random starts
+BACKGROUND_PROXY_GOP_SECONDS = float(os.environ.get('BACKGROUND_PROXY_GOP_SECONDS', '1'))
+BACKGROUND_PROXY_CRF = os.environ.get('BACKGROUND_PROXY_CRF', '20')
+BACKGROUND_OBJECT_PREFIX = 'backgrounds/'
+
+_LIBRARY_KEY = 'background_library'
+# IDs of the backgrounds with a proxy at a resolution, so a random pick is one SRANDMEMBER
+_RESOLUTION_INDEX_KEY = 'background_library:{}'
+# Keyframe times of one proxy, kept out of the library hash so listing and picking don't decode them
+_KEYFRAMES_KEY = 'background_keyframes:{}:{}'
+# Set once entries ingested with inline keyframes have been moved to the layout above
+_INDEXED_KEY = 'background_library:indexed'
+
+
+def background_id(source_url: str) -> str:
+    return hashlib.sha256(source_url.encode('utf-8')).hexdigest()[:16]
+
+
+def build_proxy_command(source: str, output_path: str, width: int, height: int) -> List[str]:
+    """FFmpeg command that transcodes a background to a cropped, short-GOP proxy without audio"""
+    return [
+        "ffmpeg", "-y", "-v", "error",
+        "-i", source,
+        "-vf", f"scale={width}:{height}:force_original_aspect_ratio=increase,crop={width}:{height},fps={BACKGROUND_PROXY_FPS},setsar=1",
+        "-an",
+        "-c:v", "libx264",
+        "-preset", "medium",
+        "-crf", BACKGROUND_PROXY_CRF,
+        "-pix_fmt", "yuv420p",
+        "-force_key_frames", f"expr:gte(t,n_forced*{BACKGROUND_PROXY_GOP_SECONDS})",
+        "-sc_threshold", "0",
+        "-movflags", "+faststart",
+        output_path
+    ]
+
+
+class BackgroundLibrary:
+    """Backgrounds ingested once and kept as pre-transcoded proxies
+
+    Each background has one proxy per target resolution, already scaled and
+    cropped, with a keyframe every BACKGROUND_PROXY_GOP_SECONDS and an index
+    of its keyframe times. Proxies are stored in MinIO and the index in Redis;
+    every worker keeps a local copy of the proxies it has used in local_dir,
+    so random starts are keyframe-accurate local seeks.
+
+    The library hash holds one small entry per background; keyframe times
+    live under their own key per proxy and each resolution has a set of the
+    backgrounds that have it.
+    """
+
+    def __init__(self, client, bucket: str, redis, local_dir: str):
+        self.client = client
+        self.bucket = bucket
+        self.redis = redis
+        self.local_dir = local_dir
+
+    def get(self, bg_id: str) -> Optional[Dict[str, Any]]:
+        raw = self.redis.hget(_LIBRARY_KEY, bg_id)
+        return json.loads(raw) if raw else None
+
+    def find(self, id_or_url: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Look a background up by its ID or the URL it was ingested from"""
+        if not id_or_url:
+            return None
+        try:
+            return self.get(id_or_url) or self.get(background_id(id_or_url))
+        except redis.exceptions.RedisError as e:
+            logger.warning(f"Background library unavailable: {str(e)}")
+            return None
+
+    def list(self) -> List[Dict[str, Any]]:
+        self._ensure_indexed()
+        entries = [json.loads(raw) for raw in self.redis.hvals(_LIBRARY_KEY)]
+        return sorted(entries, key=lambda entry: entry['created_at'])
+
+    def random(self, resolution: str) -> Optional[Dict[str, Any]]:
+        """A random background with a proxy at ``resolution``"""
+        try:
+            self._ensure_indexed()
+            bg_id = self.redis.srandmember(_RESOLUTION_INDEX_KEY.format(resolution))
+            return self.get(bg_id.decode('utf-8') if isinstance(bg_id, bytes) else bg_id) if bg_id else None
+        except redis.exceptions.RedisError as e:
+            logger.warning(f"Background library unavailable: {str(e)}")
+            return None
+
+    def keyframes(self, entry: Dict[str, Any], resolution: str) -> List[float]:
+        """Keyframe times of the background's proxy at ``resolution``"""
+        proxy = entry['proxies'][resolution]
+        if 'keyframes' in proxy:
+            return proxy['keyframes']
+        raw = self.redis.get(_KEYFRAMES_KEY.format(entry['id'], resolution))
+        return json.loads(raw) if raw else []
+
+    def _save(self, pipe, entry: Dict[str, Any], keyframes: Dict[str, List[float]]):
+        for resolution, times in keyframes.items():
+            pipe.set(_KEYFRAMES_KEY.format(entry['id'], resolution), json.dumps(times))
+        pipe.hset(_LIBRARY_KEY, entry['id'], json.dumps(entry))
+        for resolution in entry['proxies']:
+            pipe.sadd(_RESOLUTION_INDEX_KEY.format(resolution), entry['id'])
+
+    def _ensure_indexed(self):
+        """Move the keyframes of entries ingested before the per-proxy keys out of the hash, once"""
+        if self.redis.exists(_INDEXED_KEY):
+            return
+        pipe = self.redis.pipeline()
+        for _, raw in self.redis.hscan_iter(_LIBRARY_KEY):
+            entry = json.loads(raw)
+            keyframes = {
+                resolution: proxy.pop('keyframes')
+                for resolution, proxy in entry['proxies'].items() if 'keyframes' in proxy
+            }
+            for resolution, times in keyframes.items():
+                entry['proxies'][resolution]['keyframe_count'] = len(times)
+            self._save(pipe, entry, keyframes)
+        pipe.set(_INDEXED_KEY, 1)
+        pipe.execute()
+
+    def _local_path(self, bg_id: str, resolution: str) -> str:
+        return os.path.join(self.local_dir, bg_id, f"{resolution}.mp4")
+
+    def ingest(self, source: str, source_url: str, name: Optional[str] = None,
+               resolutions: Optional[List[str]] = None, duration: Optional[float] = None,
+               on_progress=None) -> Dict[str, Any]:
+        """Transcode ``source`` to proxies, upload them and record the background
+
+        Args:
+            source: Local path (or URL) FFmpeg reads the background from
+            source_url: URL identifying the background in the library
+            name: Display name
+            resolutions: Proxy resolutions as WIDTHxHEIGHT, defaults to BACKGROUND_PROXY_RESOLUTIONS
+            duration: Source duration in seconds, if already known
+            on_progress: Called with the resolution before each proxy is transcoded
+
+        Raises:
+            subprocess.CalledProcessError: If FFmpeg or ffprobe fails
+        """
+        bg_id = background_id(source_url)
+        entry = {
+            'id': bg_id,
+            'name': name or os.path.basename(source_url.split('?', 1)[0]) or bg_id,
+            'source_url': source_url,
+            'duration': duration,
+            'created_at': time.time(),
+            'proxies': {},
+        }
+        proxy_keyframes = {}
+        for resolution in resolutions or BACKGROUND_PROXY_RESOLUTIONS:
+            width, height = (int(value) for value in resolution.split('x'))
+            if on_progress:
+                on_progress(resolution)
+            local_path = self._local_path(bg_id, resolution)
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            temp_path = f"{local_path}.{os.getpid()}.tmp.mp4"
+            started = time.time()
+            subprocess.run(build_proxy_command(source, temp_path, width, height), capture_output=True, text=True, check=True)
+            keyframes = probe_keyframe_times(temp_path)
+            object_name = f"{BACKGROUND_OBJECT_PREFIX}{bg_id}/{resolution}.mp4"
+            self.client.fput_object(self.bucket, object_name, temp_path)
+            os.replace(temp_path, local_path)
+            entry['proxies'][resolution] = {
+                'object_name': object_name,
+                'size': os.path.getsize(local_path),
+                'keyframe_count': len(keyframes),
+                'duration': probe_media(local_path).duration,
+            }
+            proxy_keyframes[resolution] = keyframes
+            logger.info(f"Background {bg_id} proxy {resolution} ready in {time.time() - started:.1f}s ({len(keyframes)} keyframes)")
+
+        if entry['duration'] is None and entry['proxies']:
+            entry['duration'] = max(proxy['duration'] or 0 for proxy in entry['proxies'].values())
+        pipe = self.redis.pipeline()
+        self._save(pipe, entry, proxy_keyframes)
+        pipe.execute()
+        return entry
+
+    def local_proxy(self, entry: Dict[str, Any], resolution: str) -> Optional[str]:
+        """Path of the background's proxy at ``resolution`` on this worker, fetching it once if needed"""
+        proxy = entry['proxies'].get(resolution)
+        if proxy is None:
+            return None
+        local_path = self._local_path(entry['id'], resolution)
+        if os.path.exists(local_path):
+            return local_path
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        temp_path = f"{local_path}.{os.getpid()}.tmp"
+        try:
+            self.client.fget_object(self.bucket, proxy['object_name'], temp_path)
+        except S3Error as e:
+            logger.error(f"Background proxy {proxy['object_name']} unavailable: {str(e)}")
+            return None
+        # Atomic, so concurrent fetches on the same worker can't expose a partial file
+        os.replace(temp_path, local_path)
+        logger.info(f"Fetched background proxy {proxy['object_name']} to {local_path}")
+        return local_path
+
+
+def pick_start(entry: Dict[str, Any], resolution: str, duration: float,
+               keyframes: List[float]) -> Tuple[float, bool]:
+    """Random keyframe to start a clip of ``duration`` seconds from
+
+    Args:
+        entry: Library entry of the background
+        resolution: Proxy resolution as WIDTHxHEIGHT
+        duration: Length of the clip in seconds
+        keyframes: Keyframe times of the proxy, from BackgroundLibrary.keyframes
+
+    Returns:
+        Tuple of the start time and whether the proxy is too short and has
+        to be looped
+    """
+    proxy = entry['proxies'][resolution]
+    keyframes = keyframes or [0.0]
+    latest_start = (proxy['duration'] or 0) - duration
+    if latest_start < 0:
+        return 0.0, True
+    candidates = keyframes[:bisect.bisect_right(keyframes, latest_start)] or [keyframes[0]]
+    return random.choice(candidates), False
+
+
+background_library = BackgroundLibrary(minio_client, bucket_name, redis_client, BACKGROUND_LIBRARY_DIR)
@@ -0,0 +1,186 @@
+import os
+import json
+import math
+import time
+import logging
+import threading
+import redis
+
+from typing import List, Dict, Any, Optional
+from celery.signals import worker_init, worker_shutdown
+
+from redis_utils import redis_client
+from routing_utils import LANES, JOB_BACKLOG_KEY
+from prediction_utils import RUNTIME_DEFAULT_SECONDS, runtime_predictor
+
+logger = logging.getLogger(__name__)
+
+# Projected drain time, in seconds, of a lane above which /compose answers 429
+ADMISSION_MAX_BACKLOG_SECONDS = float(os.environ.get('ADMISSION_MAX_BACKLOG_SECONDS', '7200'))
+# Seconds a computed backlog is reused by the API before it is read again
+BACKLOG_CACHE_SECONDS = float(os.environ.get('BACKLOG_CACHE_SECONDS', '2'))
+
+WORKERS_KEY = 'queue_workers'
+_WORKER_HEARTBEAT_SECONDS = 30
+# Workers that missed this many seconds of heartbeats are considered gone
+_WORKER_EXPIRY_SECONDS = 3 * _WORKER_HEARTBEAT_SECONDS
+# Running jobs this many times past their prediction (and at least an hour) are considered lost
+_LOST_JOB_FACTOR = 4
+_LOST_JOB_MIN_SECONDS = 3600
+
+_worker_info: Dict[str, Any] = {}
+_heartbeat_stop = threading.Event()
+
+
+def _register_worker():
+    try:
+        redis_client.hset(WORKERS_KEY, _worker_info['hostname'], json.dumps({**_worker_info, 'seen_at': time.time()}))
+    except redis.exceptions.RedisError as e:
+        logger.error(f"Failed to register worker capacity: {str(e)}")
+
+
+def _heartbeat():
+    while not _heartbeat_stop.wait(_WORKER_HEARTBEAT_SECONDS):
+        _register_worker()
+
+
+@worker_init.connect
+def register_worker_capacity(sender=None, **kwargs):
+    # The worker's lanes and pool size, so the API can turn the backlog into a drain time
+    queues = sender.app.amqp.queues
+    _worker_info.update({
+        'hostname': sender.hostname,
+        'queues': sorted(queues.consume_from or queues),
+        'concurrency': sender.concurrency,
+    })
+    _register_worker()
+    threading.Thread(target=_heartbeat, name="WorkerCapacityHeartbeat", daemon=True).start()
+
+
+@worker_shutdown.connect
+def unregister_worker_capacity(**kwargs):
+    _heartbeat_stop.set()
+    if _worker_info:
+        try:
+            redis_client.hdel(WORKERS_KEY, _worker_info['hostname'])
+        except redis.exceptions.RedisError as e:
+            logger.error(f"Failed to unregister worker capacity: {str(e)}")
+
+
+def live_workers(raw_workers: Optional[List[bytes]] = None) -> List[Dict[str, Any]]:
+    """Workers that sent a heartbeat recently, read from Redis unless their raw entries are given"""
+    now = time.time()
+    if raw_workers is None:
+        raw_workers = redis_client.hvals(WORKERS_KEY)
+    workers = [json.loads(raw) for raw in raw_workers]
+    return [worker for worker in workers if now - worker['seen_at'] <= _WORKER_EXPIRY_SECONDS]
+
+
+def lane_capacity() -> Dict[str, int]:
+    """Concurrent jobs each lane's live workers can run
+
+    A worker consuming several lanes counts fully towards each of them.
+    """
+    capacity = {name: 0 for name in LANES}
+    for worker in live_workers():
+        for lane in LANES.values():
+            if lane.queue in worker['queues']:
+                capacity[lane.name] += worker['concurrency']
+    return capacity
+
+
+def compute_backlog() -> Dict[str, Any]:
+    """Outstanding predicted work per lane and the time the lane's workers need to drain it"""
+    now = time.time()
+    lanes = {name: {'queued': 0, 'running': 0, 'backlog_seconds': 0.0} for name in LANES}
+    lost = []
+    for task_id, raw in redis_client.hgetall(JOB_BACKLOG_KEY).items():
+        job = json.loads(raw)
+        lane = lanes.get(job['lane'])
+        if lane is None:
+            continue
+        predicted = job['predicted_seconds'] or RUNTIME_DEFAULT_SECONDS
+        if job['started_at'] is None:
+            lane['queued'] += 1
+            lane['backlog_seconds'] += predicted
+            continue
+        elapsed = now - job['started_at']
+        if elapsed > max(_LOST_JOB_FACTOR * predicted, _LOST_JOB_MIN_SECONDS):
+            lost.append(task_id)
+            continue
+        lane['running'] += 1
+        # A job running past its prediction still holds its slot for a while
+        lane['backlog_seconds'] += max(predicted - elapsed, 0.1 * predicted)
+    if lost:
+        logger.warning(f"Dropping {len(lost)} jobs that ran far past their prediction from the backlog")
+        redis_client.hdel(JOB_BACKLOG_KEY, *lost)
+
+    capacity = lane_capacity()
+    for name, lane in lanes.items():
+        lane['backlog_seconds'] = round(lane['backlog_seconds'], 1)
+        lane['workers'] = capacity[name]
+        if capacity[name]:
+            lane['drain_seconds'] = round(lane['backlog_seconds'] / capacity[name], 1)
+        else:
+            lane['drain_seconds'] = None if lane['backlog_seconds'] else 0.0
+    drains = [lane['drain_seconds'] for lane in lanes.values()]
+    return {
+        'computed_at': now,
+        'lanes': lanes,
+        'drain_seconds': None if None in drains else max(drains),
+        'admission_threshold_seconds': ADMISSION_MAX_BACKLOG_SECONDS,
+    }
+
+
+class BacklogMonitor:
+    """The backlog as seen by one API process, recomputed at most every BACKLOG_CACHE_SECONDS"""
+
+    def __init__(self, cache_seconds: float, threshold: float):
+        self.cache_seconds = cache_seconds
+        self.threshold = threshold
+        self._snapshot: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+
+    def snapshot(self) -> Dict[str, Any]:
+        snapshot = self._snapshot
+        if snapshot is not None and time.time() - snapshot['computed_at'] < self.cache_seconds:
+            return snapshot
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or time.time() - snapshot['computed_at'] >= self.cache_seconds:
+                snapshot = self._snapshot = compute_backlog()
+            return snapshot
+
+    def admit(self, lane: str, predicted_seconds: float) -> Optional[int]:
+        """Check whether a job fits in its lane's backlog
+
+        Returns:
+            None to admit the job, otherwise the seconds after which a retry
+            should fit, for Retry-After
+        """
+        if self.threshold <= 0:
+            return None
+        stats = self.snapshot()['lanes'][lane]
+        workers = stats['workers']
+        if not workers:
+            # No live worker for the lane: the backlog can't drain, admit and let it queue
+            return None
+        projected = (stats['backlog_seconds'] + predicted_seconds) / workers
+        if projected <= self.threshold:
+            return None
+        return max(1, math.ceil(projected - self.threshold))
+
+    def add(self, lane: str, predicted_seconds: float):
+        """Count an admitted job in the cached snapshot until the next recompute"""
+        snapshot = self._snapshot
+        if snapshot is not None:
+            stats = snapshot['lanes'][lane]
+            stats['queued'] += 1
+            stats['backlog_seconds'] += predicted_seconds
+
+
+backlog_monitor = BacklogMonitor(BACKLOG_CACHE_SECONDS, ADMISSION_MAX_BACKLOG_SECONDS)
+
+
+def describe_backlog() -> Dict[str, Any]:
+    return {**compute_backlog(), 'model': runtime_predictor.describe()}
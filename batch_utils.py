@@ -0,0 +1,164 @@
+import json
+import time
+import logging
+import redis
+
+from typing import List, Dict, Any, Optional
+from celery import states
+from celery.signals import task_postrun, task_revoked
+
+from celery_worker import celery_app
+from redis_utils import redis_client
+from task_status_utils import get_task_statuses
+from webhook_tasks import queue_webhook
+
+logger = logging.getLogger(__name__)
+
+_BATCH_KEY = 'batch:{}'
+_BATCH_DONE_KEY = 'batch:{}:done'
+_BATCH_TASK_KEY = 'batch:task:{}'
+
+# Batch records live as long as the task results they summarize
+BATCH_TTL = int(celery_app.conf.result_expires.total_seconds()) if celery_app.conf.result_expires else 24 * 3600
+
+
+def create_batch(batch_id: str, task_ids: List[str], webhook_url: Optional[str] = None,
+                 done_task_ids: Optional[List[str]] = None) -> bool:
+    """Record a batch before its tasks are enqueued
+
+    Args:
+        batch_id: Batch ID, also used as the Celery group ID
+        task_ids: IDs of every task in the batch, in submission order
+        webhook_url: URL notified once when the last task of the batch finishes
+        done_task_ids: Tasks that are already finished, e.g. served from the render cache
+
+    Returns:
+        True if every task of the batch is already finished
+    """
+    done_task_ids = set(done_task_ids or [])
+    pipe = redis_client.pipeline()
+    pipe.hset(_BATCH_KEY.format(batch_id), mapping={
+        'task_ids': json.dumps(task_ids),
+        'webhook_url': webhook_url or '',
+        'total': len(task_ids),
+        'created_at': time.time(),
+    })
+    pipe.expire(_BATCH_KEY.format(batch_id), BATCH_TTL)
+    pipe.set(_BATCH_DONE_KEY.format(batch_id), len(done_task_ids), ex=BATCH_TTL)
+    for task_id in task_ids:
+        if task_id not in done_task_ids:
+            pipe.set(_BATCH_TASK_KEY.format(task_id), batch_id, ex=BATCH_TTL)
+    pipe.execute()
+    return len(done_task_ids) == len(task_ids)
+
+
+def get_batch(batch_id: str) -> Optional[Dict[str, Any]]:
+    raw = redis_client.hgetall(_BATCH_KEY.format(batch_id))
+    if not raw:
+        return None
+    batch = {k.decode('utf-8'): v.decode('utf-8') for k, v in raw.items()}
+    return {
+        'batch_id': batch_id,
+        'task_ids': json.loads(batch['task_ids']),
+        'webhook_url': batch['webhook_url'] or None,
+        'total': int(batch['total']),
+        'created_at': float(batch['created_at']),
+    }
+
+
+def _task_outcome(status: Dict[str, Any]) -> str:
+    state = status['status']
+    if state == states.SUCCESS:
+        # process_ffmpeg_task reports FFmpeg errors as a successful task with success=False
+        result = status.get('result')
+        return 'failed' if isinstance(result, dict) and result.get('success') is False else 'succeeded'
+    if state in states.READY_STATES:
+        return 'failed'
+    if state == states.PENDING:
+        return 'pending'
+    return 'processing'
+
+
+def get_batch_status(batch_id: str, include_tasks: bool = True) -> Optional[Dict[str, Any]]:
+    """Aggregate status and progress of every task in a batch
+
+    Returns:
+        Dict with the batch status (PROCESSING or COMPLETED), per-outcome
+        counts, the mean progress percentage and optionally every task's
+        status; None if the batch is unknown
+    """
+    batch = get_batch(batch_id)
+    if batch is None:
+        return None
+
+    statuses = get_task_statuses(batch['task_ids'])
+    by_id = {status['task_id']: status for status in statuses['tasks']}
+    # Tasks still waiting in the queue have no backend entry yet
+    tasks = [by_id.get(task_id, {'task_id': task_id, 'status': states.PENDING}) for task_id in batch['task_ids']]
+
+    counts = {'pending': 0, 'processing': 0, 'succeeded': 0, 'failed': 0}
+    total_percent = 0.0
+    for status in tasks:
+        outcome = _task_outcome(status)
+        counts[outcome] += 1
+        if outcome in ('succeeded', 'failed'):
+            total_percent += 100.0
+        elif outcome == 'processing':
+            total_percent += (status.get('progress') or {}).get('progress_percent') or 0.0
+
+    completed = counts['succeeded'] + counts['failed'] == batch['total']
+    result = {
+        'batch_id': batch_id,
+        'status': 'COMPLETED' if completed else 'PROCESSING',
+        'total': batch['total'],
+        'counts': counts,
+        'progress_percent': round(total_percent / batch['total'], 2) if batch['total'] else 100.0,
+    }
+    if include_tasks:
+        result['tasks'] = tasks
+    return result
+
+
+def send_batch_webhook(batch_id: str) -> bool:
+    """Notify the batch webhook with the final status of every task"""
+    batch = get_batch(batch_id)
+    if batch is None or not batch['webhook_url']:
+        return False
+    return queue_webhook(batch['webhook_url'], get_batch_status(batch_id), batch_id) is not None
+
+
+def mark_batch_task_done(task_id: str):
+    """Count a finished task towards its batch and fire the batch webhook after the last one"""
+    try:
+        pipe = redis_client.pipeline()
+        pipe.get(_BATCH_TASK_KEY.format(task_id))
+        pipe.delete(_BATCH_TASK_KEY.format(task_id))
+        batch_id, deleted = pipe.execute()
+        # Only the caller that removed the mapping counts the task, so
+        # retries and duplicate signals don't count it twice
+        if batch_id is None or not deleted:
+            return
+        batch_id = batch_id.decode('utf-8')
+        done = redis_client.incr(_BATCH_DONE_KEY.format(batch_id))
+        total = int(redis_client.hget(_BATCH_KEY.format(batch_id), 'total') or 0)
+    except redis.exceptions.RedisError as e:
+        logger.error(f"Failed to record completion of task {task_id} in its batch: {str(e)}")
+        return
+
+    if done == total:
+        logger.info(f"Batch {batch_id} completed ({total} tasks)")
+        send_batch_webhook(batch_id)
+
+
+@task_postrun.connect
+def count_finished_batch_task(task_id=None, state=None, **kwargs):
+    # Segmented encodes finish their parent task from the concat or failure
+    # callback, which count it themselves
+    if state in states.READY_STATES:
+        mark_batch_task_done(task_id)
+
+
+@task_revoked.connect
+def count_revoked_batch_task(request=None, **kwargs):
+    if request is not None:
+        mark_batch_task_done(request.id)
@@ -0,0 +1,70 @@
+"""Benchmark for the reddit intro title overlay on synthetic testsrc backgrounds
+
+Encodes the same clip twice, with the title fed to FFmpeg as a PNG looped at
+60 fps and scaled on every frame (the old pipeline) and as a single
+pre-scaled, cropped frame held by overlay (the current pipeline), and reports
+the encode fps of each.
+
+Usage:
+    python benchmark_reddit_overlay.py --duration 20 --resolution 1080x1920
+"""
+import os
+import time
+import argparse
+import tempfile
+import subprocess
+
+from reddit_utils import create_fancy_thumbnail, load_template, prepare_overlay
+
+TITLE = "What is something you learned way too late in life that would have changed everything?"
+FPS = 60
+
+
+def encode(inputs, filter_graph, duration, encoder_args):
+    command = ["ffmpeg", "-y", "-v", "error"] + inputs + [
+        "-filter_complex", filter_graph,
+        "-map", "[outv]", "-t", str(duration), "-r", str(FPS), "-pix_fmt", "yuv420p",
+    ] + encoder_args + ["-f", "null", "-"]
+    started = time.perf_counter()
+    subprocess.run(command, check=True)
+    return duration * FPS / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=10.0, help="Clip length in seconds")
+    parser.add_argument("--resolution", default="1080x1920", help="Output WIDTHxHEIGHT")
+    parser.add_argument("--encoder", default="libx264 -preset veryfast", help="Video encoder and its options")
+    args = parser.parse_args()
+
+    width, height = (int(value) for value in args.resolution.split("x"))
+    screenshot_width = width * 90 // 100
+    background = ["-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate={FPS}:duration={args.duration}"]
+    encoder_args = ["-c:v"] + args.encoder.split()
+    fades = f"fade=t=in:st=0:d=1,fade=t=out:st={max(0.0, args.duration - 2)}:d=2"
+
+    title = create_fancy_thumbnail(load_template(), TITLE, "#000000", 5)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        full_path = os.path.join(temp_dir, "title_full.png")
+        title.save(full_path)
+        overlay, x, y = prepare_overlay(title, screenshot_width, width, height)
+        overlay_path = os.path.join(temp_dir, "title.png")
+        overlay.save(overlay_path)
+
+        looped = encode(
+            background + ["-loop", "1", "-framerate", str(FPS), "-i", full_path],
+            f"[1:v]scale={screenshot_width}:-1[title_scaled];[0:v][title_scaled]overlay=(W-w)/2:(H-h)/2,{fades}[outv]",
+            args.duration, encoder_args,
+        )
+        single = encode(
+            background + ["-i", overlay_path],
+            f"[0:v][1:v]overlay={x}:{y}:eof_action=repeat,{fades}[outv]",
+            args.duration, encoder_args,
+        )
+
+    print(f"looped 60 fps PNG:    {looped:.1f} fps")
+    print(f"single-frame overlay: {single:.1f} fps ({single / looped:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
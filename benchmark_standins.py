@@ -0,0 +1,273 @@
+"""Local stand-ins for the services the render pipeline talks to, for offline benchmarks
+
+MediaServer serves a directory over HTTP with Last-Modified/ETag validators,
+like the origins remote inputs are downloaded from. S3StandIn implements the
+subset of the S3 API the MinIO client uses here (buckets, single and
+multipart uploads, stat, get, copy, list, delete), keeping objects in memory
+and ignoring authentication.
+"""
+import os
+import time
+import uuid
+import hashlib
+import threading
+import email.utils
+
+from urllib.parse import urlsplit, parse_qs, unquote
+from xml.sax.saxutils import escape
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler, BaseHTTPRequestHandler
+from functools import partial
+
+_S3_NAMESPACE = "http://s3.amazonaws.com/doc/2006-03-01/"
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def end_headers(self):
+        if self.command in ("GET", "HEAD") and self.path and not self.path.endswith("/"):
+            path = self.translate_path(self.path)
+            if os.path.isfile(path):
+                stat = os.stat(path)
+                self.send_header("ETag", f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"')
+                self.send_header("Accept-Ranges", "bytes")
+        super().end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _Server:
+    def __init__(self, server: ThreadingHTTPServer):
+        self.server = server
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name=type(self).__name__, daemon=True)
+
+    @property
+    def address(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"{host}:{port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class MediaServer(_Server):
+    """Serves ``directory`` at http://127.0.0.1:<port>/"""
+
+    def __init__(self, directory: str):
+        super().__init__(ThreadingHTTPServer(("127.0.0.1", 0), partial(_QuietHandler, directory=directory)))
+
+    def url(self, name: str) -> str:
+        return f"http://{self.address}/{name}"
+
+
+def _http_date(timestamp: float) -> str:
+    return email.utils.formatdate(timestamp, usegmt=True)
+
+
+def _iso_date(timestamp: float) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(timestamp))
+
+
+class _S3Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def store(self) -> "S3StandIn":
+        return self.server.standin
+
+    def _parse(self):
+        parts = urlsplit(self.path)
+        path = unquote(parts.path).lstrip("/")
+        bucket, _, key = path.partition("/")
+        return bucket, key, {name: values[0] for name, values in parse_qs(parts.query, keep_blank_values=True).items()}
+
+    def _body(self) -> bytes:
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b";")[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            return b"".join(chunks)
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _reply(self, status: int, body: bytes = b"", headers=None, content_type="application/xml"):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _xml(self, status: int, root: str, inner: str):
+        self._reply(status, f'<?xml version="1.0" encoding="UTF-8"?><{root} xmlns="{_S3_NAMESPACE}">{inner}</{root}>'.encode())
+
+    def _error(self, status: int, code: str, resource: str):
+        if self.command == "HEAD":
+            self._reply(status)
+            return
+        self._reply(status, (
+            f'<?xml version="1.0" encoding="UTF-8"?><Error><Code>{code}</Code><Message>{code}</Message>'
+            f'<Resource>/{escape(resource)}</Resource><RequestId>standin</RequestId><HostId>standin</HostId></Error>'
+        ).encode())
+
+    def _object_headers(self, obj):
+        return {
+            "ETag": f'"{obj["etag"]}"',
+            "Last-Modified": _http_date(obj["mtime"]),
+            "Content-Length": str(len(obj["data"])),
+        }
+
+    def do_HEAD(self):
+        bucket, key, _ = self._parse()
+        if bucket not in self.store.buckets:
+            return self._error(404, "NoSuchBucket", bucket)
+        if not key:
+            return self._reply(200)
+        obj = self.store.buckets[bucket].get(key)
+        if obj is None:
+            return self._error(404, "NoSuchKey", f"{bucket}/{key}")
+        self.send_response(200)
+        for name, value in self._object_headers(obj).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", obj["content_type"])
+        self.end_headers()
+
+    def do_GET(self):
+        bucket, key, query = self._parse()
+        if "location" in query:
+            return self._xml(200, "LocationConstraint", "")
+        if bucket not in self.store.buckets:
+            return self._error(404, "NoSuchBucket", bucket)
+        if not key:
+            return self._list(bucket, query)
+        obj = self.store.buckets[bucket].get(key)
+        if obj is None:
+            return self._error(404, "NoSuchKey", f"{bucket}/{key}")
+        data = obj["data"]
+        status = 200
+        headers = self._object_headers(obj)
+        byte_range = self.headers.get("Range")
+        if byte_range and byte_range.startswith("bytes="):
+            start, _, end = byte_range[6:].partition("-")
+            start = int(start or 0)
+            end = int(end) if end else len(data) - 1
+            data = data[start:end + 1]
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{start + len(data) - 1}/{len(obj['data'])}"
+            headers["Content-Length"] = str(len(data))
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", obj["content_type"])
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _list(self, bucket: str, query):
+        prefix = query.get("prefix", "")
+        contents = "".join(
+            f"<Contents><Key>{escape(key)}</Key><LastModified>{_iso_date(obj['mtime'])}</LastModified>"
+            f"<ETag>&quot;{obj['etag']}&quot;</ETag><Size>{len(obj['data'])}</Size><StorageClass>STANDARD</StorageClass></Contents>"
+            for key, obj in sorted(self.store.buckets[bucket].items()) if key.startswith(prefix)
+        )
+        self._xml(200, "ListBucketResult", (
+            f"<Name>{escape(bucket)}</Name><Prefix>{escape(prefix)}</Prefix><KeyCount>{contents.count('<Contents>')}</KeyCount>"
+            f"<MaxKeys>1000</MaxKeys><IsTruncated>false</IsTruncated>{contents}"
+        ))
+
+    def do_PUT(self):
+        bucket, key, query = self._parse()
+        body = self._body()
+        if not key:
+            # make_bucket and set_bucket_policy
+            self.store.buckets.setdefault(bucket, {})
+            return self._reply(204 if "policy" in query else 200)
+        if bucket not in self.store.buckets:
+            return self._error(404, "NoSuchBucket", bucket)
+        if "uploadId" in query:
+            upload = self.store.uploads.get(query["uploadId"])
+            if upload is None:
+                return self._error(404, "NoSuchUpload", f"{bucket}/{key}")
+            etag = hashlib.md5(body).hexdigest()
+            upload[int(query["partNumber"])] = body
+            return self._reply(200, headers={"ETag": f'"{etag}"'})
+        copy_source = self.headers.get("x-amz-copy-source")
+        if copy_source:
+            source_bucket, _, source_key = unquote(copy_source).lstrip("/").partition("/")
+            source = self.store.buckets.get(source_bucket, {}).get(source_key)
+            if source is None:
+                return self._error(404, "NoSuchKey", f"{source_bucket}/{source_key}")
+            obj = self.store.put(bucket, key, source["data"], source["content_type"])
+            return self._xml(200, "CopyObjectResult", f"<ETag>&quot;{obj['etag']}&quot;</ETag><LastModified>{_iso_date(obj['mtime'])}</LastModified>")
+        obj = self.store.put(bucket, key, body, self.headers.get("Content-Type", "application/octet-stream"))
+        self._reply(200, headers={"ETag": f'"{obj["etag"]}"'})
+
+    def do_POST(self):
+        bucket, key, query = self._parse()
+        self._body()
+        if "uploads" in query:
+            upload_id = uuid.uuid4().hex
+            self.store.uploads[upload_id] = {}
+            return self._xml(200, "InitiateMultipartUploadResult",
+                             f"<Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key><UploadId>{upload_id}</UploadId>")
+        if "uploadId" in query:
+            parts = self.store.uploads.pop(query["uploadId"], None)
+            if parts is None:
+                return self._error(404, "NoSuchUpload", f"{bucket}/{key}")
+            obj = self.store.put(bucket, key, b"".join(parts[number] for number in sorted(parts)),
+                                 "application/octet-stream", etag_suffix=f"-{len(parts)}")
+            return self._xml(200, "CompleteMultipartUploadResult",
+                             f"<Location>/{escape(bucket)}/{escape(key)}</Location><Bucket>{escape(bucket)}</Bucket>"
+                             f"<Key>{escape(key)}</Key><ETag>&quot;{obj['etag']}&quot;</ETag>")
+        self._error(400, "InvalidRequest", f"{bucket}/{key}")
+
+    def do_DELETE(self):
+        bucket, key, query = self._parse()
+        if "uploadId" in query:
+            self.store.uploads.pop(query["uploadId"], None)
+        else:
+            self.store.buckets.get(bucket, {}).pop(key, None)
+        self._reply(204)
+
+
+class S3StandIn(_Server):
+    """In-memory S3 endpoint at 127.0.0.1:<port> for the MinIO client"""
+
+    def __init__(self):
+        super().__init__(ThreadingHTTPServer(("127.0.0.1", 0), _S3Handler))
+        self.server.standin = self
+        self.buckets = {}
+        self.uploads = {}
+        self._lock = threading.Lock()
+
+    def put(self, bucket: str, key: str, data: bytes, content_type: str, etag_suffix: str = ""):
+        obj = {
+            "data": data,
+            "etag": hashlib.md5(data).hexdigest() + etag_suffix,
+            "mtime": time.time(),
+            "content_type": content_type,
+        }
+        with self._lock:
+            self.buckets.setdefault(bucket, {})[key] = obj
+        return obj
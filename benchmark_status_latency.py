@@ -0,0 +1,117 @@
+"""Latency benchmark for the task status endpoints under concurrent polling
+
+Submits one short synthetic compose job (or uses the given task IDs), then
+polls GET /tasks/{task_id} from many threads at once and reports latency
+percentiles. With --batch the same IDs are also polled through
+POST /tasks/status for comparison.
+
+Usage:
+    python benchmark_status_latency.py --concurrency 200 --duration 30
+    python benchmark_status_latency.py --task-id <id> --task-id <id> --batch
+"""
+import time
+import argparse
+import threading
+import statistics
+import requests
+
+from concurrent.futures import ThreadPoolExecutor
+
+# API endpoint
+BASE_URL = "http://localhost:5200"
+
+
+def submit_synthetic_job(base_url):
+    """Submit a compose job that renders a lavfi test pattern, so there's a task to poll"""
+    data = {
+        "input_files": [["-f", "lavfi", "testsrc2=duration=60:size=640x360:rate=30"]],
+        "output_file": "benchmark_status_latency.mp4",
+        "options": {"c:v": "libx264", "preset": "ultrafast"},
+        "global_options": ["-y"],
+        "use_render_cache": False,
+    }
+    response = requests.post(f"{base_url}/compose", json=data)
+    response.raise_for_status()
+    return response.json()["task_id"]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def poll(request, concurrency, duration):
+    """Call ``request(session)`` from ``concurrency`` threads for ``duration`` seconds"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        session = requests.Session()
+        local = []
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                response = request(session)
+                ok = response.status_code == 200
+            except requests.exceptions.RequestException:
+                ok = False
+            if ok:
+                local.append((time.perf_counter() - started) * 1000)
+            else:
+                with lock:
+                    errors[0] += 1
+        with lock:
+            latencies.extend(local)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in range(concurrency):
+            executor.submit(worker)
+
+    return latencies, errors[0]
+
+
+def report(name, latencies, errors, duration):
+    if not latencies:
+        print(f"{name}: no successful requests ({errors} errors)")
+        return
+    print(
+        f"{name}: {len(latencies)} requests, {len(latencies) / duration:.0f} req/s, {errors} errors | "
+        f"p50 {percentile(latencies, 50):.1f} ms, p95 {percentile(latencies, 95):.1f} ms, "
+        f"p99 {percentile(latencies, 99):.1f} ms, max {max(latencies):.1f} ms, "
+        f"mean {statistics.mean(latencies):.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--task-id", action="append", default=[], help="Task ID to poll (repeatable); submits a synthetic job when omitted")
+    parser.add_argument("--concurrency", type=int, default=100, help="Concurrent pollers")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds to poll for")
+    parser.add_argument("--batch", action="store_true", help="Also benchmark POST /tasks/status with all task IDs")
+    args = parser.parse_args()
+
+    task_ids = args.task_id or [submit_synthetic_job(args.base_url)]
+    print(f"Polling {len(task_ids)} task(s) with {args.concurrency} concurrent clients for {args.duration:.0f}s")
+
+    counter = iter(range(1 << 62))
+
+    def single(session):
+        return session.get(f"{args.base_url}/tasks/{task_ids[next(counter) % len(task_ids)]}")
+
+    latencies, errors = poll(single, args.concurrency, args.duration)
+    report("GET /tasks/{task_id}", latencies, errors, args.duration)
+
+    if args.batch:
+        def batch(session):
+            return session.post(f"{args.base_url}/tasks/status", json={"task_ids": task_ids, "fields": ["status", "progress"]})
+
+        latencies, errors = poll(batch, args.concurrency, args.duration)
+        report(f"POST /tasks/status ({len(task_ids)} ids)", latencies, errors, args.duration)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,394 @@
+"""Reproducible offline benchmark suite for the render pipeline
+
+Runs without network access or external services: inputs are synthetic media
+generated with lavfi (testsrc2, sine), remote inputs are served by a local
+HTTP server, uploads go to an in-memory S3 stand-in (benchmark_standins.py)
+and Celery tasks run eagerly in this process with an in-memory result
+backend. Redis is optional; point --redis-url at one to include the shared
+caches, otherwise they run in their degraded, Redis-less mode.
+
+Benchmarks:
+    command_build    build_ffmpeg_command throughput
+    progress_parse   FfmpegProgressParser throughput on -progress output
+    title_render     reddit intro title card renders
+    download         remote input downloads, cold and revalidated through the input cache
+    upload           MinIO uploads, whole-file and streamed multipart
+    compose_task     process_ffmpeg_task end to end, file and streamed output (needs FFmpeg)
+    reddit_intro     process_reddit_intro_task end to end (needs FFmpeg)
+
+Each benchmark runs --repeat times and its metrics are the medians. Results
+are written as JSON; a previous results file passed as --baseline is compared
+metric by metric and the run fails when a metric regresses by more than its
+threshold (stored in the baseline, editable per metric).
+
+Usage:
+    python benchmark_suite.py --output benchmark_baselines/main.json
+    python benchmark_suite.py --baseline benchmark_baselines/main.json --output results.json
+    python benchmark_suite.py --only download,upload --repeat 5
+"""
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+
+from benchmark_standins import MediaServer, S3StandIn
+
+SUITE_VERSION = 1
+BUCKET = "video-storage"
+
+# Unit, which direction is better and the default regression threshold (relative change) of every metric
+METRICS = {
+    "command_build.commands_per_s": ("commands/s", "higher", 0.2),
+    "progress_parse.lines_per_s": ("lines/s", "higher", 0.2),
+    "title_render.renders_per_s": ("renders/s", "higher", 0.2),
+    "download.cold_mb_per_s": ("MB/s", "higher", 0.25),
+    "download.revalidated_ms": ("ms", "lower", 0.5),
+    "upload.file_mb_per_s": ("MB/s", "higher", 0.25),
+    "upload.streamed_mb_per_s": ("MB/s", "higher", 0.25),
+    "compose_task.file_seconds": ("s", "lower", 0.1),
+    "compose_task.file_realtime_x": ("x", "higher", 0.1),
+    "compose_task.streamed_seconds": ("s", "lower", 0.1),
+    "reddit_intro.seconds": ("s", "lower", 0.1),
+}
+FFMPEG_BENCHMARKS = {"compose_task", "reddit_intro"}
+
+
+def configure_environment(work_dir, s3_address, redis_url):
+    """Point the app's settings at the stand-ins; must run before any app module is imported"""
+    os.environ.update({
+        "CELERY_BROKER_URL": "memory://",
+        "CELERY_RESULT_BACKEND": "cache+memory://",
+        # Port 1 refuses connections at once, so Redis-less runs don't wait on timeouts
+        "APP_REDIS_URL": redis_url or "redis://127.0.0.1:1/0",
+        "PROBE_CACHE_REDIS_URL": redis_url or "redis://127.0.0.1:1/0",
+        "MINIO_ENDPOINT": s3_address,
+        "MINIO_PUBLIC_ENDPOINT": f"http://{s3_address}",
+        "MINIO_SECURE": "False",
+        "MINIO_BUCKET_NAME": BUCKET,
+        "INPUT_CACHE_DIR": os.path.join(work_dir, "input-cache"),
+        "CPU_LEDGER_PATH": os.path.join(work_dir, "cpu-ledger.json"),
+        "BACKGROUND_LIBRARY_DIR": os.path.join(work_dir, "backgrounds"),
+    })
+
+
+def generate_media(media_dir, duration):
+    """Synthetic inputs: a 720p30 clip with a tone, a vertical background and a voice-over stand-in"""
+    def ffmpeg(*args):
+        subprocess.run(["ffmpeg", "-y", "-v", "error", *args], check=True)
+
+    ffmpeg("-f", "lavfi", "-i", f"testsrc2=size=1280x720:rate=30:duration={duration}",
+           "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=48000:duration={duration}",
+           "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p", "-c:a", "aac", "-shortest",
+           "-movflags", "+faststart", os.path.join(media_dir, "input.mp4"))
+    ffmpeg("-f", "lavfi", "-i", f"testsrc2=size=1080x1920:rate=30:duration={duration}",
+           "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p", "-an",
+           os.path.join(media_dir, "background.mp4"))
+    ffmpeg("-f", "lavfi", "-i", f"sine=frequency=220:sample_rate=48000:duration={max(1, duration // 2)}",
+           os.path.join(media_dir, "voice.wav"))
+
+
+def generate_blob(media_dir, size_mb):
+    path = os.path.join(media_dir, "blob.bin")
+    with open(path, "wb") as f:
+        # Deterministic, incompressible enough for transfer benchmarks
+        chunk = bytes((index * 7919) % 251 for index in range(1024 * 1024))
+        for _ in range(size_mb):
+            f.write(chunk)
+    return path
+
+
+class Suite:
+    def __init__(self, args, work_dir, media, s3):
+        self.args = args
+        self.work_dir = work_dir
+        self.media = media
+        self.s3 = s3
+
+    def command_build(self):
+        from ffmpeg_utils import build_ffmpeg_command
+        inputs = [["-ss", "5", "-i_qscale", "2", "input.mp4"], "overlay.png", ["-stream_loop", "-1", "music.mp3"]]
+        options = {
+            "filter_complex": "[0:v]scale=1080:-2,crop=1080:1920[bg];[bg][1:v]overlay=(W-w)/2:(H-h)/2[v]",
+            "map": ["[v]", "2:a"], "c:v": "libx264", "preset": "veryfast", "crf": 23, "c:a": "aac", "shortest": True,
+        }
+        iterations = 20000
+        started = time.perf_counter()
+        for _ in range(iterations):
+            build_ffmpeg_command(inputs, "output.mp4", options, ["-y", "-hide_banner"])
+        return {"commands_per_s": iterations / (time.perf_counter() - started)}
+
+    def progress_parse(self):
+        from progress_utils import FfmpegProgressParser
+        block = []
+        for index in range(20000):
+            block.extend([
+                f"frame={index * 30}", "fps=120.00", "stream_0_0_q=28.0", "bitrate=2400.0kbits/s",
+                f"total_size={index * 300000}", f"out_time_us={index * 1_000_000}", f"out_time_ms={index * 1_000_000}",
+                f"out_time=00:00:{index % 60:02d}.000000", "dup_frames=0", "drop_frames=0", "speed=4.0x",
+                "progress=continue",
+            ])
+        parser = FfmpegProgressParser(expected_duration=20000)
+        started = time.perf_counter()
+        for line in block:
+            parser.feed(line)
+        return {"lines_per_s": len(block) / (time.perf_counter() - started)}
+
+    def title_render(self):
+        from reddit_utils import create_fancy_thumbnail, load_template, warm_render_assets
+        warm_render_assets()
+        titles = [
+            "What is something you learned way too late in life?",
+            "Redditors who moved to a new country alone, what surprised you the most about everyday life there?",
+            "TIFU by replying all",
+        ]
+        renders = 60
+        started = time.perf_counter()
+        for index in range(renders):
+            create_fancy_thumbnail(load_template(), titles[index % len(titles)], "#000000", 5, subreddit="AskReddit")
+        return {"renders_per_s": renders / (time.perf_counter() - started)}
+
+    def download(self):
+        from ffmpeg_utils import download_remote_inputs
+        url = self.media_server.url("blob.bin")
+        size_mb = os.path.getsize(os.path.join(self.media, "blob.bin")) / 1024 ** 2
+        shutil.rmtree(os.environ["INPUT_CACHE_DIR"], ignore_errors=True)
+        os.makedirs(os.environ["INPUT_CACHE_DIR"], exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=self.work_dir) as temp_dir:
+            started = time.perf_counter()
+            download_remote_inputs([url], os.path.join(temp_dir, "cold"))
+            cold = time.perf_counter() - started
+            started = time.perf_counter()
+            download_remote_inputs([url], os.path.join(temp_dir, "warm"))
+            warm = time.perf_counter() - started
+        return {"cold_mb_per_s": size_mb / cold, "revalidated_ms": warm * 1000}
+
+    def upload(self):
+        from minioclient_utils import minio_client
+        from output_stream_utils import MinioStreamUploader
+        path = os.path.join(self.media, "blob.bin")
+        size_mb = os.path.getsize(path) / 1024 ** 2
+        started = time.perf_counter()
+        minio_client.fput_object(BUCKET, "benchmark/file.bin", path)
+        file_seconds = time.perf_counter() - started
+
+        read_fd, write_fd = os.pipe()
+        uploader = MinioStreamUploader(minio_client, BUCKET, "benchmark/streamed.bin", io.open(read_fd, "rb"))
+        started = time.perf_counter()
+        uploader.start()
+        with open(path, "rb") as source, io.open(write_fd, "wb") as sink:
+            shutil.copyfileobj(source, sink, 1024 * 1024)
+        uploader.join()
+        streamed_seconds = time.perf_counter() - started
+        if uploader.error:
+            raise RuntimeError(uploader.error)
+        return {"file_mb_per_s": size_mb / file_seconds, "streamed_mb_per_s": size_mb / streamed_seconds}
+
+    def compose_task(self):
+        from celery_worker import process_ffmpeg_task
+        kwargs = dict(
+            input_files=[self.media_server.url("input.mp4")],
+            options={"vf": "scale=960:-2", "c:v": "libx264", "preset": "veryfast", "c:a": "aac"},
+            global_options=["-y"],
+        )
+        metrics = {}
+        for name, output, stream_output in (("file", "benchmark_output.mp4", False), ("streamed", "benchmark_output.ts", True)):
+            output_file = os.path.join(self.work_dir, "out", output)
+            started = time.perf_counter()
+            result = process_ffmpeg_task.apply(kwargs={**kwargs, "output_file": output_file, "stream_output": stream_output}).get()
+            seconds = time.perf_counter() - started
+            if not result.get("success"):
+                raise RuntimeError(result.get("error"))
+            metrics[f"{name}_seconds"] = seconds
+            if name == "file":
+                metrics["file_realtime_x"] = self.args.duration / seconds
+        return metrics
+
+    def reddit_intro(self):
+        from reddit_tasks import process_reddit_intro_task
+        started = time.perf_counter()
+        result = process_reddit_intro_task.apply(kwargs=dict(
+            subreddit="AskReddit",
+            title="What is something you learned way too late in life that changed everything?",
+            resolution_x=1080, resolution_y=1920, duration=min(5, self.args.duration),
+            font="Roboto-Bold.ttf", font_color="#000000", padding=5,
+            audio_url=self.media_server.url("voice.wav"),
+            background_video_url=self.media_server.url("background.mp4"),
+        )).get()
+        seconds = time.perf_counter() - started
+        if not isinstance(result, dict) or result.get("status") != "completed":
+            raise RuntimeError(f"Reddit intro failed: {result}")
+        return {"seconds": seconds}
+
+    def run(self, names, repeat):
+        results = {}
+        for name in names:
+            samples = {}
+            try:
+                # One unmeasured warm-up run loads modules, fonts and connections
+                getattr(self, name)()
+                for _ in range(repeat):
+                    for metric, value in getattr(self, name)().items():
+                        samples.setdefault(metric, []).append(value)
+            except Exception as e:
+                logging.getLogger(__name__).exception(f"Benchmark {name} failed")
+                results[name] = {"status": "failed", "error": str(e), "metrics": {}}
+                continue
+            metrics = {}
+            for metric, values in samples.items():
+                unit, better, _ = METRICS[f"{name}.{metric}"]
+                metrics[metric] = {
+                    "value": round(statistics.median(values), 3),
+                    "unit": unit,
+                    "better": better,
+                    "samples": [round(value, 3) for value in values],
+                }
+            results[name] = {"status": "ok", "metrics": metrics}
+            print(f"{name}: " + ", ".join(f"{metric} {data['value']} {data['unit']}" for metric, data in metrics.items()))
+        return results
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def ffmpeg_version():
+    try:
+        return subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True, check=True).stdout.splitlines()[0]
+    except (OSError, subprocess.CalledProcessError, IndexError):
+        return None
+
+
+def compare(results, baseline, default_threshold=None):
+    """Compare metric medians against a baseline results file
+
+    Returns:
+        Tuple of the report lines and the names of the regressed metrics
+    """
+    thresholds = baseline.get("thresholds", {})
+    lines = []
+    regressions = []
+    for name, benchmark in results["benchmarks"].items():
+        base_benchmark = baseline.get("benchmarks", {}).get(name)
+        if benchmark["status"] != "ok" or not base_benchmark or base_benchmark["status"] != "ok":
+            continue
+        for metric, data in benchmark["metrics"].items():
+            base = base_benchmark["metrics"].get(metric)
+            if not base or not base["value"]:
+                continue
+            key = f"{name}.{metric}"
+            threshold = thresholds.get(key, default_threshold if default_threshold is not None else METRICS[key][2])
+            change = (data["value"] - base["value"]) / base["value"]
+            worse = -change if data["better"] == "higher" else change
+            regressed = worse > threshold
+            if regressed:
+                regressions.append(key)
+            lines.append(
+                f"{'REGRESSED' if regressed else 'ok':>9}  {key:<34} {base['value']:>12} -> {data['value']:<12} "
+                f"{data['unit']:<10} {change:+.1%} (threshold {threshold:.0%})"
+            )
+    return lines, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default="benchmark_results.json", help="Results file to write")
+    parser.add_argument("--baseline", help="Previous results file to compare against")
+    parser.add_argument("--threshold", type=float, help="Regression threshold for every metric, overriding the baseline's")
+    parser.add_argument("--only", help="Comma separated benchmarks to run")
+    parser.add_argument("--repeat", type=int, default=3, help="Measured runs per benchmark")
+    parser.add_argument("--duration", type=int, default=10, help="Seconds of synthetic media")
+    parser.add_argument("--blob-mb", type=int, default=64, help="Size of the transfer test file in MiB")
+    parser.add_argument("--redis-url", help="Redis for the shared caches, Redis-less when omitted")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    names = [name.split(".")[0] for name in METRICS]
+    names = list(dict.fromkeys(names))
+    if args.only:
+        names = [name for name in names if name in args.only.split(",")]
+
+    with tempfile.TemporaryDirectory(prefix="ffmpeg-benchmark-") as work_dir, S3StandIn() as s3:
+        media = os.path.join(work_dir, "media")
+        os.makedirs(media)
+        os.makedirs(os.path.join(work_dir, "out"))
+        configure_environment(work_dir, s3.address, args.redis_url)
+        repo_dir = os.path.dirname(os.path.abspath(__file__))
+        commit, dirty = git_revision()
+
+        from ffmpeg_utils import validate_ffmpeg_installed
+        logging.getLogger().setLevel(args.log_level)
+        has_ffmpeg = validate_ffmpeg_installed()
+        if has_ffmpeg:
+            generate_media(media, args.duration)
+        generate_blob(media, args.blob_mb)
+
+        suite = Suite(args, work_dir, media, s3)
+        results = {}
+        runnable = [name for name in names if has_ffmpeg or name not in FFMPEG_BENCHMARKS]
+        for name in names:
+            if name not in runnable:
+                results[name] = {"status": "skipped", "error": "FFmpeg not installed", "metrics": {}}
+        with MediaServer(media) as media_server:
+            suite.media_server = media_server
+            # The reddit intro renders into paths relative to the working directory
+            os.chdir(work_dir)
+            try:
+                results.update(suite.run(runnable, args.repeat))
+            finally:
+                os.chdir(repo_dir)
+
+    report = {
+        "suite_version": SUITE_VERSION,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "git_commit": commit,
+        "git_dirty": dirty,
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "ffmpeg": ffmpeg_version(),
+        },
+        "settings": {"repeat": args.repeat, "duration": args.duration, "blob_mb": args.blob_mb, "redis": bool(args.redis_url)},
+        "thresholds": {key: threshold for key, (_, _, threshold) in METRICS.items()},
+        "benchmarks": {name: results[name] for name in names},
+    }
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("machine", {}).get("platform") != report["machine"]["platform"]:
+            print("Warning: baseline was recorded on a different platform")
+        # Thresholds tuned in the baseline carry over to results saved from this run
+        report["thresholds"].update(baseline.get("thresholds", {}))
+        lines, regressions = compare(report, baseline, args.threshold)
+        print(f"\nCompared with {args.baseline} ({baseline.get('git_commit')}):")
+        print("\n".join(lines))
+        if regressions:
+            print(f"\n{len(regressions)} metric(s) regressed: {', '.join(regressions)}")
+            exit_code = 1
+
+    if any(result["status"] == "failed" for result in results.values()):
+        exit_code = 1
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Microbenchmark for reddit intro title rendering throughput
+
+Renders the same set of titles onto the title template twice: once with the
+per-process font and template caches cleared before every render (how each
+task used to reload its assets) and once with warm caches. Also reports how
+many titles per second the fit-to-box layout engine lays out on its own.
+
+Usage:
+    python benchmark_title_render.py --renders 200 --font Roboto-Bold.ttf
+"""
+import time
+import argparse
+
+from font_utils import _load_font
+from layout_utils import _metrics, fit_text
+from reddit_utils import TITLE_MAX_FONT_SIZE, TITLE_MIN_FONT_SIZE, TITLE_TEXT_BOX, _load_template, create_fancy_thumbnail, load_template, warm_render_assets
+
+TITLES = [
+    "What is something you learned way too late in life?",
+    "People who quit their jobs to travel, how did it go?",
+    "What's the most useless talent you have?",
+    "Redditors who moved to a new country alone, what surprised you the most about everyday life there and would you do it again?",
+    "TIFU by replying all",
+]
+
+
+def run(renders, font, cold):
+    started = time.perf_counter()
+    for index in range(renders):
+        if cold:
+            _load_font.cache_clear()
+            _load_template.cache_clear()
+            _metrics.clear()
+        create_fancy_thumbnail(load_template(), TITLES[index % len(TITLES)], "#000000", 5, font_name=font)
+    return renders / (time.perf_counter() - started)
+
+
+def run_layout(layouts, font):
+    left, top, right, bottom = TITLE_TEXT_BOX
+    started = time.perf_counter()
+    for index in range(layouts):
+        fit_text(TITLES[index % len(TITLES)], font, right - left, bottom - top,
+                 max_size=TITLE_MAX_FONT_SIZE, min_size=TITLE_MIN_FONT_SIZE, line_gap=5)
+    return layouts / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--renders", type=int, default=200)
+    parser.add_argument("--font", default="Roboto-Bold.ttf")
+    args = parser.parse_args()
+
+    cold = run(args.renders, args.font, cold=True)
+    warm_render_assets((args.font,))
+    warm = run(args.renders, args.font, cold=False)
+    print(f"cold assets: {cold:.1f} renders/s")
+    print(f"warm cache:  {warm:.1f} renders/s ({warm / cold:.2f}x)")
+    print(f"layout only: {run_layout(args.renders * 50, args.font):.0f} titles/s")
+
+
+if __name__ == "__main__":
+    main()
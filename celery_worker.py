@@ -1,14 +1,24 @@
+import io
 import os
 import json
+import time
 import tempfile
-import requests
 from datetime import timedelta
 import subprocess
 from typing import List, Dict, Any, Optional
 from celery import Celery
+from celery.exceptions import Ignore
 import logging
 from minio import Minio
-from ffmpeg_utils import build_ffmpeg_command, download_remote_file_to_temp, format_command_for_display, validate_ffmpeg_installed, parse_ffmpeg_progress
+from ffmpeg_utils import build_ffmpeg_command, download_remote_inputs, format_command_for_display, validate_ffmpeg_installed
+from progress_utils import FfmpegProgressParser, add_progress_args, estimate_output_duration, open_progress_pipe
+from input_stream_utils import prepare_streamed_inputs
+from output_stream_utils import STREAM_OUTPUT_ENABLED, MinioStreamUploader, get_streamable_output_format
+from render_cache_utils import render_cache
+from font_utils import resolve_filter_fonts
+from cpu_budget_utils import cpu_scheduler
+from metrics_utils import metrics
+from ffmpeg_log_utils import FfmpegLog
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -52,7 +62,7 @@ except Exception as e:
     logger.error(f"Failed to create or set policy for bucket '{bucket_name}': {str(e)}")
 
 # Configure Celery
-celery_app = Celery('celery_worker', broker=broker_url, backend=result_backend)
+celery_app = Celery('celery_worker', broker=broker_url, backend=result_backend, task_cls='events_utils:EventTask')
 
 celery_app.conf.update(
     task_serializer='json',
@@ -60,64 +70,137 @@ celery_app.conf.update(
     result_serializer='json',
     timezone='UTC',
     enable_utc=True,
-    include=['celery_worker', 'reddit_tasks']
+    include=['celery_worker', 'reddit_tasks', 'segment_tasks', 'batch_utils', 'routing_utils', 'backlog_utils', 'metrics_utils', 'webhook_tasks'],
+    # Compose jobs are routed per job by estimated cost (see routing_utils);
+    # everything else has a fixed lane
+    task_default_queue='standard',
+    task_routes={
+        'reddit_tasks.process_reddit_intro_task': {'queue': 'interactive'},
+        'reddit_tasks.ingest_background_task': {'queue': 'bulk'},
+        # Webhook deliveries have their own lightweight workers
+        'webhook_tasks.*': {'queue': 'webhooks'},
+    },
 )
 
 
-import requests
-
 @celery_app.task(bind=True)
 def process_ffmpeg_task(self, input_files: List[str], output_file: str, 
-                     options: Dict[str, Any], global_options: List[str], webhook_url: Optional[str] = None):
+                     options: Dict[str, Any], global_options: List[str], webhook_url: Optional[str] = None,
+                     download_concurrency: Optional[int] = None, stream_inputs: bool = False,
+                     stream_output: Optional[bool] = None, render_fingerprint: Optional[str] = None,
+                     segment_duration: Optional[float] = None, segment_safe: Optional[bool] = None):
     """Celery task to process FFmpeg commands"""
     command = []
     process = None
     result = None
+    download_timings = []
+    streamers = []
+    uploader = None
+    cpu_allocation = None
+    ffmpeg_log = None
+    progress_file = None
 
     logger.info(f"Starting FFmpeg task with {len(input_files)} input files, output: {output_file}")
+    options = resolve_filter_fonts(options)
+
+    if segment_duration:
+        from segment_tasks import plan_segments, dispatch_segments
+        plan = None
+        try:
+            plan = plan_segments(input_files, options, global_options, segment_duration, segment_safe)
+        except Exception as e:
+            logger.error(f"Could not plan segments, encoding in one piece: {str(e)}")
+        if plan is not None:
+            dispatch_segments(self, plan, output_file, options, global_options, webhook_url, render_fingerprint)
+            # The chord callback stores the final result under this task's id
+            raise Ignore()
     with tempfile.TemporaryDirectory(prefix="ffmpeg-assets-") as temp_dir:        
         try:
+            object_name = os.path.basename(output_file)
+            output_format = None
+            if stream_output if stream_output is not None else STREAM_OUTPUT_ENABLED:
+                output_format = get_streamable_output_format(output_file, options)
+
             output_dir = os.path.dirname(output_file)
-            if output_dir and not os.path.exists(output_dir):
+            if output_format is None and output_dir and not os.path.exists(output_dir):
                 os.makedirs(output_dir)
                 logger.info(f"Created output directory: {output_dir}")
 
-            local_input_files = []
-            for item in input_files:
-                path_or_url = item[-1]
-                if path_or_url.startswith(('http://', 'https://')):
-                    local_path = download_remote_file_to_temp(path_or_url, temp_dir)
-                    new_item = item[:-1] + [local_path]
-                    local_input_files.append(new_item)
-                else:
-                    local_input_files.append(item)
-
-            command = build_ffmpeg_command(
-                input_files=local_input_files,
-                output_file=output_file,
-                options=options,
-                global_options=global_options
+            self.update_state(
+                state='PROGRESS',
+                meta={
+                    'progress': {'status': 'downloading', 'progress_percent': 0.0}
+                }
             )
+            # Probe remote inputs by URL so the shared probe cache applies
+            probe_sources = [item[-1] if isinstance(item, list) else item for item in input_files]
+            with metrics.time_phase('compose', 'download'):
+                if stream_inputs:
+                    # Streamable inputs are replaced by FIFOs, the rest are downloaded below
+                    input_files, streamers = prepare_streamed_inputs(input_files, temp_dir)
+                local_input_files, download_timings = download_remote_inputs(
+                    input_files, temp_dir, max_workers=download_concurrency
+                )
+            if download_timings:
+                logger.info(f"Downloaded {len(download_timings)} remote inputs: {download_timings}")
+
+            cpu_allocation = cpu_scheduler.acquire(self.request.id)
+            options, global_options = cpu_allocation.apply(options, global_options)
+
+            if output_format is not None:
+                # Fragmentable output: ffmpeg writes to stdout and we upload while it encodes
+                logger.info(f"Streaming {output_format} output straight to MinIO object {object_name}")
+                command = build_ffmpeg_command(
+                    input_files=local_input_files,
+                    output_file='pipe:1',
+                    options={**options, 'f': output_format},
+                    global_options=global_options
+                )
+            else:
+                command = build_ffmpeg_command(
+                    input_files=local_input_files,
+                    output_file=output_file,
+                    options=options,
+                    global_options=global_options
+                )
             
-            logger.info(f"Built FFmpeg command: {command}")
-            # Format command for logging
-            formatted_command = format_command_for_display(command)
-            logger.info(f"Executing FFmpeg command: {formatted_command}")
-            
-            # Execute the command with progress tracking
-            process = subprocess.Popen(
-                command,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                universal_newlines=True,
-                bufsize=1
-            )
+            with metrics.time_phase('compose', 'probe'):
+                expected_duration = estimate_output_duration(input_files, options, global_options, probe_sources)
+            # The read end is closed in the finally block below if FFmpeg never gets to use it
+            progress_file, progress_fd = open_progress_pipe()
+            try:
+                command = add_progress_args(command, progress_fd)
+
+                logger.info(f"Built FFmpeg command: {command}")
+                # Format command for logging
+                formatted_command = format_command_for_display(command)
+                logger.info(f"Executing FFmpeg command: {formatted_command}")
+
+                # Execute the command with progress tracking. stdout stays binary
+                # because it carries the encoded output when streaming
+                encode_started = time.time()
+                process = subprocess.Popen(
+                    command,
+                    stdout=subprocess.PIPE if output_format is not None else subprocess.DEVNULL,
+                    stderr=subprocess.PIPE,
+                    pass_fds=(progress_fd,)
+                )
+            finally:
+                os.close(progress_fd)
+            cpu_scheduler.attach(self.request.id, process.pid)
+            # stderr only carries log and error lines now; keep the tail, spill the rest to disk
+            ffmpeg_log = FfmpegLog(temp_dir, self.request.id)
+            ffmpeg_log.drain(io.TextIOWrapper(process.stderr, encoding='utf-8', errors='replace'))
+            if output_format is not None:
+                uploader = MinioStreamUploader(minio_client, bucket_name, object_name, process.stdout)
+                uploader.start()
             
             # Track progress
             progress_data = {
                 'time': '00:00:00.00',
                 'frame': 0,
                 'progress_percent': 0.0,
+                'expected_duration': expected_duration,
                 'status': 'processing'
             }
             
@@ -126,77 +209,118 @@ def process_ffmpeg_task(self, input_files: List[str], output_file: str,
                 state='PROGRESS',
                 meta={
                     'pid': process.pid,
-                    'progress': progress_data
+                    'progress': progress_data,
+                    'downloads': download_timings,
+                    'cpu': cpu_allocation.to_dict()
                 }
             )
             
-            # Process output in real-time to track progress
-            stderr_lines = []
+            # Process machine-readable progress in real-time
+            parser = FfmpegProgressParser(expected_duration)
             last_update_time = 0
             update_interval = 1.0  # Update progress at most once per second
-            duration = None
-            
-            import time
-            current_time = time.time()
-            
-            for line in iter(process.stderr.readline, ''):
-                stderr_lines.append(line)
-                # Parse progress information
-                progress_info, detected_duration = parse_ffmpeg_progress(line, duration)
-                
-                if duration is None and detected_duration is not None:
-                    duration = detected_duration
-                
-                # Update progress data if new information is available
-                if progress_info:
-                    progress_data.update(progress_info)
-                    
+
+            with progress_file:
+                for line in progress_file:
+                    snapshot = parser.feed(line)
+                    if snapshot is None:
+                        continue
+                    progress_data.update({key: value for key, value in snapshot.items() if value is not None})
+
                     # Limit how often we update the task state to avoid overwhelming Celery/Redis
+                    current_time = time.time()
                     if current_time - last_update_time >= update_interval:
-                        # Update task state with progress
                         self.update_state(
                             state='PROGRESS',
                             meta={
-                                'progress': progress_data
+                                'progress': progress_data,
+                                'downloads': download_timings,
+                                'cpu': cpu_allocation.to_dict()
                             }
                         )
                         logger.info(f"FFmpeg progress: {progress_data}")
                         last_update_time = current_time
-                
-                # Update current time for next iteration
-                current_time = time.time()
-            
-            # Join stderr lines for error reporting
-            stderr = '\n'.join(stderr_lines)
-                
+
+            ffmpeg_log.join()
+            stderr = ffmpeg_log.tail()
+
             # Wait for process to complete
             process.stderr.close()
-            process.stdout.close()
             returncode = process.wait()
+            encode_seconds = time.time() - encode_started
+            metrics.observe('ffmpeg_job_phase_seconds', encode_seconds, job='compose', phase='encode')
+            if uploader is not None:
+                # The upload runs alongside the encode; only the part trailing it is upload time
+                with metrics.time_phase('compose', 'upload'):
+                    uploader.join()
+
+            stream_errors = []
+            for streamer in streamers:
+                streamer.stop()
+                download_timings.append(streamer.timing())
+                if streamer.error:
+                    stream_errors.append(f"Streaming {streamer.url} failed: {streamer.error}")
+            metrics.inc('ffmpeg_input_bytes', sum(timing['bytes'] for timing in download_timings), job='compose')
+            if uploader is not None and (returncode != 0 or stream_errors):
+                # Don't leave a truncated object behind
+                try:
+                    minio_client.remove_object(bucket_name, object_name)
+                except Exception as remove_error:
+                    logger.error(f"Failed to remove partial object {object_name}: {str(remove_error)}")
+
+            if stream_errors and returncode == 0:
+                logger.error(f"FFmpeg finished on truncated streamed input: {stream_errors}")
+                result = {
+                    'success': False,
+                    'error': '\n'.join(stream_errors),
+                    'command': formatted_command,
+                    'return_code': returncode,
+                    'log_url': ffmpeg_log.publish(success=False),
+                }
+                return result
 
             if returncode != 0:
                 logger.error(f"FFmpeg command failed with return code {returncode}")
-                logger.error(f"Error output: {stderr}")
+                logger.error(f"Error output (last lines): {stderr}")
                 result = {
                     'success': False,
                     'error': stderr,
                     'command': formatted_command,
                     'return_code': returncode,
+                    'log_url': ffmpeg_log.publish(success=False),
                 }
                 return result
             
             # Upload the processed file to MinIO
-            object_name = os.path.basename(output_file)
             try:
-                minio_client.fput_object(bucket_name, object_name, output_file)
+                if uploader is not None:
+                    if uploader.error:
+                        raise RuntimeError(uploader.error)
+                    logger.info(f"Streamed {uploader.bytes} bytes to MinIO in {uploader.seconds}s")
+                    output_bytes = uploader.bytes
+                else:
+                    with metrics.time_phase('compose', 'upload'):
+                        minio_client.fput_object(bucket_name, object_name, output_file)
+                    output_bytes = os.path.getsize(output_file)
+                metrics.inc('ffmpeg_output_bytes', output_bytes, job='compose')
+                output_seconds = (progress_data.get('out_time_us') or 0) / 1_000_000 or expected_duration
+                if output_seconds and encode_seconds > 0:
+                    metrics.observe('ffmpeg_encode_speed_ratio', output_seconds / encode_seconds, job='compose')
                 minio_public_endpoint = os.environ.get('MINIO_PUBLIC_ENDPOINT', 'http://localhost:9000')
                 storage_url = f"{minio_public_endpoint}/{bucket_name}/{object_name}"
                 # storage_url = minio_client.presigned_get_object(bucket_name, object_name, expires=timedelta(days=365*10))
                 logger.info(f"File uploaded to MinIO: {storage_url}")
                 
-                # Remove local file after successful upload
-                os.remove(output_file)
-                logger.info(f"Local file removed: {output_file}")
+                if uploader is None:
+                    # Remove local file after successful upload
+                    os.remove(output_file)
+                    logger.info(f"Local file removed: {output_file}")
+
+                if render_fingerprint:
+                    try:
+                        render_cache.store(render_fingerprint, object_name)
+                    except Exception as cache_error:
+                        logger.error(f"Failed to store render {render_fingerprint} in cache: {str(cache_error)}")
                 
                 # Update progress to 100% for completed tasks
                 progress_data['progress_percent'] = 100.0
@@ -207,6 +331,10 @@ def process_ffmpeg_task(self, input_files: List[str], output_file: str,
                     'output_url': storage_url,
                     'command': formatted_command,
                     'message': 'FFmpeg processing and upload completed successfully',
+                    'downloads': download_timings,
+                    'render_fingerprint': render_fingerprint,
+                    'cpu': cpu_allocation.to_dict(),
+                    'log_url': ffmpeg_log.publish(success=True),
                     # 'progress': progress_data
                 }
                 return result
@@ -219,7 +347,8 @@ def process_ffmpeg_task(self, input_files: List[str], output_file: str,
                     'success': False,
                     'error': f"Failed to upload file: {str(upload_error)}",
                     'command': formatted_command,
-                    'progress': progress_data
+                    'progress': progress_data,
+                    'log_url': ffmpeg_log.publish(success=False),
                 }
                 return result
         
@@ -241,7 +370,8 @@ def process_ffmpeg_task(self, input_files: List[str], output_file: str,
                 'success': False,
                 'error': error_msg,
                 'command': format_command_for_display(command) if command else 'Command not built',
-                'progress': progress_data
+                'progress': progress_data,
+                'log_url': ffmpeg_log.publish(success=False) if ffmpeg_log is not None else None,
             }
             return result
         
@@ -253,6 +383,21 @@ def process_ffmpeg_task(self, input_files: List[str], output_file: str,
                         logger.info(f"Process {process.pid} terminated in finally block")
                 except Exception as term_error:
                     logger.error(f"Error terminating process: {term_error}")
+            if ffmpeg_log is not None:
+                ffmpeg_log.close()
+            if progress_file is not None:
+                progress_file.close()
+
+            if cpu_allocation is not None:
+                try:
+                    cpu_scheduler.release(self.request.id)
+                except OSError as release_error:
+                    logger.error(f"Failed to release CPU allocation: {str(release_error)}")
+
+            for streamer in streamers:
+                streamer.stop()
+            if uploader is not None:
+                uploader.join(30)
             
             if webhook_url:
                 task_result_data = {
@@ -261,13 +406,8 @@ def process_ffmpeg_task(self, input_files: List[str], output_file: str,
                     'result': result
                 }
                 
-                try:
-                    logger.info(f"Sending webhook notification to {webhook_url} for task {self.request.id}")
-                    response = requests.post(webhook_url, json=task_result_data, timeout=10) # Added timeout
-                    response.raise_for_status() # Raise an exception for HTTP errors (4xx or 5xx)
-                    logger.info(f"Webhook notification sent successfully to {webhook_url} for task {self.request.id}. Status: {response.status_code}")
-                except requests.exceptions.RequestException as e:
-                    logger.error(f"Failed to send webhook notification to {webhook_url} for task {self.request.id}: {str(e)}")
-                except Exception as e:
-                    logger.error(f"An unexpected error occurred while sending webhook to {webhook_url} for task {self.request.id}: {str(e)}")
+                # Delivered by the webhook workers, so a slow receiver doesn't hold this render slot
+                from webhook_tasks import queue_webhook
+                with metrics.time_phase('compose', 'webhook'):
+                    queue_webhook(webhook_url, task_result_data, self.request.id)
 
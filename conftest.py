@@ -0,0 +1,36 @@
+"""Unit test setup
+
+The app modules connect to MinIO and Redis when they are imported. Tests run
+against the in-memory S3 stand-in from benchmark_standins.py, an in-memory
+Celery broker and a Redis URL that refuses connections at once, so no
+external service is needed.
+"""
+import os
+import tempfile
+
+from benchmark_standins import S3StandIn
+
+# End-to-end scripts that drive a running API on localhost:5200
+collect_ignore = ["test_api.py", "test_api_webhook.py"]
+
+_work_dir = tempfile.mkdtemp(prefix="ffmpeg-compose-tests-")
+_s3 = S3StandIn()
+_s3.start()
+
+os.environ.update({
+    "CELERY_BROKER_URL": "memory://",
+    "CELERY_RESULT_BACKEND": "cache+memory://",
+    "APP_REDIS_URL": "redis://127.0.0.1:1/0",
+    "PROBE_CACHE_REDIS_URL": "",
+    "METRICS_ENABLED": "False",
+    "MINIO_ENDPOINT": _s3.address,
+    "MINIO_PUBLIC_ENDPOINT": f"http://{_s3.address}",
+    "MINIO_SECURE": "False",
+    "INPUT_CACHE_DIR": os.path.join(_work_dir, "input-cache"),
+    "CPU_LEDGER_PATH": os.path.join(_work_dir, "cpu-ledger.json"),
+    "BACKGROUND_LIBRARY_DIR": os.path.join(_work_dir, "backgrounds"),
+})
+
+
+def pytest_unconfigure(config):
+    _s3.stop()
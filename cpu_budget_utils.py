@@ -0,0 +1,231 @@
+import os
+import json
+import math
+import fcntl
+import shlex
+import logging
+import tempfile
+
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from typing import List, Dict, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Cores FFmpeg jobs may use in total on this worker; detected from the cgroup quota and CPU affinity when unset
+FFMPEG_CPU_BUDGET = os.environ.get('FFMPEG_CPU_BUDGET')
+# Pin each running FFmpeg to its share of the CPUs, re-pinning as jobs start and finish. Off by
+# default: each container has its own ledger, so containers sharing a host would pin onto the same cores
+FFMPEG_CPU_PINNING = os.environ.get('FFMPEG_CPU_PINNING', 'False').lower() == 'true'
+# Jobs running on this host and their allocations, shared by all worker processes
+CPU_LEDGER_PATH = os.environ.get('CPU_LEDGER_PATH', os.path.join(tempfile.gettempdir(), 'ffmpeg-cpu-ledger.json'))
+
+_CGROUP_ROOT = '/sys/fs/cgroup'
+
+
+def cgroup_cpu_quota(root: str = _CGROUP_ROOT) -> Optional[float]:
+    """CPUs allowed by the cgroup CFS quota, None when unlimited or unknown
+
+    Reads cpu.max on cgroup v2 and cpu.cfs_quota_us/cpu.cfs_period_us on v1.
+    """
+    try:
+        with open(os.path.join(root, 'cpu.max')) as f:
+            quota, period = f.read().split()[:2]
+        return None if quota == 'max' else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    for directory in ('cpu', 'cpu,cpuacct', 'cpuacct,cpu'):
+        try:
+            with open(os.path.join(root, directory, 'cpu.cfs_quota_us')) as f:
+                quota = int(f.read())
+            with open(os.path.join(root, directory, 'cpu.cfs_period_us')) as f:
+                period = int(f.read())
+        except (OSError, ValueError):
+            continue
+        return None if quota <= 0 else quota / period
+    return None
+
+
+def allowed_cpus() -> List[int]:
+    """CPUs this process may run on"""
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count() or 1))
+
+
+def detect_cpu_budget() -> int:
+    """Whole cores available to FFmpeg: FFMPEG_CPU_BUDGET, else the smaller of the quota and the affinity mask"""
+    if FFMPEG_CPU_BUDGET:
+        return max(1, int(float(FFMPEG_CPU_BUDGET)))
+    budget = len(allowed_cpus())
+    quota = cgroup_cpu_quota()
+    if quota is not None:
+        budget = min(budget, math.ceil(quota))
+    return max(1, budget)
+
+
+def split_evenly(total: int, parts: int) -> List[int]:
+    """``total`` split into ``parts`` integers differing by at most one, each at least 1"""
+    if parts <= 0:
+        return []
+    base, extra = divmod(total, parts)
+    return [max(1, base + (1 if index < extra else 0)) for index in range(parts)]
+
+
+def apply_thread_options(options: Dict[str, Any], global_options: List[str],
+                         threads: int) -> Tuple[Dict[str, Any], List[str]]:
+    """Copies of ``options`` and ``global_options`` with FFmpeg thread counts set to ``threads``
+
+    Sets the encoder/decoder ``-threads`` and the ``-filter_threads`` and
+    ``-filter_complex_threads`` globals, leaving any the job already sets alone.
+    """
+    options = dict(options)
+    options.setdefault('threads', threads)
+    global_args = [arg for opt in global_options for arg in shlex.split(opt)]
+    global_options = list(global_options)
+    for flag in ('-filter_threads', '-filter_complex_threads'):
+        if flag not in global_args:
+            global_options.append(f"{flag} {threads}")
+    return options, global_options
+
+
+@dataclass
+class CpuAllocation:
+    job_id: str
+    threads: int
+    budget: int
+    concurrent_jobs: int
+    cpus: Optional[List[int]] = None
+
+    def apply(self, options: Dict[str, Any], global_options: List[str]) -> Tuple[Dict[str, Any], List[str]]:
+        return apply_thread_options(options, global_options, self.threads)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class CpuScheduler:
+    """Divides the worker's CPU budget between the FFmpeg jobs running on it
+
+    Worker processes share a ledger file, locked with flock, listing the jobs
+    in flight. A starting job gets an even share of the budget as its FFmpeg
+    thread count. FFmpeg can't change thread counts once running, so with
+    pinning enabled every running FFmpeg is also pinned to a CPU slice matching
+    its current share, and the slices are recomputed whenever a job starts or
+    finishes. Entries of worker processes that died are dropped on the next
+    ledger access.
+    """
+
+    def __init__(self, ledger_path: str, budget: Optional[int] = None, pinning: bool = True):
+        self.ledger_path = ledger_path
+        self.budget = budget or detect_cpu_budget()
+        self.pinning = pinning
+        self.cpus = allowed_cpus()
+
+    @contextmanager
+    def _ledger(self):
+        with open(self.ledger_path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    jobs = json.loads(f.read() or '{}')
+                except ValueError:
+                    jobs = {}
+                jobs = {job_id: job for job_id, job in jobs.items() if _pid_alive(job['pid'])}
+                yield jobs
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(jobs))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _slices(self, job_ids: List[str]) -> Dict[str, List[int]]:
+        """Contiguous CPU slices of the budget in proportion to each job's even share"""
+        # A quota smaller than the affinity mask confines the jobs to that many cores
+        cpus = self.cpus[:self.budget]
+        slices = {}
+        start = 0
+        for job_id, share in zip(job_ids, split_evenly(len(cpus), len(job_ids))):
+            slices[job_id] = [cpus[(start + offset) % len(cpus)] for offset in range(share)]
+            start += share
+        return slices
+
+    def _rebalance(self, jobs: Dict[str, Dict[str, Any]]):
+        if not self.pinning or not jobs:
+            return
+        job_ids = sorted(jobs, key=lambda job_id: jobs[job_id]['started_at'])
+        for job_id, cpus in self._slices(job_ids).items():
+            jobs[job_id]['cpus'] = cpus
+            if jobs[job_id].get('ffmpeg_pid'):
+                _pin(jobs[job_id]['ffmpeg_pid'], cpus)
+
+    def acquire(self, job_id: str) -> CpuAllocation:
+        with self._ledger() as jobs:
+            threads = split_evenly(self.budget, len(jobs) + 1)[-1]
+            jobs[job_id] = {'pid': os.getpid(), 'ffmpeg_pid': None, 'threads': threads,
+                            'started_at': _ledger_clock(jobs), 'cpus': None}
+            self._rebalance(jobs)
+            allocation = CpuAllocation(job_id, threads, self.budget, len(jobs), jobs[job_id]['cpus'])
+        logger.info(f"Job {job_id} allocated {threads} of {self.budget} cores ({allocation.concurrent_jobs} jobs running)")
+        return allocation
+
+    def attach(self, job_id: str, ffmpeg_pid: int):
+        """Record the FFmpeg process of a job so it can be pinned and re-pinned"""
+        with self._ledger() as jobs:
+            job = jobs.get(job_id)
+            if job is None:
+                return
+            job['ffmpeg_pid'] = ffmpeg_pid
+            if self.pinning and job.get('cpus'):
+                _pin(ffmpeg_pid, job['cpus'])
+
+    def release(self, job_id: str):
+        with self._ledger() as jobs:
+            if jobs.pop(job_id, None) is not None:
+                self._rebalance(jobs)
+
+    @contextmanager
+    def allocate(self, job_id: str):
+        allocation = self.acquire(job_id)
+        try:
+            yield allocation
+        finally:
+            try:
+                self.release(job_id)
+            except OSError as e:
+                logger.error(f"Could not release CPU allocation of job {job_id}: {str(e)}")
+
+
+def _ledger_clock(jobs: Dict[str, Dict[str, Any]]) -> int:
+    """Start order of a new job, monotonic within the ledger"""
+    return max((job['started_at'] for job in jobs.values()), default=0) + 1
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _pin(pid: int, cpus: List[int]):
+    """Set the affinity of every thread of ``pid``; threads created later inherit it from the main thread"""
+    try:
+        thread_ids = [int(tid) for tid in os.listdir(f"/proc/{pid}/task")]
+    except OSError:
+        thread_ids = [pid]
+    for tid in thread_ids:
+        try:
+            os.sched_setaffinity(tid, cpus)
+        except (OSError, AttributeError):
+            # The thread or process exited in the meantime
+            pass
+
+
+cpu_scheduler = CpuScheduler(CPU_LEDGER_PATH, pinning=FFMPEG_CPU_PINNING)
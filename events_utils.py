@@ -0,0 +1,136 @@
+import json
+import time
+import asyncio
+import logging
+import redis
+import redis.asyncio as aioredis
+
+from typing import Dict, Any, Optional, Set
+from celery import Task, states
+from celery.signals import task_postrun
+
+from redis_utils import redis_client, redis_url
+
+logger = logging.getLogger(__name__)
+
+TASK_EVENTS_CHANNEL = 'task_events:{}'
+TASK_LAST_EVENT_KEY = 'task_events:last:{}'
+TASK_LAST_EVENT_TTL = 24 * 3600
+SUBSCRIBER_QUEUE_SIZE = 100
+# Seconds subscribe() waits for the pattern subscription before giving up on it
+SUBSCRIBE_TIMEOUT = 5
+
+
+def publish_task_event(task_id: str, state: str, meta: Any):
+    """Publish a task state change and keep it as the task's last event for replay"""
+    event = json.dumps({
+        'task_id': task_id,
+        'state': state,
+        'meta': meta,
+        'timestamp': time.time(),
+    }, default=str)
+    try:
+        pipe = redis_client.pipeline()
+        pipe.set(TASK_LAST_EVENT_KEY.format(task_id), event, ex=TASK_LAST_EVENT_TTL)
+        pipe.publish(TASK_EVENTS_CHANNEL.format(task_id), event)
+        pipe.execute()
+    except redis.exceptions.RedisError as e:
+        logger.warning(f"Failed to publish event for task {task_id}: {str(e)}")
+
+
+class EventTask(Task):
+    """Task base class that publishes every update_state call as a task event"""
+
+    def update_state(self, task_id=None, state=None, meta=None, **kwargs):
+        super().update_state(task_id=task_id, state=state, meta=meta, **kwargs)
+        publish_task_event(task_id or self.request.id, state, meta)
+
+
+@task_postrun.connect
+def publish_final_state(task_id=None, retval=None, state=None, **kwargs):
+    if state in states.READY_STATES:
+        publish_task_event(task_id, state, retval if state == states.SUCCESS else str(retval))
+
+
+class TaskEventHub:
+    """Fans task events out to any number of in-process subscribers
+
+    One pattern subscription per API process receives every task event; each
+    subscriber gets its own bounded queue for the task it follows. Slow
+    subscribers lose their oldest events rather than blocking the others.
+    """
+
+    def __init__(self, url: str):
+        self._url = url
+        self._redis = None
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._listener: Optional[asyncio.Task] = None
+        # Set while the pattern subscription is active
+        self._subscribed = asyncio.Event()
+
+    def _client(self):
+        if self._redis is None:
+            self._redis = aioredis.from_url(self._url)
+        return self._redis
+
+    async def subscribe(self, task_id: str) -> asyncio.Queue:
+        """Register a queue for the task's events
+
+        Returns once the pattern subscription is active, so anything published
+        afterwards reaches the queue. If Redis doesn't answer within
+        SUBSCRIBE_TIMEOUT the queue is returned anyway; callers fall back to
+        polling last_event().
+        """
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.setdefault(task_id, set()).add(queue)
+        try:
+            await asyncio.wait_for(self._subscribed.wait(), timeout=SUBSCRIBE_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"Task event subscription not ready, events for {task_id} may only arrive by polling")
+        return queue
+
+    def unsubscribe(self, task_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(task_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[task_id]
+
+    async def last_event(self, task_id: str) -> Optional[Dict[str, Any]]:
+        raw = await self._client().get(TASK_LAST_EVENT_KEY.format(task_id))
+        return json.loads(raw) if raw else None
+
+    async def _listen(self):
+        prefix = TASK_EVENTS_CHANNEL.format('')
+        while True:
+            pubsub = self._client().pubsub()
+            try:
+                await pubsub.psubscribe(TASK_EVENTS_CHANNEL.format('*'))
+                self._subscribed.set()
+                async for message in pubsub.listen():
+                    if message['type'] != 'pmessage':
+                        continue
+                    task_id = message['channel'].decode('utf-8')[len(prefix):]
+                    queues = self._subscribers.get(task_id)
+                    if not queues:
+                        continue
+                    event = json.loads(message['data'])
+                    for queue in list(queues):
+                        if queue.full():
+                            queue.get_nowait()
+                        queue.put_nowait(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Task event listener failed, reconnecting: {str(e)}")
+                await asyncio.sleep(1)
+            finally:
+                # Events published until the next psubscribe are missed; subscribers re-read last_event
+                self._subscribed.clear()
+                await pubsub.aclose()
+
+
+task_event_hub = TaskEventHub(redis_url)
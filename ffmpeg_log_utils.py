@@ -0,0 +1,107 @@
+import os
+import gzip
+import logging
+import threading
+
+from collections import deque
+from typing import IO, Optional
+
+from minioclient_utils import minio_client, bucket_name, minio_public_endpoint
+
+logger = logging.getLogger(__name__)
+
+# Last stderr lines kept in memory and returned in results and webhooks
+FFMPEG_LOG_TAIL_LINES = int(os.environ.get('FFMPEG_LOG_TAIL_LINES', '50'))
+# When the full log is uploaded: always, failure or never
+FFMPEG_LOG_UPLOAD = os.environ.get('FFMPEG_LOG_UPLOAD', 'failure').lower()
+# Uncompressed bytes written to the full log before the rest is dropped
+FFMPEG_LOG_MAX_BYTES = int(os.environ.get('FFMPEG_LOG_MAX_BYTES', str(256 * 1024 * 1024)))
+FFMPEG_LOG_PREFIX = os.environ.get('FFMPEG_LOG_PREFIX', 'logs/')
+
+# Longer lines (a dumped filtergraph, say) are cut in the tail
+_TAIL_LINE_CHARS = 2000
+
+
+class FfmpegLog:
+    """FFmpeg's stderr: the last lines in memory, the whole log gzip-compressed on disk
+
+    Memory stays bounded however long or verbose the job is. The compressed
+    log is uploaded to MinIO by publish(), depending on FFMPEG_LOG_UPLOAD.
+    """
+
+    def __init__(self, directory: str, name: str, tail_lines: int = FFMPEG_LOG_TAIL_LINES,
+                 max_bytes: int = FFMPEG_LOG_MAX_BYTES):
+        self.name = name
+        self.path = os.path.join(directory, f"{name}.log.gz")
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.truncated = False
+        self.url: Optional[str] = None
+        self._tail = deque(maxlen=tail_lines)
+        self._file = gzip.open(self.path, 'wt', encoding='utf-8')
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def write(self, line: str):
+        self._tail.append(line if len(line) <= _TAIL_LINE_CHARS else line[:_TAIL_LINE_CHARS] + '...\n')
+        with self._lock:
+            # Closed early when a failed job publishes while FFmpeg is still being stopped
+            if self.truncated or self._file.closed:
+                return
+            if self.bytes + len(line) > self.max_bytes:
+                self.truncated = True
+                self._file.write(f"[log truncated after {self.bytes} bytes]\n")
+                return
+            self._file.write(line)
+            self.bytes += len(line)
+
+    def drain(self, stream: IO[str]) -> threading.Thread:
+        """Consume ``stream`` line by line on a background thread"""
+        def run():
+            for line in iter(stream.readline, ''):
+                self.write(line)
+
+        self._thread = threading.Thread(target=run, name="FfmpegStderr", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def join(self, timeout: Optional[float] = None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def tail(self) -> str:
+        return ''.join(self._tail)
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def remove(self):
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def publish(self, success: bool) -> Optional[str]:
+        """Upload the full log if FFMPEG_LOG_UPLOAD asks for it and return its URL
+
+        Upload errors are logged, not raised; the tail is still available.
+        """
+        if self.url is not None:
+            return self.url
+        if FFMPEG_LOG_UPLOAD == 'never' or (FFMPEG_LOG_UPLOAD == 'failure' and success):
+            return None
+        self.close()
+        object_name = f"{FFMPEG_LOG_PREFIX}{self.name}.log.gz"
+        try:
+            # Served with Content-Encoding so browsers and curl --compressed show plain text
+            minio_client.fput_object(bucket_name, object_name, self.path, content_type='text/plain; charset=utf-8',
+                                     metadata={'Content-Encoding': 'gzip'})
+        except Exception as e:
+            logger.error(f"Failed to upload FFmpeg log {object_name}: {str(e)}")
+            return None
+        self.url = f"{minio_public_endpoint}/{bucket_name}/{object_name}"
+        logger.info(f"FFmpeg log uploaded to {self.url}")
+        return self.url
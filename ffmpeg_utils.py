@@ -1,18 +1,34 @@
 import time
 import threading
-import tempfile
 from urllib import request
 import requests
 import subprocess
 import shlex
 import os
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 
+from input_cache_utils import input_cache
+from probe_utils import probe_media
+from progress_utils import FfmpegProgressParser, progress_monitor
 from typing import List, Dict, Any, Optional, Union, Tuple
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Download concurrency limits. The per-worker limit is shared by every job
+# running in this process, the per-job limit caps a single composition.
+DOWNLOAD_CONCURRENCY_PER_WORKER = int(os.environ.get('DOWNLOAD_CONCURRENCY_PER_WORKER', '8'))
+DOWNLOAD_CONCURRENCY_PER_JOB = int(os.environ.get('DOWNLOAD_CONCURRENCY_PER_JOB', '4'))
+_download_slots = threading.BoundedSemaphore(DOWNLOAD_CONCURRENCY_PER_WORKER)
+
+# Shared pooled session so repeated downloads from the same host reuse connections
+http_session = requests.Session()
+_http_adapter = HTTPAdapter(pool_connections=DOWNLOAD_CONCURRENCY_PER_WORKER, pool_maxsize=DOWNLOAD_CONCURRENCY_PER_WORKER)
+http_session.mount('http://', _http_adapter)
+http_session.mount('https://', _http_adapter)
+
 
 def validate_ffmpeg_installed() -> bool:
     """Check if FFmpeg is installed and available in the system PATH"""
@@ -52,10 +68,6 @@ def build_ffmpeg_command(input_files: List[str],
     if global_options:
         for opt in global_options:
             command.extend(shlex.split(opt))
-                
-    import multiprocessing
-    num_threads = multiprocessing.cpu_count()
-    global_options.extend(["-filter_complex_threads", str(num_threads)])
     
     # Add input files
     for input_file in input_files:
@@ -95,7 +107,12 @@ def download_remote_file_to_temp(url: str, temp_dir: str) -> str:
 
     logger.info(f"Downloading {url} to {local_path}...")
     try:
-        with requests.get(url, stream=True) as r:
+        if input_cache is not None:
+            input_cache.fetch(url, local_path, session=http_session)
+            logger.info(f"Download complete. Input cache stats: {input_cache.stats()}")
+            return local_path
+
+        with http_session.get(url, stream=True) as r:
             r.raise_for_status()
             with open(local_path, 'wb') as f:
                 for chunk in r.iter_content(chunk_size=8192):
@@ -107,6 +124,67 @@ def download_remote_file_to_temp(url: str, temp_dir: str) -> str:
         raise
 
 
+def is_remote_url(path_or_url: str) -> bool:
+    return path_or_url.startswith(('http://', 'https://'))
+
+
+def download_remote_inputs(input_files: List[Union[str, List[str]]], temp_dir: str,
+                           max_workers: Optional[int] = None) -> Tuple[List[Union[str, List[str]]], List[Dict[str, Any]]]:
+    """Download every remote input concurrently
+
+    Each input gets its own subdirectory of ``temp_dir`` so inputs sharing a
+    basename don't overwrite each other.
+
+    Args:
+        input_files: Input items as accepted by build_ffmpeg_command
+        temp_dir: Directory to download into
+        max_workers: Per-job concurrency, defaults to DOWNLOAD_CONCURRENCY_PER_JOB
+
+    Returns:
+        Tuple of the input items with remote URLs replaced by local paths, and
+        a list of per-input download timings
+    """
+    remote = []
+    for index, item in enumerate(input_files):
+        path_or_url = item[-1] if isinstance(item, list) else item
+        if is_remote_url(path_or_url):
+            remote.append((index, path_or_url))
+
+    local_input_files = list(input_files)
+    if not remote:
+        return local_input_files, []
+
+    def download(index: int, url: str) -> Dict[str, Any]:
+        input_dir = os.path.join(temp_dir, str(index))
+        os.makedirs(input_dir, exist_ok=True)
+        with _download_slots:
+            started = time.time()
+            local_path = download_remote_file_to_temp(url, input_dir)
+            elapsed = time.time() - started
+        return {
+            'index': index,
+            'url': url,
+            'local_path': local_path,
+            'bytes': os.path.getsize(local_path),
+            'seconds': round(elapsed, 3),
+        }
+
+    workers = max(1, min(max_workers or DOWNLOAD_CONCURRENCY_PER_JOB, len(remote)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="download") as executor:
+        futures = [executor.submit(download, index, url) for index, url in remote]
+        timings = [future.result() for future in futures]
+
+    for timing in timings:
+        item = input_files[timing['index']]
+        if isinstance(item, list):
+            local_input_files[timing['index']] = item[:-1] + [timing['local_path']]
+        else:
+            local_input_files[timing['index']] = timing['local_path']
+        del timing['local_path']
+
+    return local_input_files, timings
+
+
 def format_command_for_display(command: List[str]) -> str:
     """Format a command list into a readable string for display"""
     formatted_cmd = []
@@ -120,148 +198,50 @@ def format_command_for_display(command: List[str]) -> str:
     return ' '.join(formatted_cmd)
 
 
-def parse_ffmpeg_progress(stderr_line: str, detected_duration: Optional[float] = None) -> Tuple[Optional[Dict[str, Any]], Optional[float]]:
-    """Parse FFmpeg progress information from stderr output
-    Extracts time, frame, and calculates progress percentage from FFmpeg stderr output.
-    Args:
-        stderr_line: A line of FFmpeg stderr output
-    Returns:
-        Dictionary with progress information or None if no progress info found
-    """
-
-    # Try to detect the duration from FFmpeg output
-    if 'Duration:' in stderr_line and detected_duration is None:
-        try:
-            duration_str = stderr_line.split('Duration:')[1].split(',')[0].strip()
-            duration_parts = duration_str.split(':')
-            if len(duration_parts) == 3:
-                hours, minutes, seconds = duration_parts
-                # Handle seconds with milliseconds
-                if '.' in seconds:
-                    seconds, ms = seconds.split('.')
-                    detected_duration = (int(hours) * 3600) + (int(minutes) * 60) + int(seconds) + (int(ms) / 100)
-                else:
-                    detected_duration = (int(hours) * 3600) + (int(minutes) * 60) + int(seconds)
-                logger.info(f"Detected video duration: {detected_duration} seconds")
-                return None, detected_duration
-        except (IndexError, ValueError):
-            pass
-    
-    if 'time=' in stderr_line:
-        try:
-            # Extract time information
-            time_str = stderr_line.split('time=')[1].split(' ')[0]
-            
-            # Calculate progress percentage based on time
-            # Convert time string (HH:MM:SS.MS) to seconds for calculation
-            time_parts = time_str.split(':')
-            if len(time_parts) == 3:
-                hours, minutes, seconds = time_parts
-                # Handle seconds with milliseconds
-                if '.' in seconds:
-                    seconds, ms = seconds.split('.')
-                    total_seconds = (int(hours) * 3600) + (int(minutes) * 60) + int(seconds) + (int(ms) / 100)
-                else:
-                    total_seconds = (int(hours) * 3600) + (int(minutes) * 60) + int(seconds)
-                
-                # Calculate progress percentage using detected duration if available
-                if detected_duration and detected_duration > 0:
-                    progress_percent = min(100.0, (total_seconds / detected_duration) * 100)
-                else:
-                    # Fallback to a reasonable estimate if duration is unknown
-                    max_duration = 300  # 5 minutes in seconds as a reasonable fallback
-                    progress_percent = min(100.0, (total_seconds / max_duration) * 100)
-                
-                # Ensure we're not stuck at 0% by setting a minimum progress value
-                # once we have time information
-                if progress_percent < 0.1 and total_seconds > 0:
-                    progress_percent = 0.1
-            else:
-                progress_percent = 0.0
-            
-            # Extract frame information if available
-            frame = None
-            if 'frame=' in stderr_line:
-                frame_str = stderr_line.split('frame=')[1].split(' ')[0].strip()
-                try:
-                    frame = int(frame_str)
-                    # Use frame count as an additional progress indicator
-                    if frame > 0 and progress_percent == 0.0:
-                        progress_percent = 0.01  # At least show some progress if frames are being processed
-                except ValueError:
-                    pass
-            
-            # Extract speed information if available
-            speed = None
-            if 'speed=' in stderr_line:
-                speed_str = stderr_line.split('speed=')[1].split(' ')[0]
-                speed = speed_str
-            
-            return {
-                'time': time_str,
-                'frame': frame,
-                'speed': speed,
-                'progress_percent': round(progress_percent, 2)
-            }, detected_duration
-        except (IndexError, ValueError):
-            pass
-    
-    return None, detected_duration
+class ProgressFfmpeg:
+    """Report the progress of one ffmpeg run through the per-process progress monitor
 
+    Pass ``progress_arg`` to ffmpeg's ``-progress`` option and ``pass_fds`` to
+    ``subprocess.Popen``, then call ``child_started`` once the process is up.
+    The callback receives the completed fraction of ``vid_duration_seconds``.
+    """
 
-class ProgressFfmpeg(threading.Thread):
     def __init__(self, vid_duration_seconds, progress_update_callback):
-        threading.Thread.__init__(self, name="ProgressFfmpeg")
-        self.stop_event = threading.Event()
-        self.output_file = tempfile.NamedTemporaryFile(mode="w+", delete=False)
         self.vid_duration_seconds = vid_duration_seconds
         self.progress_update_callback = progress_update_callback
+        self.read_fd, self.write_fd = os.pipe()
+        self.parser = FfmpegProgressParser(vid_duration_seconds)
 
-    def run(self):
-        while not self.stop_event.is_set():
-            latest_progress = self.get_latest_ms_progress()
-            if latest_progress is not None:
-                completed_percent = latest_progress / self.vid_duration_seconds
-                self.progress_update_callback(completed_percent)
-            time.sleep(1)
-
-    def get_latest_ms_progress(self):
-        lines = self.output_file.readlines()
-
-        if lines:
-            for line in lines:
-                if "out_time_ms" in line:
-                    out_time_ms_str = line.split("=")[1].strip()
-                    if out_time_ms_str.isnumeric():
-                        return float(out_time_ms_str) / 1000000.0
-                    else:
-                        # Handle the case when "N/A" is encountered
-                        return None
-        return None
+    @property
+    def progress_arg(self) -> str:
+        return f"pipe:{self.write_fd}"
 
-    def stop(self):
-        self.stop_event.set()
+    @property
+    def pass_fds(self) -> Tuple[int]:
+        return (self.write_fd,)
+
+    def child_started(self):
+        """Close the parent's copy of the write end so EOF arrives when ffmpeg exits"""
+        if self.write_fd is not None:
+            os.close(self.write_fd)
+            self.write_fd = None
+
+    def _on_progress(self, snapshot: Dict[str, Any]):
+        if snapshot['out_time_us'] is not None:
+            self.progress_update_callback(snapshot['out_time_us'] / 1_000_000 / self.vid_duration_seconds)
 
     def __enter__(self):
-        self.start()
+        self._handle = progress_monitor.register(self.read_fd, self.parser, self._on_progress)
         return self
 
     def __exit__(self, *args, **kwargs):
-        self.stop()
+        self.child_started()
+        progress_monitor.unregister(self.read_fd, self._handle)
 
 
 def get_media_duration_seconds(video_url):
     try:
-        cmd = [
-            "ffprobe",
-            "-v", "error",
-            # "-select_streams", "v:0",
-            "-show_entries", "stream=duration",
-            "-of", "default=noprint_wrappers=1:nokey=1",
-            video_url
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        return float(result.stdout.strip())
+        return probe_media(video_url).stream_duration('video')
     except subprocess.CalledProcessError as e:
         logger.error(f"Error getting video duration: {e}")
-        return None
\ No newline at end of file
+        return None
@@ -1,5 +1,54 @@
+import os
+import re
+import time
+import hashlib
+import logging
+import threading
+import subprocess
+
+from functools import lru_cache
+from dataclasses import dataclass, field, asdict
+from typing import List, Dict, Any, Optional
+from PIL import ImageFont as PILImageFont
 from PIL.ImageFont import FreeTypeFont, ImageFont
 
+logger = logging.getLogger(__name__)
+
+FONTS_DIR = os.environ.get('FONTS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fonts'))
+DEFAULT_FONT = 'Roboto-Bold.ttf'
+# Directories watched for changes besides FONTS_DIR; fontconfig is re-read when one changes
+FONTCONFIG_DIRS = [d for d in os.environ.get('FONTCONFIG_DIRS', '/usr/share/fonts:/usr/local/share/fonts').split(':') if d]
+# Seconds between directory mtime checks
+FONT_REGISTRY_CHECK_INTERVAL = float(os.environ.get('FONT_REGISTRY_CHECK_INTERVAL', '5'))
+# Loaded FreeTypeFont objects kept per process, keyed by (path, size)
+FONT_CACHE_SIZE = int(os.environ.get('FONT_CACHE_SIZE', '64'))
+
+_FONT_EXTENSIONS = ('.ttf', '.otf', '.ttc')
+
+# One representative character per script, compared against the font's missing-glyph rendering
+_SCRIPT_SAMPLES = {
+    'Latin': 'A',
+    'Cyrillic': 'Ж',
+    'Greek': 'Ω',
+    'Devanagari': 'क',
+    'Bengali': 'ক',
+    'Arabic': 'ب',
+    'Hebrew': 'א',
+    'Thai': 'ก',
+    'Han': '中',
+    'Hiragana': 'あ',
+    'Hangul': '한',
+}
+_MISSING_GLYPH = '\U0010FFFD'
+
+# fontconfig language codes mapped to the scripts above
+_LANG_SCRIPTS = {
+    'en': 'Latin', 'ru': 'Cyrillic', 'el': 'Greek', 'hi': 'Devanagari', 'mr': 'Devanagari', 'ne': 'Devanagari',
+    'bn': 'Bengali', 'ar': 'Arabic', 'fa': 'Arabic', 'ur': 'Arabic', 'he': 'Hebrew', 'th': 'Thai',
+    'zh-cn': 'Han', 'zh-tw': 'Han', 'ja': 'Hiragana', 'ko': 'Hangul',
+}
+
+
 def getsize(font: ImageFont | FreeTypeFont, text: str):
     left, top, right, bottom = font.getbbox(text)
     width = right - left
@@ -9,3 +58,245 @@ def getsize(font: ImageFont | FreeTypeFont, text: str):
 def getheight(font: ImageFont | FreeTypeFont, text: str):
     _, height = getsize(font, text)
     return height
+
+
+@dataclass
+class FontEntry:
+    family: str
+    style: str
+    path: str
+    source: str
+    scripts: List[str] = field(default_factory=list)
+
+    @property
+    def file_name(self) -> str:
+        return os.path.basename(self.path)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {**asdict(self), 'file_name': self.file_name}
+
+
+def detect_scripts(path: str) -> List[str]:
+    """Scripts the font has glyphs for, found by comparing sample characters against its missing-glyph box"""
+    try:
+        font = PILImageFont.truetype(path, 32)
+        missing = bytes(font.getmask(_MISSING_GLYPH))
+        return [script for script, sample in _SCRIPT_SAMPLES.items() if bytes(font.getmask(sample)) != missing]
+    except OSError as e:
+        logger.warning(f"Could not inspect font {path}: {str(e)}")
+        return []
+
+
+def scan_font_dir(directory: str) -> List[FontEntry]:
+    entries = []
+    if not os.path.isdir(directory):
+        return entries
+    for name in sorted(os.listdir(directory)):
+        if not name.lower().endswith(_FONT_EXTENSIONS):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            family, style = PILImageFont.truetype(path, 12).getname()
+        except OSError as e:
+            logger.warning(f"Skipping unreadable font {path}: {str(e)}")
+            continue
+        entries.append(FontEntry(family=family, style=style or 'Regular', path=path, source='fonts', scripts=detect_scripts(path)))
+    return entries
+
+
+def list_fontconfig_fonts() -> List[FontEntry]:
+    """Fonts known to fontconfig, with scripts derived from their language coverage"""
+    try:
+        result = subprocess.run(
+            ['fc-list', '--format', '%{family[0]}\t%{style[0]}\t%{file}\t%{lang}\n'],
+            capture_output=True, text=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError) as e:
+        logger.warning(f"fontconfig unavailable, using {FONTS_DIR} only: {str(e)}")
+        return []
+
+    entries = []
+    for line in result.stdout.splitlines():
+        parts = line.split('\t')
+        if len(parts) != 4 or not parts[0]:
+            continue
+        family, style, path, langs = parts
+        scripts = sorted({_LANG_SCRIPTS[lang] for lang in langs.split('|') if lang in _LANG_SCRIPTS})
+        entries.append(FontEntry(family=family, style=style or 'Regular', path=path, source='fontconfig', scripts=scripts))
+    return entries
+
+
+def _key(value: str) -> str:
+    return re.sub(r'[\s_-]+', ' ', value).strip().lower()
+
+
+class FontRegistry:
+    """Index of the fonts available for rendering, built from FONTS_DIR and fontconfig
+
+    Fonts resolve by file name, file stem, "Family Style" or family (preferring
+    the regular style) with a dictionary lookup. The index is rebuilt when the
+    modification time of one of the font directories changes; the check runs
+    at most every FONT_REGISTRY_CHECK_INTERVAL seconds. Fonts in FONTS_DIR win
+    over fontconfig fonts with the same name.
+    """
+
+    def __init__(self, fonts_dir: str, watch_dirs: List[str], check_interval: float):
+        self.fonts_dir = fonts_dir
+        self.watch_dirs = [fonts_dir] + [d for d in watch_dirs if d != fonts_dir]
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._entries: List[FontEntry] = []
+        self._index: Dict[str, FontEntry] = {}
+        self._mtimes = None
+        self._checked_at = 0.0
+        self.etag = None
+
+    def _dir_mtimes(self):
+        mtimes = []
+        for directory in self.watch_dirs:
+            try:
+                mtimes.append(os.stat(directory).st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._mtimes is not None and now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if self._mtimes is not None and now - self._checked_at < self.check_interval:
+                return
+            mtimes = self._dir_mtimes()
+            if mtimes != self._mtimes:
+                self._build()
+                self._mtimes = mtimes
+            self._checked_at = now
+
+    def _build(self):
+        started = time.time()
+        entries = scan_font_dir(self.fonts_dir) + list_fontconfig_fonts()
+        index = {}
+        # Reverse order so earlier entries (FONTS_DIR) take precedence
+        for entry in reversed(entries):
+            stem = os.path.splitext(entry.file_name)[0]
+            index[entry.file_name.lower()] = entry
+            index[_key(stem)] = entry
+            index[_key(f"{entry.family} {entry.style}")] = entry
+            if entry.style.lower() in ('regular', 'normal', 'book') or _key(entry.family) not in index:
+                index[_key(entry.family)] = entry
+
+        self._entries = entries
+        self._index = index
+        digest = hashlib.sha256()
+        for entry in entries:
+            digest.update(f"{entry.family}\t{entry.style}\t{entry.path}\t{','.join(entry.scripts)}\n".encode('utf-8'))
+        self.etag = f'"{digest.hexdigest()[:32]}"'
+        logger.info(f"Font registry built with {len(entries)} fonts in {time.time() - started:.2f}s")
+
+    def entries(self) -> List[FontEntry]:
+        self._refresh()
+        return self._entries
+
+    def resolve(self, name: str) -> Optional[FontEntry]:
+        """Find a font by file name, file stem, "Family Style" or family"""
+        self._refresh()
+        if not name:
+            return None
+        if os.path.isabs(name) and os.path.isfile(name):
+            return self._index.get(os.path.basename(name).lower()) or FontEntry(
+                family=os.path.splitext(os.path.basename(name))[0], style='Regular', path=name, source='path')
+        return self._index.get(name.lower()) or self._index.get(_key(os.path.splitext(name)[0])) or self._index.get(_key(name))
+
+    def resolve_path(self, name: str, default: Optional[str] = DEFAULT_FONT) -> str:
+        """Path of the font called ``name``, falling back to ``default``
+
+        Raises:
+            ValueError: If neither font is available
+        """
+        entry = self.resolve(name)
+        if entry is None and default and default != name:
+            logger.warning(f"Font {name} not found, using {default}")
+            entry = self.resolve(default)
+        if entry is None:
+            raise ValueError(f"Font {name} not found")
+        return entry.path
+
+
+font_registry = FontRegistry(FONTS_DIR, FONTCONFIG_DIRS, FONT_REGISTRY_CHECK_INTERVAL)
+
+
+@lru_cache(maxsize=FONT_CACHE_SIZE)
+def _load_font(path: str, size: int) -> FreeTypeFont:
+    return PILImageFont.truetype(path, size)
+
+
+def get_font(name: str, size: int) -> FreeTypeFont:
+    """Loaded font for a registry name or path at ``size``, shared within the process
+
+    The returned object is shared: use it for drawing and measuring only.
+    """
+    return _load_font(font_registry.resolve_path(name), size)
+
+# drawtext fontfile values given as a bare font name instead of a path
+_FONTFILE_PATTERN = re.compile(r"fontfile=(?:'([^'/]+)'|([^'/:,;\[\]\\]+))")
+_FILTER_OPTION_KEYS = ('filter_complex', 'lavfi', 'vf', 'af', 'filter', 'filter:v', 'filter:a')
+# Characters special to the filter option parser and, one level up, to the filtergraph parser
+_OPTION_SPECIAL = re.compile(r"([\\':])")
+_GRAPH_SPECIAL = re.compile(r"([\\'\[\],;])")
+
+
+def _quoted_positions(graph: str) -> List[bool]:
+    """Whether each position of a filtergraph lies inside a single-quoted section"""
+    quoted = []
+    inside = escaped = False
+    for char in graph:
+        quoted.append(inside)
+        if escaped:
+            escaped = False
+        elif char == '\\' and not inside:
+            escaped = True
+        elif char == "'":
+            inside = not inside
+    return quoted
+
+
+def escape_filter_value(value: str, quoted: bool = False) -> str:
+    """Escape an option value for a filtergraph, without adding quotes
+
+    Args:
+        value: Raw option value, e.g. a font path
+        quoted: The value goes inside a single-quoted section of the graph,
+            where only a quote needs escaping at the graph level
+    """
+    value = _OPTION_SPECIAL.sub(r"\\\1", value)
+    if quoted:
+        return value.replace("'", "'\\''")
+    return _GRAPH_SPECIAL.sub(r"\\\1", value)
+
+
+def resolve_filter_fonts(options: Dict[str, Any]) -> Dict[str, Any]:
+    """Replace bare font names in drawtext ``fontfile`` options with their registry paths
+
+    ``fontfile='Roboto-Bold.ttf'`` or ``fontfile=Roboto Bold`` become the path
+    of the matching font; paths and unknown names are left untouched. The
+    path is escaped for where it lands, inside or outside a quoted section
+    of the graph, so characters like ``:`` or ``'`` don't end the option.
+    """
+    def substitute(match, quoted):
+        if match.string[match.end():match.end() + 1] == '/':
+            # Unquoted relative path such as fonts/Roboto-Bold.ttf
+            return match.group(0)
+        name = (match.group(1) or match.group(2)).strip()
+        entry = font_registry.resolve(name)
+        if entry is None:
+            return match.group(0)
+        return f"fontfile={escape_filter_value(entry.path, quoted[match.start()])}"
+
+    resolved = dict(options)
+    for key in _FILTER_OPTION_KEYS:
+        graph = resolved.get(key)
+        if isinstance(graph, str) and 'fontfile=' in graph:
+            quoted = _quoted_positions(graph)
+            resolved[key] = _FONTFILE_PATTERN.sub(lambda match: substitute(match, quoted), graph)
+    return resolved
@@ -0,0 +1,215 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+import requests
+
+from typing import Dict, Any, Optional
+
+from metrics_utils import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class InputCache:
+    """Persistent on-disk cache for remote inputs.
+
+    Entries are keyed by the sha256 of the URL and store the ETag/Last-Modified
+    validators returned by the origin. A cached entry is revalidated with a
+    conditional GET on every use, so a 304 costs one round trip instead of a
+    full transfer. The cache is bounded by size and evicts by last access time.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int, chunk_size: int = 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'revalidations': 0, 'evictions': 0, 'bytes_downloaded': 0}
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _key(self, url: str) -> str:
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def _data_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.bin")
+
+    def _meta_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _incr(self, name: str, amount: int = 1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def _read_meta(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._meta_path(key), 'r') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not os.path.isfile(self._data_path(key)):
+            return None
+        return meta
+
+    def _write_meta(self, key: str, meta: Dict[str, Any]):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.json.part')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._meta_path(key))
+
+    def _touch(self, key: str):
+        try:
+            os.utime(self._data_path(key))
+        except OSError:
+            pass
+
+    def fetch(self, url: str, dest_path: str, session: Optional[requests.Session] = None) -> str:
+        """Place an up-to-date copy of ``url`` at ``dest_path`` and return it.
+
+        Cached files are hard linked into place, so eviction or a newer version
+        replacing the entry can't pull the file out from under a running ffmpeg.
+        """
+        return self._fetch(url, dest_path, session, revalidate=True)
+
+    def _fetch(self, url: str, dest_path: str, session: Optional[requests.Session], revalidate: bool) -> str:
+        http = session or requests
+        key = self._key(url)
+        # Without revalidation the download is unconditional, so it can't hit the 304 path again
+        meta = self._read_meta(key) if revalidate else None
+
+        headers = {}
+        if meta:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        with http.get(url, stream=True, headers=headers) as r:
+            if meta and r.status_code == 304:
+                self._touch(key)
+                try:
+                    link_or_copy(self._data_path(key), dest_path)
+                except FileNotFoundError:
+                    # Evicted by another worker sharing the cache since we read the entry
+                    logger.warning(f"Cached input for {url} was evicted during revalidation, downloading it again")
+                    self.invalidate_key(key)
+                    r.close()
+                    return self._fetch(url, dest_path, session, revalidate=False)
+                self._incr('hits')
+                self._incr('revalidations')
+                metrics.cache_lookup('input', hit=True)
+                logger.info(f"Input cache hit for {url}")
+                return dest_path
+
+            r.raise_for_status()
+            self._incr('misses')
+            metrics.cache_lookup('input', hit=False)
+            etag = r.headers.get('ETag')
+            last_modified = r.headers.get('Last-Modified')
+
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.bin.part')
+            size = 0
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    for chunk in r.iter_content(chunk_size=self.chunk_size):
+                        f.write(chunk)
+                        size += len(chunk)
+            except Exception:
+                os.remove(tmp_path)
+                raise
+
+        self._incr('bytes_downloaded', size)
+        if not etag and not last_modified:
+            # Without validators we can never revalidate, so don't keep it
+            logger.info(f"Input cache miss for {url} (no validators, not cached)")
+            shutil.move(tmp_path, dest_path)
+            return dest_path
+
+        # Linked before the entry is published, so a concurrent evict() can't remove it first
+        try:
+            link_or_copy(tmp_path, dest_path)
+        except OSError:
+            os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, self._data_path(key))
+        self._write_meta(key, {
+            'url': url,
+            'etag': etag,
+            'last_modified': last_modified,
+            'size': size,
+            'stored_at': time.time(),
+        })
+        logger.info(f"Input cache miss for {url}, stored {size} bytes")
+        self.evict()
+        return dest_path
+
+    def contains(self, url: str) -> bool:
+        """Check whether ``url`` has a cached entry, without revalidating it"""
+        return self._read_meta(self._key(url)) is not None
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.bin'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name[:-len('.bin')]))
+            total += st.st_size
+
+        if total <= self.max_bytes:
+            return
+
+        entries.sort()
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            self.invalidate_key(key)
+            total -= size
+            self._incr('evictions')
+
+    def invalidate(self, url: str):
+        self.invalidate_key(self._key(url))
+
+    def invalidate_key(self, key: str):
+        for path in (self._meta_path(key), self._data_path(key)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
+
+
+def link_or_copy(src: str, dst: str) -> str:
+    """Hard link ``src`` to ``dst``, falling back to a copy across filesystems"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+    return dst
+
+
+input_cache: Optional[InputCache] = None
+if os.environ.get('INPUT_CACHE_ENABLED', 'True').lower() == 'true':
+    try:
+        input_cache = InputCache(
+            cache_dir=os.environ.get('INPUT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'ffmpeg-input-cache')),
+            max_bytes=int(os.environ.get('INPUT_CACHE_MAX_BYTES', str(20 * 1024 ** 3))),
+        )
+    except OSError as e:
+        logger.error(f"Failed to initialize input cache, downloads will not be cached: {str(e)}")
@@ -0,0 +1,168 @@
+import os
+import time
+import struct
+import logging
+import threading
+import requests
+
+from typing import List, Dict, Any, Optional, Union, Tuple
+from urllib.parse import urlparse
+
+from ffmpeg_utils import http_session, is_remote_url
+from input_cache_utils import input_cache
+
+logger = logging.getLogger(__name__)
+
+# Containers ffmpeg can demux from a non-seekable pipe
+STREAMABLE_EXTENSIONS = {'.ts', '.m2ts', '.mts', '.mkv', '.webm', '.flv', '.mp3', '.aac', '.ogg', '.oga', '.opus', '.wav', '.flac'}
+STREAMABLE_CONTENT_TYPES = {
+    'video/mp2t', 'video/webm', 'video/x-matroska', 'video/x-flv',
+    'audio/mpeg', 'audio/aac', 'audio/ogg', 'audio/opus', 'audio/wav', 'audio/x-wav', 'audio/flac', 'audio/webm',
+}
+# ISO BMFF containers are only streamable when the moov atom precedes mdat (faststart)
+ISOBMFF_EXTENSIONS = {'.mp4', '.m4v', '.m4a', '.mov'}
+ISOBMFF_CONTENT_TYPES = {'video/mp4', 'audio/mp4', 'video/quicktime'}
+# Input options that make ffmpeg seek in the input
+SEEKING_INPUT_OPTIONS = {'-stream_loop', '-sseof'}
+
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+def _moov_before_mdat(url: str, probe_bytes: int = 64 * 1024) -> bool:
+    """Walk the top-level ISO BMFF boxes in the first bytes of ``url`` and
+    report whether moov shows up before mdat"""
+    with http_session.get(url, headers={'Range': f'bytes=0-{probe_bytes - 1}'}, stream=True, timeout=10) as r:
+        r.raise_for_status()
+        head = r.raw.read(probe_bytes)
+
+    offset = 0
+    while offset + 8 <= len(head):
+        size, box_type = struct.unpack('>I4s', head[offset:offset + 8])
+        if box_type == b'moov':
+            return True
+        if box_type == b'mdat':
+            return False
+        if size == 1:
+            if offset + 16 > len(head):
+                break
+            size = struct.unpack('>Q', head[offset + 8:offset + 16])[0]
+        elif size == 0:
+            break
+        if size < 8:
+            break
+        offset += size
+    return False
+
+
+def is_streamable_input(item: Union[str, List[str]]) -> bool:
+    """Check whether a remote input can be fed to ffmpeg through a pipe"""
+    path_or_url = item[-1] if isinstance(item, list) else item
+    if not is_remote_url(path_or_url):
+        return False
+    if isinstance(item, list) and SEEKING_INPUT_OPTIONS.intersection(item[:-1]):
+        return False
+    if input_cache is not None and input_cache.contains(path_or_url):
+        # A revalidated cache hit is faster than streaming
+        return False
+
+    extension = os.path.splitext(urlparse(path_or_url).path)[1].lower()
+    try:
+        with http_session.head(path_or_url, allow_redirects=True, timeout=10) as r:
+            r.raise_for_status()
+            content_type = r.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if extension in STREAMABLE_EXTENSIONS or content_type in STREAMABLE_CONTENT_TYPES:
+            return True
+        if extension in ISOBMFF_EXTENSIONS or content_type in ISOBMFF_CONTENT_TYPES:
+            return _moov_before_mdat(path_or_url)
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"Could not inspect {path_or_url} for streaming, falling back to download: {str(e)}")
+    return False
+
+
+class InputStreamer(threading.Thread):
+    """Feed a remote input into a named FIFO that ffmpeg reads from"""
+
+    def __init__(self, index: int, url: str, fifo_path: str):
+        threading.Thread.__init__(self, name=f"InputStreamer-{index}", daemon=True)
+        self.index = index
+        self.url = url
+        self.fifo_path = fifo_path
+        self.bytes = 0
+        self.seconds = None
+        self.error = None
+        self._opened = threading.Event()
+
+    def run(self):
+        started = time.time()
+        try:
+            # Blocks until ffmpeg opens the FIFO for reading
+            with open(self.fifo_path, 'wb') as fifo:
+                self._opened.set()
+                with http_session.get(self.url, stream=True) as r:
+                    r.raise_for_status()
+                    for chunk in r.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                        fifo.write(chunk)
+                        self.bytes += len(chunk)
+        except BrokenPipeError:
+            # ffmpeg stopped reading early, e.g. because of -t
+            logger.info(f"FFmpeg closed stream for {self.url} after {self.bytes} bytes")
+        except Exception as e:
+            self.error = str(e)
+            logger.error(f"Error streaming {self.url}: {self.error}")
+        finally:
+            self._opened.set()
+            self.seconds = round(time.time() - started, 3)
+
+    def stop(self, timeout: float = 5.0):
+        """Unblock the writer if ffmpeg never opened the FIFO and wait for it"""
+        deadline = time.time() + timeout
+        while self.is_alive() and not self._opened.is_set() and time.time() < deadline:
+            # Hold a reader end open until the writer gets through open(), then
+            # close it so the writer's next write fails with a broken pipe
+            try:
+                fd = os.open(self.fifo_path, os.O_RDONLY | os.O_NONBLOCK)
+            except OSError:
+                break
+            try:
+                self._opened.wait(0.1)
+            finally:
+                os.close(fd)
+        self.join(max(0.0, deadline - time.time()))
+
+    def timing(self) -> Dict[str, Any]:
+        return {
+            'index': self.index,
+            'url': self.url,
+            'bytes': self.bytes,
+            'seconds': self.seconds,
+            'streamed': True,
+        }
+
+
+def prepare_streamed_inputs(input_files: List[Union[str, List[str]]],
+                            temp_dir: str) -> Tuple[List[Union[str, List[str]]], List[InputStreamer]]:
+    """Replace streamable remote inputs with named FIFOs fed by InputStreamer threads
+
+    Inputs that are not streamable are left untouched so the regular download
+    path handles them.
+
+    Returns:
+        Tuple of the rewritten input items and the started streamers
+    """
+    rewritten = list(input_files)
+    streamers = []
+    for index, item in enumerate(input_files):
+        if not is_streamable_input(item):
+            continue
+        url = item[-1] if isinstance(item, list) else item
+        input_dir = os.path.join(temp_dir, f"stream-{index}")
+        os.makedirs(input_dir, exist_ok=True)
+        fifo_path = os.path.join(input_dir, os.path.basename(urlparse(url).path) or "stream")
+        os.mkfifo(fifo_path)
+
+        streamer = InputStreamer(index, url, fifo_path)
+        streamer.start()
+        streamers.append(streamer)
+        rewritten[index] = item[:-1] + [fifo_path] if isinstance(item, list) else fifo_path
+        logger.info(f"Streaming input {index} from {url} through {fifo_path}")
+    return rewritten, streamers
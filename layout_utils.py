@@ -0,0 +1,194 @@
+import os
+import logging
+import threading
+
+from dataclasses import dataclass
+from typing import List, Dict, Tuple, Optional
+
+from font_utils import get_font, font_registry
+
+logger = logging.getLogger(__name__)
+
+# Size glyph advances are measured at; advances at other sizes are scaled from it
+REFERENCE_SIZE = int(os.environ.get('LAYOUT_REFERENCE_SIZE', '256'))
+
+
+class GlyphMetrics:
+    """Per-glyph advance widths of one font, measured once at REFERENCE_SIZE
+
+    Advances scale linearly with the font size, so a string's width at any
+    size is the sum of its cached advances times size / REFERENCE_SIZE.
+    Kerning and hinting are ignored here; fit_text checks the final layout
+    against the real font.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._font = get_font(path, REFERENCE_SIZE)
+        ascent, descent = self._font.getmetrics()
+        self.line_height = (ascent + descent) / REFERENCE_SIZE
+        self._advances: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def width(self, text: str) -> float:
+        """Width of ``text`` in units of the font size"""
+        advances = self._advances
+        total = 0.0
+        for char in text:
+            advance = advances.get(char)
+            if advance is None:
+                with self._lock:
+                    advance = advances[char] = self._font.getlength(char) / REFERENCE_SIZE
+            total += advance
+        return total
+
+
+_metrics: Dict[str, GlyphMetrics] = {}
+_metrics_lock = threading.Lock()
+
+
+def get_glyph_metrics(font_name: str) -> GlyphMetrics:
+    path = font_registry.resolve_path(font_name)
+    metrics = _metrics.get(path)
+    if metrics is None:
+        with _metrics_lock:
+            metrics = _metrics.get(path)
+            if metrics is None:
+                metrics = _metrics[path] = GlyphMetrics(path)
+    return metrics
+
+
+@dataclass
+class TextLayout:
+    lines: List[str]
+    font_path: str
+    font_size: int
+    line_pitch: float
+    width: float
+    height: float
+    fits: bool
+
+    @property
+    def font(self):
+        return get_font(self.font_path, self.font_size)
+
+
+def _wrap(words: List[Tuple[str, float]], space: float, max_width: float,
+          allow_overflow: bool = False) -> Optional[List[Tuple[str, float]]]:
+    """Greedy wrap of pre-measured words; widths in units of the font size
+
+    Returns the lines with their widths, or None if a single word is wider
+    than max_width, unless allow_overflow puts it on a line of its own.
+    """
+    lines = []
+    line, line_width = None, 0.0
+    for word, width in words:
+        if word == '\n':
+            lines.append((line or '', line_width))
+            line, line_width = None, 0.0
+            continue
+        if width > max_width and not allow_overflow:
+            return None
+        if line is None:
+            line, line_width = word, width
+        elif line_width + space + width <= max_width:
+            line, line_width = f"{line} {word}", line_width + space + width
+        else:
+            lines.append((line, line_width))
+            line, line_width = word, width
+    if line is not None:
+        lines.append((line, line_width))
+    return lines
+
+
+def fit_text(text: str, font_name: str, box_width: float, box_height: float,
+             max_size: int = 120, min_size: int = 10, line_gap: float = 0,
+             max_lines: Optional[int] = None) -> TextLayout:
+    """Lay out ``text`` at the largest font size that fits the box
+
+    Binary searches the integer sizes between min_size and max_size, wrapping
+    words greedily at each candidate using cached glyph advances, then checks
+    the chosen lines against the real font and steps down if rounding made one
+    overflow.
+
+    Args:
+        text: Text to lay out; newlines force line breaks
+        font_name: Registry font name or path
+        box_width: Available width in pixels
+        box_height: Available height in pixels
+        max_size: Largest font size to consider
+        min_size: Smallest font size to consider
+        line_gap: Extra pixels between lines
+        max_lines: Upper bound on the number of lines
+
+    Returns:
+        The layout; ``fits`` is False when even min_size overflows, in which
+        case the min_size layout is returned
+    """
+    metrics = get_glyph_metrics(font_name)
+    space = metrics.width(' ')
+    words = []
+    for index, paragraph in enumerate(text.split('\n')):
+        if index:
+            words.append(('\n', 0.0))
+        words.extend((word, metrics.width(word)) for word in paragraph.split())
+
+    def layout_at(size: int) -> Optional[TextLayout]:
+        lines = _wrap(words, space, box_width / size)
+        if lines is None or (max_lines is not None and len(lines) > max_lines):
+            return None
+        pitch = metrics.line_height * size + line_gap
+        height = pitch * len(lines) - line_gap
+        if height > box_height:
+            return None
+        width = max((line_width for _, line_width in lines), default=0.0) * size
+        return TextLayout([line for line, _ in lines], metrics.path, size, pitch, width, height, True)
+
+    best = None
+    low, high = min_size, max_size
+    while low <= high:
+        size = (low + high) // 2
+        layout = layout_at(size)
+        if layout is not None:
+            best, low = layout, size + 1
+        else:
+            high = size - 1
+
+    while best is not None:
+        font = best.font
+        widths = [font.getlength(line) for line in best.lines]
+        if max(widths, default=0.0) <= box_width:
+            best.width = max(widths, default=0.0)
+            return best
+        best = layout_at(best.font_size - 1) if best.font_size > min_size else None
+
+    logger.warning(f"Text does not fit a {box_width}x{box_height} box even at size {min_size}")
+    lines = _wrap(words, space, box_width / min_size, allow_overflow=True)
+    pitch = metrics.line_height * min_size + line_gap
+    return TextLayout(
+        [line for line, _ in lines], metrics.path, min_size, pitch,
+        max((line_width for _, line_width in lines), default=0.0) * min_size,
+        pitch * len(lines) - line_gap, False
+    )
+
+
+def draw_layout(draw, layout: TextLayout, box: Tuple[float, float, float, float], fill,
+                align: str = 'left', valign: str = 'center'):
+    """Draw a layout inside ``box`` (left, top, right, bottom) on an ImageDraw"""
+    left, top, right, bottom = box
+    if valign == 'center':
+        y = top + (bottom - top - layout.height) / 2
+    elif valign == 'bottom':
+        y = bottom - layout.height
+    else:
+        y = top
+    font = layout.font
+    for line in layout.lines:
+        if align == 'center':
+            x = left + (right - left - font.getlength(line)) / 2
+        elif align == 'right':
+            x = right - font.getlength(line)
+        else:
+            x = left
+        draw.text((x, y), line, font=font, fill=fill, anchor='la')
+        y += layout.line_pitch
@@ -0,0 +1,262 @@
+import os
+import json
+import time
+import atexit
+import logging
+import threading
+import redis
+
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from celery import states
+from celery.signals import before_task_publish, task_prerun, task_postrun, worker_init
+from prometheus_client import CollectorRegistry, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, HistogramMetricFamily
+
+from redis_utils import redis_client
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'True').lower() == 'true'
+# Seconds between pushes of buffered observations to Redis; tasks also push when they finish
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', '10'))
+
+_KEY_PREFIX = 'metrics:'
+_ACTIVE_JOBS_KEY = 'metrics:active_jobs'
+
+# Tasks whose phases are measured, and the job label they are reported under
+TRACKED_TASKS = {
+    'celery_worker.process_ffmpeg_task': 'compose',
+    'reddit_tasks.process_reddit_intro_task': 'reddit_intro',
+}
+
+_PHASE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+_SPEED_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64)
+
+
+@dataclass
+class MetricSpec:
+    name: str
+    kind: str
+    documentation: str
+    labels: Tuple[str, ...]
+    buckets: Tuple[float, ...] = ()
+
+
+METRICS = {spec.name: spec for spec in [
+    MetricSpec('ffmpeg_job_phase_seconds', 'histogram',
+               'Seconds jobs spent in each phase (queue_wait, download, probe, render, encode, upload, webhook)',
+               ('job', 'phase'), _PHASE_BUCKETS),
+    MetricSpec('ffmpeg_encode_speed_ratio', 'histogram', 'Encode speed as a multiple of realtime',
+               ('job',), _SPEED_BUCKETS),
+    MetricSpec('ffmpeg_input_bytes', 'counter', 'Bytes of remote inputs fetched by jobs', ('job',)),
+    MetricSpec('ffmpeg_output_bytes', 'counter', 'Bytes of job outputs uploaded', ('job',)),
+    MetricSpec('ffmpeg_jobs', 'counter', 'Finished jobs by outcome', ('job', 'outcome')),
+    MetricSpec('ffmpeg_cache_lookups', 'counter', 'Cache lookups by cache and result (hit or miss)',
+               ('cache', 'result')),
+    MetricSpec('ffmpeg_webhook_deliveries', 'counter', 'Webhook delivery attempts by outcome (delivered, retried, failed)',
+               ('outcome',)),
+]}
+
+
+def _field(label_values: Tuple[str, ...], part: str = '') -> str:
+    return json.dumps(list(label_values)) + '\t' + part
+
+
+class MetricsRecorder:
+    """Buffers observations in-process and pushes them to Redis
+
+    Observations are summed per metric, label set and histogram bucket, and
+    pushed with one pipeline of HINCRBYFLOAT per flush, so every worker
+    process, in every container, adds into the same totals. Observations that
+    fail to push are kept and retried on the next flush.
+    """
+
+    def __init__(self, redis, flush_interval: float, enabled: bool = True):
+        self.redis = redis
+        self.flush_interval = flush_interval
+        self.enabled = enabled
+        self._reset()
+        # Pool processes are forked: each one gets its own buffer and flusher
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._pending: Dict[Tuple[str, str], float] = {}
+        self._flusher: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def _add(self, updates: List[Tuple[str, str, float]]):
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name="MetricsFlusher", daemon=True)
+                self._flusher.start()
+            for name, field, amount in updates:
+                self._pending[(name, field)] = self._pending.get((name, field), 0.0) + amount
+
+    def inc(self, name: str, amount: float = 1.0, **labels):
+        spec = METRICS[name]
+        self._add([(name, _field(tuple(labels[label] for label in spec.labels)), amount)])
+
+    def observe(self, name: str, value: float, **labels):
+        spec = METRICS[name]
+        label_values = tuple(labels[label] for label in spec.labels)
+        updates = [(name, _field(label_values, 'sum'), value), (name, _field(label_values, 'count'), 1.0)]
+        bucket = next((str(bound) for bound in spec.buckets if value <= bound), '+Inf')
+        updates.append((name, _field(label_values, bucket), 1.0))
+        self._add(updates)
+
+    @contextmanager
+    def time_phase(self, job: str, phase: str):
+        """Observe the duration of the block as a phase of ``job``, also when it raises"""
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.observe('ffmpeg_job_phase_seconds', time.time() - started, job=job, phase=phase)
+
+    def cache_lookup(self, cache: str, hit: bool):
+        self.inc('ffmpeg_cache_lookups', cache=cache, result='hit' if hit else 'miss')
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for (name, field), amount in pending.items():
+                pipe.hincrbyfloat(_KEY_PREFIX + name, field, amount)
+            pipe.execute()
+        except redis.exceptions.RedisError as e:
+            logger.warning(f"Failed to push metrics, retrying on the next flush: {str(e)}")
+            with self._lock:
+                for key, amount in pending.items():
+                    self._pending[key] = self._pending.get(key, 0.0) + amount
+
+    def job_active(self, hostname: str, job: str, delta: int):
+        """Adjust a worker's active job count, written through so the gauge is current"""
+        if not self.enabled:
+            return
+        try:
+            self.redis.hincrby(_ACTIVE_JOBS_KEY, json.dumps([hostname, job]), delta)
+        except redis.exceptions.RedisError as e:
+            logger.warning(f"Failed to update active jobs: {str(e)}")
+
+
+metrics = MetricsRecorder(redis_client, METRICS_FLUSH_INTERVAL, METRICS_ENABLED)
+atexit.register(metrics.flush)
+
+
+@before_task_publish.connect
+def stamp_enqueued_at(sender=None, headers=None, **kwargs):
+    # Custom headers end up on task.request, where task_prerun reads the queue wait
+    if sender in TRACKED_TASKS and headers is not None:
+        headers.setdefault('enqueued_at', time.time())
+
+
+@worker_init.connect
+def reset_active_jobs(sender=None, **kwargs):
+    # Counts left behind by this worker's previous run, if it died mid-job
+    if not METRICS_ENABLED:
+        return
+    try:
+        stale = [field for field in redis_client.hkeys(_ACTIVE_JOBS_KEY) if json.loads(field)[0] == sender.hostname]
+        if stale:
+            redis_client.hdel(_ACTIVE_JOBS_KEY, *stale)
+    except redis.exceptions.RedisError as e:
+        logger.warning(f"Failed to reset active jobs: {str(e)}")
+
+
+@task_prerun.connect
+def start_job_metrics(task=None, **kwargs):
+    job = TRACKED_TASKS.get(task.name)
+    if job is None:
+        return
+    enqueued_at = getattr(task.request, 'enqueued_at', None)
+    if enqueued_at:
+        metrics.observe('ffmpeg_job_phase_seconds', max(0.0, time.time() - enqueued_at), job=job, phase='queue_wait')
+    if task.request.hostname:
+        metrics.job_active(task.request.hostname, job, 1)
+
+
+@task_postrun.connect
+def finish_job_metrics(task=None, retval=None, state=None, **kwargs):
+    job = TRACKED_TASKS.get(task.name)
+    if job is None:
+        return
+    if task.request.hostname:
+        metrics.job_active(task.request.hostname, job, -1)
+    # Segmented compose jobs are ignored here and finish in their chord callback
+    if state != states.IGNORED:
+        succeeded = isinstance(retval, dict) and (retval.get('success') is True or retval.get('status') == 'completed')
+        metrics.inc('ffmpeg_jobs', job=job, outcome='success' if succeeded else 'failure')
+    metrics.flush()
+
+
+class RedisMetricsCollector:
+    """Exposes the totals workers pushed to Redis as Prometheus metric families"""
+
+    def __init__(self, redis):
+        self.redis = redis
+
+    def collect(self):
+        # Imported here: backlog_utils depends on modules that record metrics
+        from backlog_utils import WORKERS_KEY, live_workers
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for name in METRICS:
+                pipe.hgetall(_KEY_PREFIX + name)
+            pipe.hgetall(_ACTIVE_JOBS_KEY)
+            pipe.hvals(WORKERS_KEY)
+            *values, active_jobs, workers = pipe.execute()
+        except redis.exceptions.RedisError as e:
+            logger.error(f"Failed to read metrics: {str(e)}")
+            yield GaugeMetricFamily('ffmpeg_metrics_store_up', 'Whether the metrics store could be read', value=0)
+            return
+        yield GaugeMetricFamily('ffmpeg_metrics_store_up', 'Whether the metrics store could be read', value=1)
+
+        for spec, raw in zip(METRICS.values(), values):
+            series: Dict[Tuple[str, ...], Dict[str, float]] = {}
+            for field, value in raw.items():
+                labels, _, part = field.decode('utf-8').partition('\t')
+                series.setdefault(tuple(json.loads(labels)), {})[part] = float(value)
+            if spec.kind == 'counter':
+                family = CounterMetricFamily(spec.name, spec.documentation, labels=spec.labels)
+                for label_values, parts in series.items():
+                    family.add_metric(label_values, parts.get('', 0.0))
+            else:
+                family = HistogramMetricFamily(spec.name, spec.documentation, labels=spec.labels)
+                for label_values, parts in series.items():
+                    cumulative = 0.0
+                    buckets = []
+                    for bound in spec.buckets:
+                        cumulative += parts.get(str(bound), 0.0)
+                        buckets.append((str(bound), cumulative))
+                    buckets.append(('+Inf', parts.get('count', 0.0)))
+                    family.add_metric(label_values, buckets, parts.get('sum', 0.0))
+            yield family
+
+        live = {worker['hostname'] for worker in live_workers(workers)}
+        family = GaugeMetricFamily('ffmpeg_active_jobs', 'Jobs running on each live worker', labels=('worker', 'job'))
+        for field, value in active_jobs.items():
+            hostname, job = json.loads(field)
+            if hostname in live:
+                family.add_metric((hostname, job), max(0.0, float(value)))
+        yield family
+
+
+_registry = CollectorRegistry(auto_describe=False)
+_registry.register(RedisMetricsCollector(redis_client))
+
+
+def render_metrics() -> bytes:
+    """Metrics in the Prometheus text exposition format"""
+    return generate_latest(_registry)
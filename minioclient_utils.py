@@ -1,4 +1,5 @@
 import os
+import json
 import logging
 from minio import Minio
 
@@ -0,0 +1,95 @@
+import os
+import time
+import logging
+import mimetypes
+import threading
+
+from typing import Dict, Any, Optional, IO
+from minio import Minio
+
+logger = logging.getLogger(__name__)
+
+# Opt-in: piped Matroska, MP3, FLV and Ogg outputs lack what their muxers write by seeking back
+STREAM_OUTPUT_ENABLED = os.environ.get('STREAM_OUTPUT_ENABLED', 'False').lower() == 'true'
+STREAM_OUTPUT_PART_SIZE = int(os.environ.get('STREAM_OUTPUT_PART_SIZE', str(16 * 1024 * 1024)))
+STREAM_OUTPUT_PARALLEL_UPLOADS = int(os.environ.get('STREAM_OUTPUT_PARALLEL_UPLOADS', '3'))
+
+# Muxers that can write to a pipe, keyed by output extension. MPEG-TS and ADTS
+# come out byte-identical; Matroska/WebM lose their cues and duration, MP3 its
+# Xing/LAME header, FLV and Ogg their duration metadata
+STREAMABLE_OUTPUT_FORMATS = {
+    '.ts': 'mpegts',
+    '.m2ts': 'mpegts',
+    '.mts': 'mpegts',
+    '.mkv': 'matroska',
+    '.webm': 'webm',
+    '.mp3': 'mp3',
+    '.aac': 'adts',
+    '.ogg': 'ogg',
+    '.oga': 'ogg',
+    '.opus': 'opus',
+    '.flv': 'flv',
+}
+# ISO BMFF outputs are only streamable when written as fragments
+FRAGMENTABLE_OUTPUT_FORMATS = {
+    '.mp4': 'mp4',
+    '.m4v': 'mp4',
+    '.m4a': 'ipod',
+    '.mov': 'mov',
+}
+FRAGMENTED_MOVFLAGS = ('frag_keyframe', 'empty_moov', 'frag_every_frame', 'frag_custom', 'dash')
+
+
+def get_streamable_output_format(output_file: str, options: Dict[str, Any]) -> Optional[str]:
+    """Return the muxer to use when the output can be written to a pipe, or None
+    when it needs a seekable file (e.g. faststart or non-fragmented MP4)"""
+    extension = os.path.splitext(output_file)[1].lower()
+    muxer = options.get('f') or STREAMABLE_OUTPUT_FORMATS.get(extension)
+    if muxer in STREAMABLE_OUTPUT_FORMATS.values():
+        return muxer
+
+    muxer = options.get('f') or FRAGMENTABLE_OUTPUT_FORMATS.get(extension)
+    if muxer in ('mp4', 'mov', 'ipod'):
+        movflags = str(options.get('movflags') or '')
+        if 'faststart' in movflags:
+            return None
+        if any(flag in movflags for flag in FRAGMENTED_MOVFLAGS):
+            return muxer
+    return None
+
+
+class MinioStreamUploader(threading.Thread):
+    """Upload ffmpeg's stdout to MinIO as a parallel multipart upload while it encodes"""
+
+    def __init__(self, client: Minio, bucket: str, object_name: str, stream: IO[bytes]):
+        threading.Thread.__init__(self, name="MinioStreamUploader", daemon=True)
+        self.client = client
+        self.bucket = bucket
+        self.object_name = object_name
+        self.stream = stream
+        self.error = None
+        self.seconds = None
+        self.bytes = 0
+
+    def run(self):
+        started = time.time()
+        content_type = mimetypes.guess_type(self.object_name)[0] or 'application/octet-stream'
+        try:
+            self.client.put_object(
+                self.bucket,
+                self.object_name,
+                self.stream,
+                length=-1,
+                content_type=content_type,
+                part_size=STREAM_OUTPUT_PART_SIZE,
+                num_parallel_uploads=STREAM_OUTPUT_PARALLEL_UPLOADS,
+            )
+            self.bytes = self.client.stat_object(self.bucket, self.object_name).size
+        except Exception as e:
+            self.error = str(e)
+            logger.error(f"Streaming upload of {self.object_name} failed: {self.error}")
+        finally:
+            # Closing our end makes ffmpeg fail fast with a broken pipe instead
+            # of blocking forever on a full pipe when the upload dies
+            self.stream.close()
+            self.seconds = round(time.time() - started, 3)
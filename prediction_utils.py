@@ -0,0 +1,187 @@
+import os
+import json
+import math
+import time
+import random
+import logging
+import threading
+import statistics
+import redis
+
+from typing import List, Dict, Any, Optional
+
+from redis_utils import redis_client
+from routing_utils import JobCost, job_cost_history, codec_factor
+
+logger = logging.getLogger(__name__)
+
+# Finished jobs needed before the regression replaces the calibrated cost ratio
+RUNTIME_MODEL_MIN_SAMPLES = int(os.environ.get('RUNTIME_MODEL_MIN_SAMPLES', '50'))
+# Seconds between retrains from job_cost_history
+RUNTIME_MODEL_RETRAIN_INTERVAL = float(os.environ.get('RUNTIME_MODEL_RETRAIN_INTERVAL', '600'))
+# Predicted runtime of jobs whose cost can't be estimated
+RUNTIME_DEFAULT_SECONDS = float(os.environ.get('RUNTIME_DEFAULT_SECONDS', '300'))
+
+_MODEL_KEY = 'runtime_model'
+_FEATURES = ['intercept', 'log_duration', 'log_pixel_rate', 'log_codec_factor', 'log_filter_weight']
+_REFERENCE_PIXEL_RATE = 1920 * 1080 * 30
+_RIDGE = 1e-3
+# Share of the history held out to measure the model's error
+_HOLDOUT = 0.2
+
+
+def job_features(estimate: Dict[str, Any]) -> Optional[List[float]]:
+    """Regression inputs of a job estimate, None when its duration is unknown"""
+    duration = estimate.get('duration')
+    if not duration or duration <= 0:
+        return None
+    pixel_rate = (estimate.get('width') or 1920) * (estimate.get('height') or 1080) * (estimate.get('fps') or 30)
+    return [
+        1.0,
+        math.log(duration),
+        math.log(pixel_rate / _REFERENCE_PIXEL_RATE),
+        math.log(codec_factor(estimate.get('codec'), estimate.get('preset'))),
+        math.log1p(estimate.get('filter_weight') or 0.0),
+    ]
+
+
+def _solve(matrix: List[List[float]], vector: List[float]) -> List[float]:
+    """Solve a small linear system by Gaussian elimination with partial pivoting"""
+    size = len(vector)
+    rows = [row[:] + [value] for row, value in zip(matrix, vector)]
+    for column in range(size):
+        pivot = max(range(column, size), key=lambda row: abs(rows[row][column]))
+        if abs(rows[pivot][column]) < 1e-12:
+            raise ValueError("Singular system")
+        rows[column], rows[pivot] = rows[pivot], rows[column]
+        for row in range(column + 1, size):
+            factor = rows[row][column] / rows[column][column]
+            for index in range(column, size + 1):
+                rows[row][index] -= factor * rows[column][index]
+    solution = [0.0] * size
+    for row in reversed(range(size)):
+        solution[row] = (rows[row][size] - sum(rows[row][index] * solution[index] for index in range(row + 1, size))) / rows[row][row]
+    return solution
+
+
+def fit_log_linear(samples: List[List[float]], targets: List[float]) -> List[float]:
+    """Ridge regression of log(target) on the features, the intercept unpenalized"""
+    size = len(samples[0])
+    gram = [[0.0] * size for _ in range(size)]
+    moment = [0.0] * size
+    for features, target in zip(samples, targets):
+        log_target = math.log(target)
+        for i in range(size):
+            moment[i] += features[i] * log_target
+            for j in range(size):
+                gram[i][j] += features[i] * features[j]
+    for i in range(1, size):
+        gram[i][i] += _RIDGE * len(samples)
+    return _solve(gram, moment)
+
+
+class RuntimePredictor:
+    """Predicts encode seconds of compose jobs from their cost estimate
+
+    Trained on job_cost_history. Until RUNTIME_MODEL_MIN_SAMPLES jobs have
+    finished, the prediction is the estimated cost times the median ratio of
+    actual runtime to cost seen so far (1 without history). After that a
+    log-linear ridge regression on output duration, pixel rate, encoder and
+    preset, and filter weight is used. The trained model is shared through
+    Redis, so only one API process retrains it per interval.
+    """
+
+    def __init__(self, redis, retrain_interval: float, min_samples: int):
+        self.redis = redis
+        self.retrain_interval = retrain_interval
+        self.min_samples = min_samples
+        self._model: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+
+    def train(self, history: List[Dict[str, Any]]) -> Dict[str, Any]:
+        samples = []
+        targets = []
+        ratios = []
+        for entry in history:
+            estimate = entry.get('estimate') or {}
+            runtime = entry.get('runtime')
+            if not entry.get('success') or not runtime or runtime <= 0:
+                continue
+            if estimate.get('cost'):
+                ratios.append(runtime / estimate['cost'])
+            features = job_features(estimate)
+            if features is not None:
+                samples.append(features)
+                targets.append(runtime)
+
+        model = {
+            'trained_at': time.time(),
+            'samples': len(samples),
+            'cost_ratio': statistics.median(ratios) if ratios else 1.0,
+            'weights': None,
+            'mape': None,
+        }
+        if len(samples) >= self.min_samples:
+            indices = list(range(len(samples)))
+            random.Random(0).shuffle(indices)
+            split = int(len(indices) * _HOLDOUT)
+            holdout, train = indices[:split], indices[split:]
+            weights = fit_log_linear([samples[i] for i in train], [targets[i] for i in train])
+            if holdout:
+                errors = [abs(self._regress(weights, samples[i]) - targets[i]) / targets[i] for i in holdout]
+                model['mape'] = round(statistics.mean(errors), 4)
+            # Final weights use every sample
+            model['weights'] = fit_log_linear(samples, targets)
+        logger.info(f"Runtime model trained on {len(samples)} jobs (holdout MAPE {model['mape']})")
+        return model
+
+    @staticmethod
+    def _regress(weights: List[float], features: List[float]) -> float:
+        return math.exp(sum(weight * value for weight, value in zip(weights, features)))
+
+    def model(self) -> Dict[str, Any]:
+        """The current model, retrained from the history when older than the retrain interval"""
+        model = self._model
+        now = time.time()
+        if model is not None and now - model['trained_at'] < self.retrain_interval:
+            return model
+        with self._lock:
+            model = self._model
+            if model is not None and now - model['trained_at'] < self.retrain_interval:
+                return model
+            try:
+                raw = self.redis.get(_MODEL_KEY)
+                model = json.loads(raw) if raw else None
+                if model is None or now - model['trained_at'] >= self.retrain_interval:
+                    model = self.train(job_cost_history())
+                    self.redis.set(_MODEL_KEY, json.dumps(model))
+            except redis.exceptions.RedisError as e:
+                logger.error(f"Runtime model unavailable, using the last one: {str(e)}")
+                model = self._model or {'trained_at': now, 'samples': 0, 'cost_ratio': 1.0, 'weights': None, 'mape': None}
+            self._model = model
+            return model
+
+    def predict(self, job_cost: JobCost) -> float:
+        """Predicted encode seconds of a job"""
+        model = self.model()
+        estimate = job_cost.to_dict()
+        features = job_features(estimate)
+        if model['weights'] is not None and features is not None:
+            return round(self._regress(model['weights'], features), 2)
+        if job_cost.cost is not None:
+            return round(job_cost.cost * model['cost_ratio'], 2)
+        return RUNTIME_DEFAULT_SECONDS
+
+    def describe(self) -> Dict[str, Any]:
+        model = self.model()
+        return {
+            'trained_at': model['trained_at'],
+            'samples': model['samples'],
+            'regression': model['weights'] is not None,
+            'weights': dict(zip(_FEATURES, model['weights'])) if model['weights'] else None,
+            'cost_ratio': model['cost_ratio'],
+            'holdout_mape': model['mape'],
+        }
+
+
+runtime_predictor = RuntimePredictor(redis_client, RUNTIME_MODEL_RETRAIN_INTERVAL, RUNTIME_MODEL_MIN_SAMPLES)
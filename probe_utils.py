@@ -0,0 +1,337 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+import subprocess
+import requests
+import redis
+
+from collections import OrderedDict
+from dataclasses import dataclass, field, asdict
+from typing import List, Dict, Any, Optional
+
+from metrics_utils import metrics
+
+logger = logging.getLogger(__name__)
+
+PROBE_CACHE_TTL = int(os.environ.get('PROBE_CACHE_TTL', '86400'))
+PROBE_CACHE_MAX_ENTRIES = int(os.environ.get('PROBE_CACHE_MAX_ENTRIES', '1024'))
+PROBE_CACHE_REDIS_URL = os.environ.get('PROBE_CACHE_REDIS_URL', os.environ.get('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0'))
+# Versioned: bumped when MediaInfo gains fields, so older cached entries aren't read back without them
+PROBE_CACHE_KEY_PREFIX = 'ffprobe:v2:'
+
+# Bytes hashed from each end of a local file to build its content key
+_SAMPLE_BYTES = 1024 * 1024
+
+
+@dataclass
+class StreamInfo:
+    index: int
+    codec_type: str
+    codec_name: Optional[str] = None
+    duration: Optional[float] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    frame_rate: Optional[float] = None
+    sample_rate: Optional[int] = None
+    channels: Optional[int] = None
+    bit_rate: Optional[int] = None
+
+
+@dataclass
+class MediaInfo:
+    source: str
+    format_name: Optional[str] = None
+    duration: Optional[float] = None
+    start_time: Optional[float] = None
+    size: Optional[int] = None
+    bit_rate: Optional[int] = None
+    streams: List[StreamInfo] = field(default_factory=list)
+
+    def first_stream(self, codec_type: str) -> Optional[StreamInfo]:
+        for stream in self.streams:
+            if stream.codec_type == codec_type:
+                return stream
+        return None
+
+    def stream_duration(self, codec_type: str) -> Optional[float]:
+        """Duration of the first stream of ``codec_type``, falling back to the container duration"""
+        stream = self.first_stream(codec_type)
+        if stream is not None and stream.duration is not None:
+            return stream.duration
+        return self.duration
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'MediaInfo':
+        streams = [StreamInfo(**stream) for stream in data.get('streams', [])]
+        return cls(**{**data, 'streams': streams})
+
+
+def _to_float(value: Any) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_int(value: Any) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_rate(value: Optional[str]) -> Optional[float]:
+    if not value or '/' not in value:
+        return _to_float(value)
+    num, den = value.split('/', 1)
+    num, den = _to_float(num), _to_float(den)
+    if not num or not den:
+        return None
+    return num / den
+
+
+def parse_ffprobe_output(source: str, data: Dict[str, Any]) -> MediaInfo:
+    """Build a MediaInfo from ``ffprobe -show_format -show_streams -of json`` output"""
+    fmt = data.get('format', {})
+    streams = []
+    for stream in data.get('streams', []):
+        streams.append(StreamInfo(
+            index=stream.get('index', len(streams)),
+            codec_type=stream.get('codec_type', 'unknown'),
+            codec_name=stream.get('codec_name'),
+            duration=_to_float(stream.get('duration')),
+            width=_to_int(stream.get('width')),
+            height=_to_int(stream.get('height')),
+            frame_rate=_parse_rate(stream.get('avg_frame_rate')) or _parse_rate(stream.get('r_frame_rate')),
+            sample_rate=_to_int(stream.get('sample_rate')),
+            channels=_to_int(stream.get('channels')),
+            bit_rate=_to_int(stream.get('bit_rate')),
+        ))
+    return MediaInfo(
+        source=source,
+        format_name=fmt.get('format_name'),
+        duration=_to_float(fmt.get('duration')),
+        start_time=_to_float(fmt.get('start_time')),
+        size=_to_int(fmt.get('size')),
+        bit_rate=_to_int(fmt.get('bit_rate')),
+        streams=streams,
+    )
+
+
+def source_digest(source: str, require_validator: bool = False, full_content: bool = False) -> Optional[str]:
+    """Digest identifying the current content of a local path or remote URL
+
+    Remote sources are identified by URL plus ETag/Last-Modified, local files
+    by a hash of their size and first and last megabyte.
+
+    Args:
+        source: Local path or http(s) URL
+        require_validator: Return None for remote sources that expose neither
+            ETag nor Last-Modified, instead of falling back to the bare URL
+        full_content: Hash every byte of a local file, so an edit in the middle
+            that keeps the size also changes the digest
+    """
+    if source.startswith(('http://', 'https://')):
+        # Imported here: ffmpeg_utils imports this module
+        from ffmpeg_utils import http_session
+        validator = ''
+        try:
+            with http_session.head(source, allow_redirects=True, timeout=10) as r:
+                if r.ok:
+                    validator = r.headers.get('ETag') or r.headers.get('Last-Modified') or ''
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Could not fetch validators for {source}: {str(e)}")
+        if not validator and require_validator:
+            return None
+        material = f"url:{source}\n{validator}"
+    else:
+        st = os.stat(source)
+        digest = hashlib.sha256(str(st.st_size).encode('utf-8'))
+        with open(source, 'rb') as f:
+            if full_content:
+                for chunk in iter(lambda: f.read(_SAMPLE_BYTES), b''):
+                    digest.update(chunk)
+            else:
+                digest.update(f.read(_SAMPLE_BYTES))
+                if st.st_size > _SAMPLE_BYTES:
+                    f.seek(max(_SAMPLE_BYTES, st.st_size - _SAMPLE_BYTES))
+                    digest.update(f.read(_SAMPLE_BYTES))
+        material = f"{'content' if full_content else 'file'}:{digest.hexdigest()}"
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+class ProbeCache:
+    """Two level ffprobe result cache: a bounded in-process LRU in front of Redis.
+
+    Keys come from source_digest, so a changed source gets a new key instead
+    of a stale result. Remote sources without ETag or Last-Modified have no
+    key and are never cached.
+    """
+
+    def __init__(self, redis_url: Optional[str], ttl: int, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._redis = None
+        self._stats = {'hits': 0, 'redis_hits': 0, 'misses': 0}
+        if redis_url:
+            try:
+                self._redis = redis.Redis.from_url(redis_url, socket_timeout=2, socket_connect_timeout=2)
+            except Exception as e:
+                logger.error(f"Probe cache could not connect to Redis, using in-process cache only: {str(e)}")
+
+    def source_key(self, source: str) -> Optional[str]:
+        digest = source_digest(source, require_validator=True)
+        return PROBE_CACHE_KEY_PREFIX + digest if digest else None
+
+    @staticmethod
+    def latest_key(source: str) -> str:
+        """Key of the last result probed for ``source``, whatever its content was then"""
+        return PROBE_CACHE_KEY_PREFIX + 'latest:' + hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[MediaInfo]:
+        now = time.time()
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is not None:
+                expires_at, info = entry
+                if expires_at > now:
+                    self._local.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return info
+                del self._local[key]
+
+        if self._redis is not None:
+            try:
+                raw = self._redis.get(key)
+            except redis.exceptions.RedisError as e:
+                logger.warning(f"Probe cache Redis read failed: {str(e)}")
+                raw = None
+            if raw:
+                info = MediaInfo.from_dict(json.loads(raw))
+                self._store_local(key, info)
+                with self._lock:
+                    self._stats['redis_hits'] += 1
+                return info
+
+        with self._lock:
+            self._stats['misses'] += 1
+        return None
+
+    def set(self, key: str, info: MediaInfo):
+        self._store_local(key, info)
+        if self._redis is not None:
+            try:
+                self._redis.set(key, json.dumps(info.to_dict()), ex=self.ttl)
+            except redis.exceptions.RedisError as e:
+                logger.warning(f"Probe cache Redis write failed: {str(e)}")
+
+    def _store_local(self, key: str, info: MediaInfo):
+        with self._lock:
+            self._local[key] = (time.time() + self.ttl, info)
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_entries:
+                self._local.popitem(last=False)
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._local.pop(key, None)
+        if self._redis is not None:
+            try:
+                self._redis.delete(key)
+            except redis.exceptions.RedisError as e:
+                logger.warning(f"Probe cache Redis delete failed: {str(e)}")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+
+probe_cache = ProbeCache(PROBE_CACHE_REDIS_URL, PROBE_CACHE_TTL, PROBE_CACHE_MAX_ENTRIES)
+
+
+def run_ffprobe(source: str) -> MediaInfo:
+    """Run ffprobe against ``source`` without consulting the cache"""
+    cmd = [
+        "ffprobe",
+        "-v", "error",
+        "-show_format",
+        "-show_streams",
+        "-of", "json",
+        source
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    return parse_ffprobe_output(source, json.loads(result.stdout))
+
+
+def probe_media(source: str, use_cache: bool = True) -> MediaInfo:
+    """Return stream and format metadata for a local path or remote URL
+
+    Raises:
+        subprocess.CalledProcessError: If ffprobe fails
+    """
+    if not use_cache:
+        return run_ffprobe(source)
+
+    key = probe_cache.source_key(source)
+    if key is None:
+        logger.info(f"No ETag or Last-Modified for {source}, probing without the cache")
+        return run_ffprobe(source)
+    info = probe_cache.get(key)
+    metrics.cache_lookup('probe', hit=info is not None)
+    if info is not None:
+        logger.info(f"Probe cache hit for {source}")
+        return info
+
+    info = run_ffprobe(source)
+    probe_cache.set(key, info)
+    probe_cache.set(probe_cache.latest_key(source), info)
+    return info
+
+
+def cached_probe(source: str) -> Optional[MediaInfo]:
+    """The last probe result cached for ``source``, or None; never runs ffprobe or contacts the source
+
+    The result may describe an older version of the source, so it is only
+    fit for estimates made before the job runs.
+    """
+    info = probe_cache.get(probe_cache.latest_key(source))
+    metrics.cache_lookup('probe', hit=info is not None)
+    return info
+
+
+def probe_keyframe_times(source: str) -> List[float]:
+    """Presentation times of the video keyframes in ``source``, read from packet flags without decoding"""
+    cmd = [
+        "ffprobe",
+        "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags",
+        "-of", "csv=p=0",
+        source
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    keyframes = []
+    for line in result.stdout.splitlines():
+        pts_time, _, flags = line.partition(',')
+        if 'K' in flags:
+            try:
+                keyframes.append(float(pts_time))
+            except ValueError:
+                continue
+    return sorted(keyframes)
+
+
+def invalidate_probe(source: str):
+    """Drop any cached probe result for ``source``"""
+    key = probe_cache.source_key(source)
+    if key is not None:
+        probe_cache.invalidate(key)
+    probe_cache.invalidate(probe_cache.latest_key(source))
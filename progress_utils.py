@@ -0,0 +1,297 @@
+import os
+import time
+import shlex
+import logging
+import selectors
+import threading
+import subprocess
+
+from typing import List, Dict, Any, Optional, Union, Tuple, IO, Callable
+
+from probe_utils import cached_probe, probe_media
+
+logger = logging.getLogger(__name__)
+
+
+def parse_time_value(value: Any) -> Optional[float]:
+    """Parse an ffmpeg duration (seconds, ``HH:MM:SS.frac`` or ``MM:SS.frac``) to seconds"""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        if ':' not in value:
+            return float(value.rstrip('s'))
+        seconds = 0.0
+        for part in value.split(':'):
+            seconds = seconds * 60 + float(part)
+        return seconds
+    except ValueError:
+        return None
+
+
+def _arg_value(args: List[str], name: str) -> Optional[str]:
+    value = None
+    for index, arg in enumerate(args[:-1]):
+        if arg == name:
+            value = args[index + 1]
+    return value
+
+
+def estimate_output_duration(input_files: List[Union[str, List[str]]], options: Dict[str, Any],
+                             global_options: Optional[List[str]] = None,
+                             probe_sources: Optional[List[str]] = None,
+                             cached_only: bool = False) -> Optional[float]:
+    """Expected duration of the output, in seconds
+
+    Output ``-t``/``-to`` win when present. Otherwise each input's probed
+    duration is trimmed by its own ``-ss``/``-t``/``-to`` options and the
+    longest one (the shortest with ``-shortest``) is used. Looping inputs are
+    ignored since they have no length of their own.
+
+    Args:
+        input_files: Input items as passed to build_ffmpeg_command
+        options: Output options
+        global_options: Global options, which ffmpeg applies to the first input
+        probe_sources: Paths or URLs to probe for each input, when the item's
+            own path can't be probed (e.g. a FIFO fed by a streamer)
+        cached_only: Use only cached probe results; the duration is unknown
+            when an input has none
+    """
+    start = parse_time_value(options.get('ss')) or 0.0
+    if options.get('t') is not None:
+        return parse_time_value(options['t'])
+    if options.get('to') is not None:
+        end = parse_time_value(options['to'])
+        return end - start if end is not None else None
+
+    global_args = [arg for opt in (global_options or []) for arg in shlex.split(opt)]
+    durations = []
+    for index, item in enumerate(input_files):
+        args = list(item[:-1]) if isinstance(item, list) else []
+        if index == 0:
+            args = global_args + args
+        stream_loop = _arg_value(args, '-stream_loop')
+        if stream_loop is not None and stream_loop != '0':
+            continue
+
+        input_start = parse_time_value(_arg_value(args, '-ss')) or 0.0
+        input_t = parse_time_value(_arg_value(args, '-t'))
+        input_to = parse_time_value(_arg_value(args, '-to'))
+        if input_t is not None:
+            durations.append(input_t)
+            continue
+        if input_to is not None:
+            durations.append(input_to - input_start)
+            continue
+
+        source = probe_sources[index] if probe_sources else (item[-1] if isinstance(item, list) else item)
+        if cached_only:
+            info = cached_probe(source)
+            if info is None:
+                return None
+            if info.duration is not None:
+                durations.append(max(0.0, info.duration - input_start))
+            continue
+        try:
+            duration = probe_media(source).duration
+        except (subprocess.CalledProcessError, OSError, ValueError) as e:
+            logger.warning(f"Could not probe {source} for its duration: {str(e)}")
+            duration = None
+        if duration is not None:
+            durations.append(max(0.0, duration - input_start))
+
+    if not durations:
+        return None
+    duration = min(durations) if options.get('shortest') else max(durations)
+    return max(0.0, duration - start)
+
+
+def add_progress_args(command: List[str], fd: int) -> List[str]:
+    """Send machine-readable progress to file descriptor ``fd`` and silence the human-readable stats line"""
+    return command[:1] + ['-progress', f'pipe:{fd}', '-nostats'] + command[1:]
+
+
+class FfmpegProgressParser:
+    """Streaming parser for ffmpeg's ``-progress`` key=value output
+
+    ffmpeg writes one block of key=value lines per update, terminated by a
+    ``progress=continue`` or ``progress=end`` line. Lines are only split on
+    the first ``=``; a snapshot dict is built once per block.
+    """
+
+    def __init__(self, expected_duration: Optional[float] = None):
+        self.expected_duration = expected_duration if expected_duration and expected_duration > 0 else None
+        self.started_at = time.time()
+        self._block: Dict[str, str] = {}
+
+    def feed(self, line: str) -> Optional[Dict[str, Any]]:
+        """Consume one line and return a progress snapshot when a block completes"""
+        key, sep, value = line.partition('=')
+        if not sep:
+            return None
+        key = key.strip()
+        value = value.strip()
+        if key != 'progress':
+            self._block[key] = value
+            return None
+
+        block, self._block = self._block, {}
+        return self._snapshot(block, finished=(value == 'end'))
+
+    def _snapshot(self, block: Dict[str, str], finished: bool) -> Dict[str, Any]:
+        # out_time_ms is misnamed by ffmpeg and carries microseconds too
+        out_time_us = _to_int(block.get('out_time_us')) or _to_int(block.get('out_time_ms'))
+        out_time = out_time_us / 1_000_000 if out_time_us is not None else None
+        speed = _to_float(block.get('speed', '').rstrip('x'))
+
+        progress_percent = None
+        eta_seconds = None
+        if self.expected_duration and out_time is not None:
+            progress_percent = round(min(100.0, out_time / self.expected_duration * 100), 2)
+            remaining = max(0.0, self.expected_duration - out_time)
+            if speed:
+                eta_seconds = round(remaining / speed, 1)
+            elif out_time > 0:
+                eta_seconds = round(remaining * (time.time() - self.started_at) / out_time, 1)
+        if finished:
+            progress_percent = 100.0
+            eta_seconds = 0.0
+
+        return {
+            'time': block.get('out_time'),
+            'out_time_us': out_time_us,
+            'frame': _to_int(block.get('frame')),
+            'fps': _to_float(block.get('fps')),
+            'bitrate': block.get('bitrate'),
+            'total_size': _to_int(block.get('total_size')),
+            'speed': speed,
+            'dup_frames': _to_int(block.get('dup_frames')),
+            'drop_frames': _to_int(block.get('drop_frames')),
+            'expected_duration': self.expected_duration,
+            'eta_seconds': eta_seconds,
+            'progress_percent': progress_percent,
+        }
+
+
+def open_progress_pipe() -> Tuple[IO[str], int]:
+    """Create the pipe ffmpeg writes progress to
+
+    Returns:
+        Tuple of the line-iterable read end and the write file descriptor to
+        pass to the child through ``pass_fds``; close it in the parent once
+        ffmpeg has started
+    """
+    read_fd, write_fd = os.pipe()
+    return os.fdopen(read_fd, 'r', encoding='utf-8', errors='replace'), write_fd
+
+
+class ProgressMonitor:
+    """Single selector thread per process that multiplexes the progress pipes
+    of every running ffmpeg job
+
+    Each registered pipe gets its own FfmpegProgressParser; the callback is
+    invoked with the newest snapshot as soon as its block is complete. A pipe
+    is unregistered and closed on EOF, i.e. when ffmpeg exits.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _ensure_started(self):
+        # Set up lazily and per pid: Celery forks its pool processes after
+        # import, and they must not share one epoll instance or wake pipe
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._selector = selectors.DefaultSelector()
+        self._pending: List[Tuple[str, int, Any]] = []
+        self._wake_read, self._wake_write = os.pipe()
+        os.set_blocking(self._wake_read, False)
+        self._selector.register(self._wake_read, selectors.EVENT_READ, None)
+        threading.Thread(target=self._run, name="ProgressMonitor", daemon=True).start()
+
+    def register(self, fd: int, parser: FfmpegProgressParser, callback: Callable[[Dict[str, Any]], None]) -> Dict[str, Any]:
+        """Start watching ``fd`` and return the handle to pass to unregister"""
+        handle = {'parser': parser, 'callback': callback, 'buffer': b''}
+        self._submit('register', fd, handle)
+        return handle
+
+    def unregister(self, fd: int, handle: Dict[str, Any]):
+        """Stop watching ``fd`` and close it, unless EOF already did"""
+        self._submit('unregister', fd, handle)
+
+    def _submit(self, action: str, fd: int, handle: Dict[str, Any]):
+        with self._lock:
+            self._ensure_started()
+            self._pending.append((action, fd, handle))
+        os.write(self._wake_write, b'\0')
+
+    def _apply_pending(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for action, fd, handle in pending:
+            if action == 'register':
+                self._selector.register(fd, selectors.EVENT_READ, handle)
+            else:
+                self._close(fd, handle)
+
+    def _close(self, fd: int, handle: Dict[str, Any]):
+        # The fd number may already belong to a newer registration once EOF
+        # closed it, so only close it if it's still ours
+        try:
+            key = self._selector.get_key(fd)
+        except (KeyError, ValueError):
+            return
+        if key.data is not handle:
+            return
+        self._selector.unregister(fd)
+        os.close(fd)
+
+    def _run(self):
+        while True:
+            for key, _ in self._selector.select():
+                if key.data is None:
+                    try:
+                        os.read(self._wake_read, 4096)
+                    except BlockingIOError:
+                        pass
+                    self._apply_pending()
+                    continue
+                self._read(key)
+
+    def _read(self, key):
+        chunk = os.read(key.fd, 65536)
+        if not chunk:
+            self._close(key.fd, key.data)
+            return
+        handle = key.data
+        lines = (handle['buffer'] + chunk).split(b'\n')
+        handle['buffer'] = lines.pop()
+        latest = None
+        for line in lines:
+            snapshot = handle['parser'].feed(line.decode('utf-8', errors='replace'))
+            if snapshot is not None:
+                latest = snapshot
+        if latest is not None:
+            try:
+                handle['callback'](latest)
+            except Exception as e:
+                logger.error(f"Progress callback failed: {str(e)}")
+
+
+progress_monitor = ProgressMonitor()
+
+
+def _to_int(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_float(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
@@ -5,20 +5,36 @@ import subprocess
 import random
 import math
 import time
+import tempfile
 from pathlib import Path
-from typing import Optional
-from PIL import Image
+from typing import List, Optional
+from celery.signals import worker_process_init
 from celery_worker import celery_app
-from reddit_utils import create_fancy_thumbnail
-from ffmpeg_utils import ProgressFfmpeg, get_media_duration_seconds
-from webhook_utils import send_webhook_task
+from cpu_budget_utils import cpu_scheduler
+from metrics_utils import metrics
+from ffmpeg_log_utils import FfmpegLog
+from reddit_utils import create_fancy_thumbnail, load_template, prepare_overlay, warm_render_assets
+from ffmpeg_utils import ProgressFfmpeg, download_remote_file_to_temp, get_media_duration_seconds, is_remote_url
+from probe_utils import probe_media
+from webhook_tasks import queue_webhook
 from celery.result import AsyncResult
 from celery import states
 
 from minioclient_utils import minio_client, bucket_name, minio_public_endpoint
+from background_library_utils import BACKGROUND_PROXY_RESOLUTIONS, background_library, pick_start
 
 logger = logging.getLogger(__name__)
 
+
+@worker_process_init.connect
+def warm_reddit_intro_assets(**kwargs):
+    # Decode the template and load the title fonts once per pool process instead of on every render
+    try:
+        warm_render_assets()
+    except Exception as e:
+        logger.error(f"Failed to warm reddit intro assets: {str(e)}")
+
+
 def clean_text_to_folder_name(text: str) -> str:
     text = text.lower()
     text = re.sub(r'[\s!"\'-]+', '_', text)
@@ -41,7 +57,8 @@ def process_reddit_intro_task(
     padding: int,
     audio_url: Optional[str] = None,
     background_video_url: Optional[str] = None,
-    webhook_url: Optional[str] = None
+    webhook_url: Optional[str] = None,
+    background_id: Optional[str] = None
 ):
     """Celery task to generate the Reddit intro video"""
     task_id = self.request.id
@@ -54,19 +71,35 @@ def process_reddit_intro_task(
     logger.info(f"padding: {padding}")
 
     result = {}
+    cpu_allocation = None
+    ffmpeg_log = None
     TEMP_ASSETS_PATH = "temp/assets"
     temp_folder = clean_text_to_folder_name(title)
     Path(f"{TEMP_ASSETS_PATH}/{temp_folder}").mkdir(parents=True, exist_ok=True)
     screenshot_width = int((resolution_x * 90) // 100)
-    title_template = Image.open("assets/title_template.png")
+    title_template = load_template()
 
     logger.info(f"Creating customized title image...")
-    title_img = create_fancy_thumbnail(title_template, title, font_color, padding, subreddit=subreddit)
-    title_img.save(f"{TEMP_ASSETS_PATH}/{temp_folder}/title.png")
+    with metrics.time_phase('reddit_intro', 'render'):
+        title_img = create_fancy_thumbnail(title_template, title, font_color, padding, subreddit=subreddit, font_name=font)
+        title_overlay, overlay_x, overlay_y = prepare_overlay(title_img, screenshot_width, resolution_x, resolution_y)
+        title_overlay.save(f"{TEMP_ASSETS_PATH}/{temp_folder}/title.png")
 
     output_path = f"{TEMP_ASSETS_PATH}/{temp_folder}/{temp_folder}.mp4"
 
     try:
+        if background_id:
+            # A background the caller named is never swapped for another one
+            background = background_library.find(background_id)
+            if background is None:
+                raise ValueError(f"Background {background_id} not found in the library")
+        else:
+            background = background_library.find(background_video_url)
+            if background is None and background_video_url is None:
+                background = background_library.random(f"{resolution_x}x{resolution_y}")
+        if background is not None and background_video_url is None:
+            # Streamed instead when the background has no proxy at this resolution
+            background_video_url = background['source_url']
         if background_video_url is None:
             # TODO: generate green background video            
             background_video_url = "https://storage.charichagaming.com.np/video-storage/Satisfying%20Cake%20Compilation-satisfying-cake.mp4"
@@ -82,48 +115,70 @@ def process_reddit_intro_task(
                         "task_id": task_id,
                         "status": "processing",
                         "progress": progress,
-                        "message": "Generating Reddit intro video..."
+                        "message": "Generating Reddit intro video...",
+                        "cpu": cpu_allocation.to_dict() if cpu_allocation else None
                     }
                 )
+        cpu_allocation = cpu_scheduler.acquire(task_id)
         update_celery_progress(0.0)
 
         with ProgressFfmpeg(float(duration), update_celery_progress) as progress_monitor:
             ffmpeg_cmd = [
                 "ffmpeg", "-y",
+                "-filter_threads", str(cpu_allocation.threads),
+                "-filter_complex_threads", str(cpu_allocation.threads),
                 # "-stream_loop", "-1", "-i", background_video_url,
                 # "-loop", "1", "-framerate", "30", "-i", f"{TEMP_ASSETS_PATH}/{temp_folder}/title.png"
             ]
 
-            bg_duration = get_media_duration_seconds(background_video_url)
-            if bg_duration > duration:
-                max_start_time = bg_duration - duration
-                start_time = random.uniform(0, max_start_time)
-                ffmpeg_cmd.extend([
-                    "-ss", str(start_time),                    
-                    "-i", background_video_url,
-                    "-t", str(duration)
-                ])
+            fade_in_duration = 1
+            fade_out_duration = 2
+
+            resolution = f"{resolution_x}x{resolution_y}"
+            proxy_path = background_library.local_proxy(background, resolution) if background else None
+            if background is not None:
+                metrics.cache_lookup('background_proxy', hit=proxy_path is not None)
+            if proxy_path:
+                # Library proxy: already at the target resolution with a keyframe every
+                # BACKGROUND_PROXY_GOP_SECONDS, so the seek is a cheap local keyframe seek
+                keyframes = background_library.keyframes(background, resolution)
+                start_time, loop = pick_start(background, resolution, duration + fade_in_duration + fade_out_duration, keyframes)
+                logger.info(f"Using background {background['id']} proxy {resolution} from {start_time}s")
+                if loop:
+                    ffmpeg_cmd.extend(["-stream_loop", "-1", "-i", proxy_path])
+                else:
+                    ffmpeg_cmd.extend(["-ss", str(start_time), "-i", proxy_path])
+                filter_complex_args = []
+                background_label = "[0:v]"
             else:
-                ffmpeg_cmd.extend(["-stream_loop", "-1", "-i", background_video_url])
+                with metrics.time_phase('reddit_intro', 'probe'):
+                    bg_duration = get_media_duration_seconds(background_video_url)
+                if bg_duration > duration:
+                    max_start_time = bg_duration - duration
+                    start_time = random.uniform(0, max_start_time)
+                    ffmpeg_cmd.extend([
+                        "-ss", str(start_time),                    
+                        "-i", background_video_url,
+                        "-t", str(duration)
+                    ])
+                else:
+                    ffmpeg_cmd.extend(["-stream_loop", "-1", "-i", background_video_url])
+                filter_complex_args = [
+                    f"[0:v]scale={resolution_x}:{resolution_y}:force_original_aspect_ratio=increase,crop={resolution_x}:{resolution_y}[bg]"
+                ]
+                background_label = "[bg]"
 
+            # A single pre-scaled frame: overlay keeps showing it after its end (eof_action=repeat),
+            # so FFmpeg decodes the PNG once instead of 60 times per second
             ffmpeg_cmd.extend([
-                "-loop", "1", "-framerate", "60", "-i", f"{TEMP_ASSETS_PATH}/{temp_folder}/title.png"
+                "-i", f"{TEMP_ASSETS_PATH}/{temp_folder}/title.png"
             ])
 
-            fade_in_duration = 1
-            fade_out_duration = 2
-            filter_complex_args = [
-                f"[0:v]scale={resolution_x}:{resolution_y}:force_original_aspect_ratio=increase,crop={resolution_x}:{resolution_y}[bg]",
-                f"[1:v]scale={screenshot_width}:-1[title_scaled]",
-                f"[bg][title_scaled]overlay=(W-w)/2:(H-h)/2,fade=t=in:st=0:d={fade_in_duration},fade=t=out:st={{fade_out_start}}:d={fade_out_duration}[outv]"
-            ]
+            overlay_filter = f"{background_label}[1:v]overlay={overlay_x}:{overlay_y}:eof_action=repeat,fade=t=in:st=0:d={fade_in_duration},fade=t=out:st={{fade_out_start}}:d={fade_out_duration}[outv]"
 
             if audio_url:
-                probe_cmd = [
-                    "ffprobe", "-v", "error", "-select_streams", "a:0", "-show_entries", "stream=duration", "-of", "default=noprint_wrappers=1:nokey=1", audio_url
-                ]
-                probe_result = subprocess.run(probe_cmd, capture_output=True, text=True)
-                audio_duration = float(probe_result.stdout.strip())
+                with metrics.time_phase('reddit_intro', 'probe'):
+                    audio_duration = probe_media(audio_url).stream_duration('audio')
                 logger.info(f"Audio duration: {audio_duration}")
 
                 duration = min(math.ceil(audio_duration), duration) + fade_in_duration
@@ -143,7 +198,7 @@ def process_reddit_intro_task(
             else:
                 fade_out_start = duration - fade_in_duration
 
-            filter_complex_args[2] = filter_complex_args[2].format(fade_out_start=fade_out_start)
+            filter_complex_args.append(overlay_filter.format(fade_out_start=fade_out_start))
             ffmpeg_cmd.extend([
                 "-filter_complex", ";".join(filter_complex_args),
                 "-map", "[outv]",
@@ -151,7 +206,8 @@ def process_reddit_intro_task(
                 "-t", f"{duration}",
                 "-pix_fmt", "yuv420p",
                 "-r", "60",
-                "-progress", progress_monitor.output_file.name,
+                "-threads", str(cpu_allocation.threads),
+                "-progress", progress_monitor.progress_arg,
                 output_path
             ])
             
@@ -169,20 +225,34 @@ def process_reddit_intro_task(
             #     output_path
             # ]
             logger.info(f"Running ffmpeg command: {' '.join(ffmpeg_cmd)}")
-            process = subprocess.Popen(ffmpeg_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-            stdout, stderr = process.communicate()
+            encode_started = time.time()
+            process = subprocess.Popen(ffmpeg_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True,
+                                       pass_fds=progress_monitor.pass_fds)
+            progress_monitor.child_started()
+            cpu_scheduler.attach(task_id, process.pid)
+            ffmpeg_log = FfmpegLog(f"{TEMP_ASSETS_PATH}/{temp_folder}", task_id)
+            ffmpeg_log.drain(process.stderr)
+            ffmpeg_log.join()
+            process.wait()
+            stderr = ffmpeg_log.tail()
+            encode_seconds = time.time() - encode_started
+            metrics.observe('ffmpeg_job_phase_seconds', encode_seconds, job='reddit_intro', phase='encode')
 
             if process.returncode != 0:
                 error_msg = f"Error generating video: {stderr}"
-                raise subprocess.CalledProcessError(returncode=process.returncode, cmd=ffmpeg_cmd, output=stdout, stderr=stderr)
+                raise subprocess.CalledProcessError(returncode=process.returncode, cmd=ffmpeg_cmd, stderr=stderr)
 
             update_celery_progress(1.0)    
             logger.info(f"Video generated successfully: {output_path}")
 
-            minio_client.fput_object(bucket_name, f"{temp_folder}/reddit_intro.mp4", output_path)
+            metrics.observe('ffmpeg_encode_speed_ratio', duration / encode_seconds, job='reddit_intro')
+            with metrics.time_phase('reddit_intro', 'upload'):
+                minio_client.fput_object(bucket_name, f"{temp_folder}/reddit_intro.mp4", output_path)
+            metrics.inc('ffmpeg_output_bytes', Path(output_path).stat().st_size, job='reddit_intro')
             output_url = f"{minio_public_endpoint}/{bucket_name}/{temp_folder}/reddit_intro.mp4"
             logger.info(f"Video uploaded to MinIO: {output_url}")
             result["output_url"] = output_url
+            log_url = ffmpeg_log.publish(success=True)
             
             self.update_state(
                 state=states.SUCCESS,
@@ -190,7 +260,9 @@ def process_reddit_intro_task(
                     "task_id": task_id,
                     "status": "completed",
                     "output_url": output_url,                    
-                    "message": "Reddit intro video generated successfully"
+                    "message": "Reddit intro video generated successfully",
+                    "cpu": cpu_allocation.to_dict(),
+                    "log_url": log_url
                 }
             )
 
@@ -198,14 +270,15 @@ def process_reddit_intro_task(
                 "task_id": task_id,
                 "status": "completed",
                 "output_url": output_url,
-                "message": "Reddit intro video generated successfully"                
+                "message": "Reddit intro video generated successfully",
+                "cpu": cpu_allocation.to_dict(),
+                "log_url": log_url
             }
             logger.info(f"Result: {json.dumps(result, indent=4)}")
             return result
     except subprocess.CalledProcessError as e:
         logger.error(f"Error generating video: {e}")
-        logger.error(f"FFmpeg stdout output: {e.stdout}")
-        logger.error(f"FFmpeg stderr output: {e.stderr}")
+        logger.error(f"FFmpeg stderr output (last lines): {e.stderr}")
         self.update_state(
             state=states.FAILURE,
             meta={
@@ -214,6 +287,7 @@ def process_reddit_intro_task(
                 "task_id": task_id,
                 "status": "failed",
                 "stderr": e.stderr,
+                "log_url": ffmpeg_log.publish(success=False) if ffmpeg_log else None,
                 # "progress": self.request.meta.get("progress", 0),
                 "message": "Error generating Reddit intro video"
             }
@@ -225,12 +299,21 @@ def process_reddit_intro_task(
             meta={
                 "task_id": task_id,
                 "status": "failed",
+                "error": str(e),
+                "log_url": ffmpeg_log.publish(success=False) if ffmpeg_log else None,
                 # "progress": self.request.meta.get("progress", 0),
                 "message": "Error generating Reddit intro video"
             }
         )
     finally:
+        if cpu_allocation is not None:
+            try:
+                cpu_scheduler.release(task_id)
+            except OSError as e:
+                logger.error(f"Failed to release CPU allocation: {str(e)}")
         logger.info(f"Cleaning up temporary assets...")
+        if ffmpeg_log is not None:
+            ffmpeg_log.remove()
         # shutil.rmtree(temp_assets_path)
         logger.info(f"Cleaned up temporary assets")
 
@@ -242,4 +325,56 @@ def process_reddit_intro_task(
                 "task_info": current_task_result.info if current_task_result.info else "unknown",
                 "result": result
             }
-            send_webhook_task(webhook_url, payload, task_id)
+            with metrics.time_phase('reddit_intro', 'webhook'):
+                queue_webhook(webhook_url, payload, task_id)
+
+
+@celery_app.task(bind=True)
+def ingest_background_task(self, url: str, name: Optional[str] = None, resolutions: Optional[List[str]] = None):
+    """Celery task to add a background video to the library as pre-transcoded proxies"""
+    task_id = self.request.id
+    resolutions = resolutions or BACKGROUND_PROXY_RESOLUTIONS
+    logger.info(f"Ingesting background {url} at {resolutions}")
+
+    def report(status: str, done: int):
+        self.update_state(state='PROGRESS', meta={
+            'progress': {
+                'status': status,
+                'progress_percent': round(done / (len(resolutions) + 1) * 100, 2),
+            }
+        })
+
+    done = [0]
+
+    def on_proxy(resolution: str):
+        done[0] += 1
+        report(f"transcoding {resolution}", done[0])
+
+    try:
+        with tempfile.TemporaryDirectory(prefix="background-") as temp_dir:
+            report('downloading', 0)
+            source = download_remote_file_to_temp(url, temp_dir) if is_remote_url(url) else url
+            duration = probe_media(source).duration
+            entry = background_library.ingest(source, url, name=name, resolutions=resolutions,
+                                              duration=duration, on_progress=on_proxy)
+        return {
+            'success': True,
+            'background_id': entry['id'],
+            'resolutions': list(entry['proxies']),
+            'duration': entry['duration'],
+            'message': 'Background ingested successfully',
+        }
+    except subprocess.CalledProcessError as e:
+        logger.error(f"Error ingesting background {url}: {e.stderr}")
+        return {
+            'success': False,
+            'error': e.stderr,
+            'message': 'FFmpeg error while transcoding background',
+        }
+    except Exception as e:
+        logger.error(f"Error ingesting background {url}: {str(e)}")
+        return {
+            'success': False,
+            'error': str(e),
+            'message': 'Error ingesting background',
+        }
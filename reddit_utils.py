@@ -1,23 +1,67 @@
 import os
-import textwrap
+import string
 import logging
 
-from PIL import Image, ImageDraw, ImageFont
-from font_utils import getheight
+from functools import lru_cache
+from PIL import Image, ImageDraw
+from font_utils import get_font, font_registry, DEFAULT_FONT
+from layout_utils import fit_text, draw_layout, get_glyph_metrics
 
 logger = logging.getLogger(__name__)
 
+TITLE_TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "title_template.png")
+# Area of the title card the title is fitted into: (left, top, right, bottom)
+TITLE_TEXT_BOX = (120, 925, 960, 1085)
+TITLE_MAX_FONT_SIZE = 47
+TITLE_MIN_FONT_SIZE = 20
+USERNAME_FONT_SIZE = 30
 
-def create_fancy_thumbnail(image, text, text_color, padding, wrap=35, subreddit="zeroface.co"):
+
+@lru_cache(maxsize=8)
+def _load_template(path: str) -> Image.Image:
+    image = Image.open(path)
+    image.load()
+    return image
+
+
+def load_template(path: str = TITLE_TEMPLATE_PATH) -> Image.Image:
+    """Fresh copy of a decoded template image; the decoded original is cached per process"""
+    return _load_template(path).copy()
+
+
+def warm_render_assets(font_names=(DEFAULT_FONT,)):
+    """Decode the title template and load the title fonts ahead of the first render"""
+    font_registry.entries()
+    _load_template(TITLE_TEMPLATE_PATH)
+    get_font(DEFAULT_FONT, USERNAME_FONT_SIZE)
+    for name in font_names:
+        get_glyph_metrics(name).width(string.printable)
+
+
+def prepare_overlay(image: Image.Image, width: int, canvas_width: int, canvas_height: int):
+    """Scale an overlay to ``width`` and crop it to its visible pixels
+
+    Matches centering the scaled image on a canvas_width x canvas_height frame,
+    but leaves FFmpeg a single small frame to blend instead of scaling the
+    full-size image on every output frame.
+
+    Returns:
+        Tuple of the cropped image and its x, y position on the canvas
+    """
+    height = round(image.height * width / image.width)
+    scaled = image.resize((width, height), Image.LANCZOS)
+    bbox = scaled.getchannel("A").getbbox() if "A" in scaled.getbands() else None
+    left, top = (canvas_width - width) // 2, (canvas_height - height) // 2
+    if bbox is None:
+        return scaled, left, top
+    return scaled.crop(bbox), left + bbox[0], top + bbox[1]
+
+
+def create_fancy_thumbnail(image, text, text_color, padding, subreddit="zeroface.co", font_name=DEFAULT_FONT):
     logger.info(f"Creating fancy thumbnail for: {text}")
-    font_title_size = 47
-    font = ImageFont.truetype(os.path.join("fonts", "Roboto-Bold.ttf"), font_title_size)
-    image_width, image_height = image.size
-    lines = textwrap.wrap(text, width=wrap)
-    y = (image_height / 2) - (((getheight(font, text) + (len(lines) * padding) / len(lines)) * len(lines)) / 2) + 30
     draw = ImageDraw.Draw(image)
 
-    username_font = ImageFont.truetype(os.path.join("fonts", "Roboto-Bold.ttf"), 30)
+    username_font = get_font(DEFAULT_FONT, USERNAME_FONT_SIZE)
     draw.text(
         (205, 825),
         subreddit,
@@ -26,24 +70,9 @@ def create_fancy_thumbnail(image, text, text_color, padding, wrap=35, subreddit=
         align="left",
     )
 
-    if len(lines) == 3:
-        lines = textwrap.wrap(text, width=wrap + 10)
-        font_title_size = 40
-        font = ImageFont.truetype(os.path.join("fonts", "Roboto-Bold.ttf"), font_title_size)
-        y = (image_height / 2) - (((getheight(font, text) + (len(lines) * padding) / len(lines)) * len(lines)) / 2) + 35
-    elif len(lines) == 4:
-        lines = textwrap.wrap(text, width=wrap + 10)
-        font_title_size = 35
-        font = ImageFont.truetype(os.path.join("fonts", "Roboto-Bold.ttf"), font_title_size)
-        y = (image_height / 2) - (((getheight(font, text) + (len(lines) * padding) / len(lines)) * len(lines)) / 2) + 40
-    elif len(lines) > 4:
-        lines = textwrap.wrap(text, width=wrap + 10)
-        font_title_size = 30
-        font = ImageFont.truetype(os.path.join("fonts", "Roboto-Bold.ttf"), font_title_size)
-        y = (image_height / 2) - (((getheight(font, text) + (len(lines) * padding) / len(lines)) * len(lines)) / 2) + 30
-
-    for line in lines:
-        draw.text((120, y), line, font=font, fill=text_color, align="left")
-        y += getheight(font, line) + padding
+    left, top, right, bottom = TITLE_TEXT_BOX
+    layout = fit_text(text, font_name, right - left, bottom - top,
+                      max_size=TITLE_MAX_FONT_SIZE, min_size=TITLE_MIN_FONT_SIZE, line_gap=padding)
+    draw_layout(draw, layout, TITLE_TEXT_BOX, fill=text_color)
 
     return image
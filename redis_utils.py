@@ -0,0 +1,6 @@
+import os
+import redis
+
+# Shared client for application state kept next to the Celery result backend
+redis_url = os.environ.get('APP_REDIS_URL', os.environ.get('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0'))
+redis_client = redis.Redis.from_url(redis_url, socket_timeout=5, socket_connect_timeout=5)
@@ -0,0 +1,181 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import redis
+
+from typing import List, Dict, Any, Optional, Union
+from minio.commonconfig import CopySource
+from minio.error import S3Error
+
+from ffmpeg_utils import build_ffmpeg_command
+from probe_utils import source_digest
+from redis_utils import redis_client
+from minioclient_utils import minio_client, bucket_name, minio_public_endpoint
+
+logger = logging.getLogger(__name__)
+
+RENDER_CACHE_ENABLED = os.environ.get('RENDER_CACHE_ENABLED', 'True').lower() == 'true'
+RENDER_CACHE_MAX_BYTES = int(os.environ.get('RENDER_CACHE_MAX_BYTES', str(50 * 1024 ** 3)))
+RENDER_CACHE_PREFIX = os.environ.get('RENDER_CACHE_PREFIX', 'render-cache/')
+
+_ENTRY_KEY = 'render_cache:entry:{}'
+_LRU_KEY = 'render_cache:lru'
+_BYTES_KEY = 'render_cache:bytes'
+
+# Options that only affect logging, overwrite behaviour or threading, not the encoded output
+_VOLATILE_FLAGS = {'-y', '-n', '-hide_banner', '-stats', '-nostats', '-nostdin'}
+_VOLATILE_OPTIONS = {'-loglevel', '-v', '-progress', '-stats_period', '-threads', '-filter_threads', '-filter_complex_threads'}
+
+
+def canonicalize_command(command: List[str]) -> List[str]:
+    """Drop arguments that don't change the encoded output"""
+    canonical = []
+    skip_next = False
+    for arg in command:
+        if skip_next:
+            skip_next = False
+            continue
+        if arg in _VOLATILE_FLAGS:
+            continue
+        if arg in _VOLATILE_OPTIONS:
+            skip_next = True
+            continue
+        canonical.append(arg)
+    return canonical
+
+
+def compute_render_fingerprint(input_files: List[Union[str, List[str]]], output_file: str,
+                               options: Dict[str, Any], global_options: List[str]) -> Optional[str]:
+    """Deterministic fingerprint of a compose job
+
+    Built from the canonicalized ffmpeg command with every input replaced by a
+    digest of its content. Returns None when an input can't be identified
+    reliably (a remote URL without ETag/Last-Modified or a missing local file),
+    in which case the job must not be served from the cache.
+    """
+    digested_inputs = []
+    for item in input_files:
+        path_or_url = item[-1] if isinstance(item, list) else item
+        try:
+            # Whole-file hashes: a sampled digest would serve a stale render for a file edited in the middle
+            digest = source_digest(path_or_url, require_validator=True, full_content=True)
+        except OSError:
+            digest = None
+        if digest is None:
+            logger.info(f"Input {path_or_url} has no stable digest, render cache skipped")
+            return None
+        placeholder = f"input:{digest}"
+        digested_inputs.append(item[:-1] + [placeholder] if isinstance(item, list) else placeholder)
+
+    extension = os.path.splitext(output_file)[1].lower()
+    command = build_ffmpeg_command(
+        input_files=digested_inputs,
+        output_file=f"output{extension}",
+        options=options,
+        global_options=list(global_options)
+    )
+    canonical = json.dumps(canonicalize_command(command), separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class RenderCache:
+    """Finished renders kept under a dedicated MinIO prefix, indexed in Redis.
+
+    Each entry is a server-side copy of a successful output. The total size is
+    bounded by max_bytes and the least recently served entries are evicted first.
+    """
+
+    def __init__(self, client, bucket: str, prefix: str, max_bytes: int, redis):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.redis = redis
+
+    def _url(self, object_name: str) -> str:
+        return f"{minio_public_endpoint}/{self.bucket}/{object_name}"
+
+    def lookup(self, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """Return the cached entry for ``fingerprint`` and mark it as used"""
+        entry = self.redis.hgetall(_ENTRY_KEY.format(fingerprint))
+        if not entry:
+            return None
+        entry = {k.decode('utf-8'): v.decode('utf-8') for k, v in entry.items()}
+        try:
+            self.client.stat_object(self.bucket, entry['object_name'])
+        except S3Error as e:
+            if e.code != 'NoSuchKey':
+                raise
+            # Object removed behind our back, drop the stale index entry
+            logger.warning(f"Render cache object {entry['object_name']} is gone, dropping entry")
+            self._forget(fingerprint, int(entry.get('size', 0)))
+            return None
+        self.redis.zadd(_LRU_KEY, {fingerprint: time.time()})
+        entry['output_url'] = self._url(entry['object_name'])
+        return entry
+
+    def store(self, fingerprint: str, source_object: str) -> Optional[Dict[str, Any]]:
+        """Copy a finished output into the cache and enforce the quota"""
+        if self.redis.exists(_ENTRY_KEY.format(fingerprint)):
+            return None
+        extension = os.path.splitext(source_object)[1].lower()
+        object_name = f"{self.prefix}{fingerprint}{extension}"
+        self.client.copy_object(self.bucket, object_name, CopySource(self.bucket, source_object))
+        size = self.client.stat_object(self.bucket, object_name).size
+        if size > self.max_bytes:
+            self.client.remove_object(self.bucket, object_name)
+            return None
+
+        entry = {'object_name': object_name, 'size': size, 'created_at': time.time()}
+        entry_key = _ENTRY_KEY.format(fingerprint)
+        # Two jobs with the same fingerprint can both get here and copy to the same
+        # object; only the one that creates the entry counts its size against the quota
+        with self.redis.pipeline() as pipe:
+            try:
+                pipe.watch(entry_key)
+                if pipe.exists(entry_key):
+                    return None
+                pipe.multi()
+                pipe.hset(entry_key, mapping=entry)
+                pipe.zadd(_LRU_KEY, {fingerprint: time.time()})
+                pipe.incrby(_BYTES_KEY, size)
+                pipe.execute()
+            except redis.exceptions.WatchError:
+                return None
+        logger.info(f"Stored render {fingerprint} in cache as {object_name} ({size} bytes)")
+        self.evict()
+        return entry
+
+    def copy_to(self, entry: Dict[str, Any], object_name: str) -> str:
+        """Server-side copy of a cached render to the object a job asked for, returning its URL"""
+        self.client.copy_object(self.bucket, object_name, CopySource(self.bucket, entry['object_name']))
+        return self._url(object_name)
+
+    def evict(self):
+        """Evict least recently used renders until the cache fits in max_bytes"""
+        while int(self.redis.get(_BYTES_KEY) or 0) > self.max_bytes:
+            oldest = self.redis.zrange(_LRU_KEY, 0, 0)
+            if not oldest:
+                break
+            fingerprint = oldest[0].decode('utf-8')
+            entry = self.redis.hgetall(_ENTRY_KEY.format(fingerprint))
+            size = int(entry.get(b'size', 0)) if entry else 0
+            if entry:
+                try:
+                    self.client.remove_object(self.bucket, entry[b'object_name'].decode('utf-8'))
+                except Exception as e:
+                    logger.error(f"Failed to remove evicted render {fingerprint}: {str(e)}")
+            self._forget(fingerprint, size)
+            logger.info(f"Evicted render {fingerprint} from cache ({size} bytes)")
+
+    def _forget(self, fingerprint: str, size: int):
+        pipe = self.redis.pipeline()
+        pipe.delete(_ENTRY_KEY.format(fingerprint))
+        pipe.zrem(_LRU_KEY, fingerprint)
+        pipe.decrby(_BYTES_KEY, size)
+        pipe.execute()
+
+
+render_cache = RenderCache(minio_client, bucket_name, RENDER_CACHE_PREFIX, RENDER_CACHE_MAX_BYTES, redis_client)
@@ -0,0 +1,339 @@
+import os
+import re
+import json
+import time
+import logging
+import subprocess
+import redis
+
+from dataclasses import dataclass, asdict, field
+from typing import List, Dict, Any, Optional, Union, Tuple
+from celery import states
+from celery.signals import task_prerun, task_postrun, task_revoked
+
+from probe_utils import cached_probe, probe_media
+from progress_utils import estimate_output_duration
+from redis_utils import redis_client
+
+logger = logging.getLogger(__name__)
+
+# Jobs costing up to this many reference seconds go to the interactive lane
+ROUTING_INTERACTIVE_MAX_COST = float(os.environ.get('ROUTING_INTERACTIVE_MAX_COST', '60'))
+# Jobs costing up to this many reference seconds go to the standard lane, costlier ones to bulk
+ROUTING_STANDARD_MAX_COST = float(os.environ.get('ROUTING_STANDARD_MAX_COST', '1800'))
+# Finished jobs whose estimate and actual runtime are kept for accuracy analysis
+JOB_COST_HISTORY_SIZE = int(os.environ.get('JOB_COST_HISTORY_SIZE', '10000'))
+
+_JOB_COST_KEY = 'job_cost:{}'
+JOB_COST_HISTORY_KEY = 'job_cost_history'
+# Queued and running compose jobs with their lane and predicted runtime
+JOB_BACKLOG_KEY = 'job_backlog'
+_JOB_COST_TTL = 7 * 24 * 3600
+
+# One reference second is the work of encoding one second of 1080p30 with libx264 -preset medium
+_REFERENCE_PIXEL_RATE = 1920 * 1080 * 30
+
+# Relative encode cost of x264/x265 presets, medium being 1
+_PRESET_FACTORS = {
+    'ultrafast': 0.15, 'superfast': 0.25, 'veryfast': 0.35, 'faster': 0.5, 'fast': 0.7,
+    'medium': 1.0, 'slow': 1.6, 'slower': 3.0, 'veryslow': 6.0, 'placebo': 15.0,
+}
+# Relative cost of encoders at their default preset, libx264 being 1
+_CODEC_FACTORS = {
+    'copy': 0.02, 'libx264': 1.0, 'libx265': 3.0, 'libvpx': 1.5, 'libvpx-vp9': 4.0,
+    'libaom-av1': 10.0, 'libsvtav1': 2.5, 'h264_nvenc': 0.2, 'hevc_nvenc': 0.25, 'av1_nvenc': 0.3,
+    'h264_qsv': 0.25, 'hevc_qsv': 0.3, 'h264_vaapi': 0.25, 'mpeg4': 0.3, 'prores_ks': 0.6, 'gif': 0.5,
+}
+_PRESET_CODECS = {'libx264', 'libx265'}
+# Filters that cost noticeably more than a plain scale/crop, in multiples of one
+_FILTER_WEIGHTS = {
+    'minterpolate': 20.0, 'nlmeans': 15.0, 'vidstabdetect': 4.0, 'vidstabtransform': 3.0, 'deshake': 4.0,
+    'subtitles': 2.0, 'ass': 2.0, 'drawtext': 1.5, 'zoompan': 3.0, 'xfade': 2.0, 'gblur': 2.0, 'boxblur': 1.5,
+    'overlay': 1.0, 'scale': 0.5, 'crop': 0.2, 'fps': 0.2, 'setsar': 0.0, 'format': 0.1, 'null': 0.0,
+}
+_DEFAULT_FILTER_WEIGHT = 1.0
+_FILTER_OPTION_KEYS = ('filter_complex', 'lavfi', 'vf', 'filter:v', 'af', 'filter:a', 'filter')
+_SCALE_PATTERN = re.compile(r"scale(?:_cuda|_npp)?=(?:w=)?(-?\d+)[:x](?:h=)?(-?\d+)")
+_FPS_PATTERN = re.compile(r"\bfps=(?:fps=)?(\d+(?:\.\d+)?)")
+
+
+@dataclass
+class Lane:
+    name: str
+    queue: str
+
+
+LANES = {
+    'interactive': Lane('interactive', 'interactive'),
+    'standard': Lane('standard', 'standard'),
+    'bulk': Lane('bulk', 'bulk'),
+}
+DEFAULT_LANE = LANES['standard']
+
+
+@dataclass
+class JobCost:
+    """Estimated cost of a compose job and the features it was derived from"""
+    cost: Optional[float]
+    lane: str
+    duration: Optional[float] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    fps: Optional[float] = None
+    codec: Optional[str] = None
+    preset: Optional[str] = None
+    filter_count: int = 0
+    filter_weight: float = 0.0
+    filters: List[str] = field(default_factory=list)
+    # Filled in by prediction_utils from the trained runtime model
+    predicted_seconds: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def codec_factor(codec: Optional[str], preset: Optional[str]) -> float:
+    """Relative cost of an encoder and preset, libx264 -preset medium being 1; None is audio only"""
+    if codec is None:
+        return 0.02
+    factor = _CODEC_FACTORS.get(codec, 1.0)
+    if codec in _PRESET_CODECS:
+        factor *= _PRESET_FACTORS.get(preset or 'medium', 1.0)
+    return factor
+
+
+def lane_for_cost(cost: Optional[float]) -> Lane:
+    if cost is None:
+        return DEFAULT_LANE
+    if cost <= ROUTING_INTERACTIVE_MAX_COST:
+        return LANES['interactive']
+    if cost <= ROUTING_STANDARD_MAX_COST:
+        return LANES['standard']
+    return LANES['bulk']
+
+
+def _filter_names(options: Dict[str, Any]) -> List[str]:
+    # Imported here: segment_tasks pulls in the Celery app
+    from segment_tasks import filtergraph_filter_names
+    names = []
+    for key in _FILTER_OPTION_KEYS:
+        graphs = options.get(key)
+        if graphs is None:
+            continue
+        for graph in graphs if isinstance(graphs, list) else [graphs]:
+            names.extend(filtergraph_filter_names(str(graph)))
+    return names
+
+
+def _filter_graphs(options: Dict[str, Any]) -> str:
+    return ';'.join(
+        str(graph)
+        for key in _FILTER_OPTION_KEYS if options.get(key) is not None
+        for graph in (options[key] if isinstance(options[key], list) else [options[key]])
+    )
+
+
+def _video_codec(options: Dict[str, Any]) -> Optional[str]:
+    if options.get('vn'):
+        return None
+    for key in ('c:v', 'codec:v', 'vcodec', 'c', 'codec'):
+        if options.get(key):
+            return str(options[key])
+    return 'libx264'
+
+
+def _output_geometry(input_files: List[Union[str, List[str]]], options: Dict[str, Any],
+                     graphs: str, cached_only: bool = False) -> Tuple[Optional[int], Optional[int], Optional[float]]:
+    """Output width, height and frame rate from the options, the filters or the first video input"""
+    width = height = fps = None
+    source_width = source_height = source_fps = None
+    for item in input_files:
+        source = item[-1] if isinstance(item, list) else item
+        if cached_only:
+            info = cached_probe(source)
+            stream = info.first_stream('video') if info is not None else None
+            if stream is not None and stream.width:
+                source_width, source_height, source_fps = stream.width, stream.height, stream.frame_rate
+                break
+            continue
+        try:
+            stream = probe_media(source).first_stream('video')
+        except (subprocess.CalledProcessError, OSError, ValueError) as e:
+            logger.warning(f"Could not probe {source} for its resolution: {str(e)}")
+            continue
+        if stream is not None and stream.width:
+            source_width, source_height, source_fps = stream.width, stream.height, stream.frame_rate
+            break
+
+    if options.get('s') and 'x' in str(options['s']):
+        width, height = (int(value) for value in str(options['s']).split('x', 1))
+    else:
+        scales = _SCALE_PATTERN.findall(graphs)
+        if scales:
+            width, height = (int(value) for value in scales[-1])
+            if source_width and source_height:
+                # -1/-2 keep the aspect ratio of the input
+                if width < 0 < height:
+                    width = round(height * source_width / source_height)
+                elif height < 0 < width:
+                    height = round(width * source_height / source_width)
+            if width < 0 or height < 0:
+                width, height = max(width, height), max(width, height)
+    if width is None:
+        width, height = source_width, source_height
+
+    if options.get('r'):
+        try:
+            fps = float(options['r'])
+        except ValueError:
+            fps = None
+    if fps is None:
+        rates = _FPS_PATTERN.findall(graphs)
+        fps = float(rates[-1]) if rates else source_fps
+    return width, height, fps
+
+
+def estimate_job_cost(input_files: List[Union[str, List[str]]], options: Dict[str, Any],
+                      global_options: Optional[List[str]] = None, cached_only: bool = False) -> JobCost:
+    """Estimate the cost of a compose job before it is enqueued
+
+    The cost is in reference seconds: the time one encode of 1080p30 with
+    libx264 -preset medium takes per second of output, scaled by the output
+    pixel rate, the encoder and preset, and the weight of the filters used.
+    Probes go through the shared probe cache, which the worker reuses.
+    With ``cached_only`` nothing is probed: inputs the cache has never seen
+    leave the duration, and so the cost, unknown.
+    """
+    graphs = _filter_graphs(options)
+    names = _filter_names(options)
+    filter_weight = sum((_FILTER_WEIGHTS.get(name, _DEFAULT_FILTER_WEIGHT) for name in names), 0.0)
+    duration = estimate_output_duration(input_files, options, global_options, cached_only=cached_only)
+    width, height, fps = _output_geometry(input_files, options, graphs, cached_only)
+    codec = _video_codec(options)
+    preset = str(options['preset']) if options.get('preset') else None
+
+    if duration is None:
+        cost = None
+    else:
+        factor = codec_factor(codec, preset)
+        if codec not in (None, 'copy'):
+            pixel_rate = (width or 1920) * (height or 1080) * (fps or 30)
+            factor *= pixel_rate / _REFERENCE_PIXEL_RATE
+        cost = round(duration * factor * (1 + 0.1 * filter_weight), 2)
+
+    return JobCost(
+        cost=cost, lane=lane_for_cost(cost).name, duration=duration, width=width, height=height, fps=fps,
+        codec=codec, preset=preset, filter_count=len(names), filter_weight=filter_weight, filters=names,
+    )
+
+
+def record_estimates(estimates: Dict[str, JobCost]):
+    """Keep the estimates of enqueued jobs, by task ID, until the jobs finish and move to the history
+
+    The jobs are also added to the backlog, which lasts until they finish or
+    are revoked.
+    """
+    queued_at = time.time()
+    try:
+        pipe = redis_client.pipeline()
+        for task_id, job_cost in estimates.items():
+            pipe.set(
+                _JOB_COST_KEY.format(task_id),
+                json.dumps({'estimate': job_cost.to_dict(), 'queued_at': queued_at}),
+                ex=_JOB_COST_TTL
+            )
+            pipe.hset(JOB_BACKLOG_KEY, task_id, json.dumps({
+                'lane': job_cost.lane,
+                'predicted_seconds': job_cost.predicted_seconds,
+                'queued_at': queued_at,
+                'started_at': None,
+            }))
+        pipe.execute()
+    except redis.exceptions.RedisError as e:
+        logger.error(f"Failed to record cost estimates of {len(estimates)} tasks: {str(e)}")
+
+
+def record_job_start(task_id: str):
+    key = _JOB_COST_KEY.format(task_id)
+    try:
+        pipe = redis_client.pipeline()
+        pipe.get(key)
+        pipe.hget(JOB_BACKLOG_KEY, task_id)
+        raw, backlog_raw = pipe.execute()
+        if raw is None:
+            return
+        started_at = time.time()
+        entry = json.loads(raw)
+        entry.setdefault('started_at', started_at)
+        pipe = redis_client.pipeline()
+        pipe.set(key, json.dumps(entry), ex=_JOB_COST_TTL)
+        if backlog_raw is not None:
+            pipe.hset(JOB_BACKLOG_KEY, task_id, json.dumps({**json.loads(backlog_raw), 'started_at': entry['started_at']}))
+        pipe.execute()
+    except redis.exceptions.RedisError as e:
+        logger.error(f"Failed to record start of task {task_id}: {str(e)}")
+
+
+def record_job_outcome(task_id: str, success: bool):
+    """Move a finished job's estimate to the history along with its actual runtime"""
+    key = _JOB_COST_KEY.format(task_id)
+    try:
+        pipe = redis_client.pipeline()
+        pipe.get(key)
+        pipe.delete(key)
+        pipe.hdel(JOB_BACKLOG_KEY, task_id)
+        raw, deleted, _ = pipe.execute()
+        if raw is None or not deleted:
+            return
+        entry = json.loads(raw)
+        finished_at = time.time()
+        started_at = entry.get('started_at')
+        entry.update({
+            'task_id': task_id,
+            'finished_at': finished_at,
+            'runtime': round(finished_at - started_at, 3) if started_at else None,
+            'wait': round(started_at - entry['queued_at'], 3) if started_at else None,
+            'success': success,
+        })
+        pipe = redis_client.pipeline()
+        pipe.lpush(JOB_COST_HISTORY_KEY, json.dumps(entry))
+        pipe.ltrim(JOB_COST_HISTORY_KEY, 0, JOB_COST_HISTORY_SIZE - 1)
+        pipe.execute()
+    except redis.exceptions.RedisError as e:
+        logger.error(f"Failed to record outcome of task {task_id}: {str(e)}")
+
+
+def discard_job(task_id: str):
+    """Forget a job that will never finish, e.g. a revoked one"""
+    try:
+        pipe = redis_client.pipeline()
+        pipe.delete(_JOB_COST_KEY.format(task_id))
+        pipe.hdel(JOB_BACKLOG_KEY, task_id)
+        pipe.execute()
+    except redis.exceptions.RedisError as e:
+        logger.error(f"Failed to discard task {task_id}: {str(e)}")
+
+
+def job_cost_history(limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Finished jobs with their estimate and actual runtime, newest first"""
+    end = -1 if limit is None else limit - 1
+    return [json.loads(raw) for raw in redis_client.lrange(JOB_COST_HISTORY_KEY, 0, end)]
+
+
+@task_prerun.connect
+def record_routed_task_start(task_id=None, **kwargs):
+    record_job_start(task_id)
+
+
+@task_postrun.connect
+def record_routed_task_outcome(task_id=None, state=None, retval=None, **kwargs):
+    # Segmented encodes finish from their concat or failure callback, which record the outcome
+    if state in states.READY_STATES:
+        success = state == states.SUCCESS and not (isinstance(retval, dict) and retval.get('success') is False)
+        record_job_outcome(task_id, success)
+
+
+@task_revoked.connect
+def discard_revoked_task(request=None, **kwargs):
+    if request is not None:
+        discard_job(request.id)
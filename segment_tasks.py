@@ -0,0 +1,435 @@
+import os
+import re
+import json
+import time
+import shlex
+import logging
+import tempfile
+import subprocess
+from typing import List, Dict, Any, Optional, Tuple, Union
+
+from celery import chord
+from batch_utils import mark_batch_task_done
+from celery_worker import celery_app
+from cpu_budget_utils import cpu_scheduler
+from events_utils import publish_task_event
+from ffmpeg_utils import build_ffmpeg_command, format_command_for_display
+from minioclient_utils import minio_client, bucket_name, minio_public_endpoint
+from probe_utils import probe_media, probe_keyframe_times
+from progress_utils import FfmpegProgressParser, add_progress_args, open_progress_pipe
+from redis_utils import redis_client
+from render_cache_utils import render_cache
+from routing_utils import record_job_outcome
+from webhook_tasks import queue_webhook
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_OBJECT_PREFIX = 'segments/'
+_PROGRESS_KEY = 'segment_progress:{}'
+# Segment and callback task ids of a parent, copied into every progress meta so /stop can revoke them
+_CHILDREN_KEY = 'segment_children:{}'
+
+# Filters that process every frame independently of its position in the
+# stream, so encoding the source in pieces gives the same result as a single
+# pass. Extend with SEGMENT_SAFE_FILTERS (comma separated) or declare a single
+# job safe with segment_safe=true on /compose.
+DEFAULT_SEGMENT_SAFE_FILTERS = {
+    'null', 'anull', 'copy', 'acopy', 'scale', 'scale_cuda', 'scale_npp', 'crop', 'pad', 'setsar', 'setdar',
+    'format', 'aformat', 'hflip', 'vflip', 'transpose', 'rotate', 'eq', 'hue', 'colorbalance', 'curves',
+    'lut', 'lutrgb', 'lutyuv', 'lut3d', 'unsharp', 'boxblur', 'gblur', 'drawbox', 'hwupload', 'hwupload_cuda',
+    'hwdownload', 'volume', 'aresample', 'pan', 'split', 'asplit',
+}
+SEGMENT_SAFE_FILTERS = DEFAULT_SEGMENT_SAFE_FILTERS | {
+    name.strip() for name in os.environ.get('SEGMENT_SAFE_FILTERS', '').split(',') if name.strip()
+}
+
+_FILTER_OPTION_KEYS = {'filter_complex', 'lavfi', 'vf', 'af', 'filter', 'filter:v', 'filter:a'}
+# Options that trim or loop the timeline; jobs using them are encoded in one piece
+_TIMELINE_ARGS = {'-ss', '-sseof', '-t', '-to', '-stream_loop', '-itsoffset'}
+_TIMELINE_OPTIONS = {'ss', 'sseof', 't', 'to', 'frames', 'frames:v', 'vframes', 'itsoffset'}
+# Output options that only concern audio. Segments are encoded without audio and the
+# audio is encoded once, from the whole source, when the segments are concatenated:
+# per-segment AAC would leave its priming samples at every boundary
+_AUDIO_OPTIONS = {'af', 'filter:a', 'acodec', 'ab', 'ar', 'ac', 'aq', 'an', 'sample_fmt', 'channel_layout', 'ch_layout'}
+_AUDIO_FILTERS = {'volume', 'pan', 'loudnorm', 'compand', 'dynaudnorm', 'highpass', 'lowpass', 'bandpass',
+                  'equalizer', 'bass', 'treble', 'silenceremove', 'join', 'channelmap', 'channelsplit'}
+
+
+def split_filtergraph(graph: str) -> List[str]:
+    """Split a filtergraph into filter descriptions, honouring quotes, escapes and brackets"""
+    parts = []
+    current = []
+    quote = False
+    depth = 0
+    escaped = False
+    for char in graph:
+        if escaped:
+            current.append(char)
+            escaped = False
+            continue
+        if char == '\\':
+            escaped = True
+            current.append(char)
+            continue
+        if char == "'":
+            quote = not quote
+        elif not quote and char in '([':
+            depth += 1
+        elif not quote and char in ')]':
+            depth -= 1
+        elif not quote and depth == 0 and char in ',;':
+            parts.append(''.join(current))
+            current = []
+            continue
+        current.append(char)
+    parts.append(''.join(current))
+    return [part.strip() for part in parts if part.strip()]
+
+
+def filtergraph_filter_names(graph: str) -> List[str]:
+    names = []
+    for description in split_filtergraph(graph):
+        description = re.sub(r'^(\[[^\]]*\]\s*)+', '', description)
+        name = re.split(r'[=@\[\s]', description, maxsplit=1)[0]
+        if name:
+            names.append(name)
+    return names
+
+
+def is_segment_safe(options: Dict[str, Any]) -> bool:
+    """Check every filter used by the job against SEGMENT_SAFE_FILTERS"""
+    for key in _FILTER_OPTION_KEYS:
+        graphs = options.get(key)
+        if graphs is None:
+            continue
+        for graph in graphs if isinstance(graphs, list) else [graphs]:
+            unsafe = [name for name in filtergraph_filter_names(str(graph)) if name not in SEGMENT_SAFE_FILTERS]
+            if unsafe:
+                logger.info(f"Filters {unsafe} are not segment-safe")
+                return False
+    return True
+
+
+def is_audio_option(key: str) -> bool:
+    return key in _AUDIO_OPTIONS or key.endswith(':a') or ':a:' in key
+
+
+def split_audio_options(options: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+    """Split a job's output options into video-only segment options and the audio options of the concat step
+
+    The audio options map the audio of the concat step's second input (the
+    source) the way the job mapped it from its only input, or are None when
+    the job outputs no audio.
+    """
+    video_options = {}
+    audio_options = {}
+    for key, value in options.items():
+        if is_audio_option(key):
+            audio_options[key] = value
+        elif key != 'map':
+            video_options[key] = value
+    video_options['an'] = True
+
+    if options.get('an'):
+        return video_options, None
+    maps = options.get('map')
+    if maps is None:
+        # What FFmpeg's default stream selection would have picked
+        audio_options['map'] = ['1:a:0?']
+        return video_options, audio_options
+    maps = [str(item) for item in (maps if isinstance(maps, list) else [maps])]
+    video_options['map'] = [item for item in maps if ':a' not in item]
+    audio_maps = []
+    for item in maps:
+        stream = item.lstrip('-')
+        if stream == '0':
+            audio_maps.append('1:a?')
+        elif stream.startswith('0:a'):
+            audio_maps.append(('-' if item.startswith('-') else '') + '1' + stream[1:])
+    if not audio_maps:
+        return video_options, None
+    audio_options['map'] = audio_maps
+    return video_options, audio_options
+
+
+def _filters_audio(options: Dict[str, Any]) -> bool:
+    """Whether a complex filtergraph of the job processes audio"""
+    for key in ('filter_complex', 'lavfi'):
+        graphs = options.get(key)
+        if graphs is None:
+            continue
+        for graph in graphs if isinstance(graphs, list) else [graphs]:
+            # Errs on the side of audio: a false positive only means encoding in one piece
+            if any(name.startswith('a') or name in _AUDIO_FILTERS for name in filtergraph_filter_names(str(graph))):
+                return True
+    return False
+
+
+def choose_boundaries(keyframes: List[float], total_duration: float, segment_duration: float) -> List[float]:
+    """Pick segment start times on keyframes, roughly every ``segment_duration`` seconds"""
+    starts = [0.0]
+    for keyframe in keyframes:
+        if keyframe >= starts[-1] + segment_duration and total_duration - keyframe >= segment_duration / 2:
+            starts.append(keyframe)
+    return starts
+
+
+def plan_segments(input_files: List[Union[str, List[str]]], options: Dict[str, Any], global_options: List[str],
+                  segment_duration: float, segment_safe: Optional[bool] = None) -> Optional[Dict[str, Any]]:
+    """Work out keyframe-aligned segments for a compose job
+
+    Returns:
+        Segment plan, or None when the job has to be encoded in one piece
+    """
+    if len(input_files) != 1:
+        return None
+    item = input_files[0]
+    source = item[-1] if isinstance(item, list) else item
+    input_options = list(item[:-1]) if isinstance(item, list) else []
+
+    global_args = [arg for opt in global_options for arg in shlex.split(opt)]
+    if _TIMELINE_ARGS.intersection(global_args + input_options) or _TIMELINE_OPTIONS.intersection(options):
+        return None
+    if segment_safe is False or (segment_safe is None and not is_segment_safe(options)):
+        return None
+
+    info = probe_media(source)
+    total_duration = info.duration
+    if not total_duration or total_duration < segment_duration * 2:
+        return None
+
+    # Keyframe pts are absolute while input -ss counts from the container's start_time
+    start_offset = info.start_time or 0.0
+    keyframes = [keyframe - start_offset for keyframe in probe_keyframe_times(source)]
+    starts = choose_boundaries(keyframes, total_duration, segment_duration)
+    if len(starts) < 2:
+        return None
+
+    has_audio = info.first_stream('audio') is not None
+    if has_audio and _filters_audio(options):
+        # Audio and video share the filtergraph, so the audio can't be encoded separately
+        return None
+
+    ends = starts[1:] + [total_duration]
+    return {
+        'source': source,
+        'input_options': input_options,
+        'total_duration': total_duration,
+        'has_audio': has_audio,
+        'segments': [{'start': start, 'duration': end - start} for start, end in zip(starts, ends)],
+    }
+
+
+def dispatch_segments(task, plan: Dict[str, Any], output_file: str, options: Dict[str, Any],
+                      global_options: List[str], webhook_url: Optional[str] = None,
+                      render_fingerprint: Optional[str] = None) -> Dict[str, Any]:
+    """Fan the planned segments out as a chord whose callback concatenates them
+    and records the final result under the parent task id"""
+    parent_task_id = task.request.id
+    # Segments and their callbacks stay in the lane the parent was routed to
+    queue = (task.request.delivery_info or {}).get('routing_key') or celery_app.conf.task_default_queue
+    extension = os.path.splitext(output_file)[1].lower() or '.mp4'
+    segment_options, audio_options = split_audio_options(options)
+    header = [
+        encode_segment_task.s(
+            parent_task_id, index, plan['source'], plan['input_options'], segment['start'], segment['duration'],
+            segment_options, global_options, extension, plan['total_duration']
+        ).set(queue=queue)
+        for index, segment in enumerate(plan['segments'])
+    ]
+    audio_input = plan['input_options'] + [plan['source']] if plan.get('has_audio') and audio_options else None
+    callback = concat_segments_task.s(
+        parent_task_id, output_file, options, webhook_url, render_fingerprint, audio_input, audio_options
+    ).set(queue=queue)
+    callback = callback.on_error(segment_failure_task.s(parent_task_id, webhook_url).set(queue=queue))
+
+    # Ids are fixed up front so the meta is written before any segment can report progress
+    children = {
+        'segment_task_ids': [signature.freeze().id for signature in header],
+        'chord_id': callback.freeze().id,
+    }
+    redis_client.set(_CHILDREN_KEY.format(parent_task_id), json.dumps(children), ex=24 * 3600)
+    meta = {
+        'progress': {
+            'status': 'processing',
+            'progress_percent': 0.0,
+            'segments': len(header),
+        },
+        **children,
+    }
+    task.update_state(state='PROGRESS', meta=meta)
+    chord(header)(callback)
+    logger.info(f"Split task {parent_task_id} into {len(header)} segments")
+    return meta
+
+
+def _publish_segment_progress(parent_task_id: str, index: int, done_seconds: float, total_duration: float):
+    key = _PROGRESS_KEY.format(parent_task_id)
+    pipe = redis_client.pipeline()
+    pipe.hset(key, str(index), done_seconds)
+    pipe.expire(key, 24 * 3600)
+    pipe.hvals(key)
+    pipe.get(_CHILDREN_KEY.format(parent_task_id))
+    *_, values, children = pipe.execute()
+    done = sum(float(value) for value in values)
+    # store_result replaces the whole meta, so the ids dispatch_segments wrote are carried over
+    meta = {
+        'progress': {
+            'status': 'processing',
+            'progress_percent': round(min(100.0, done / total_duration * 100), 2),
+        },
+        **(json.loads(children) if children else {}),
+    }
+    celery_app.backend.store_result(parent_task_id, meta, 'PROGRESS')
+    publish_task_event(parent_task_id, 'PROGRESS', meta)
+
+
+@celery_app.task(bind=True)
+def encode_segment_task(self, parent_task_id: str, index: int, source: str, input_options: List[str],
+                        start: float, duration: float, options: Dict[str, Any], global_options: List[str],
+                        extension: str, total_duration: float):
+    """Encode one keyframe-aligned segment of a compose job and upload it to MinIO"""
+    with tempfile.TemporaryDirectory(prefix="ffmpeg-segment-") as temp_dir, cpu_scheduler.allocate(self.request.id) as cpu_allocation:
+        options, global_options = cpu_allocation.apply(options, global_options)
+        segment_path = os.path.join(temp_dir, f"segment{extension}")
+        command = build_ffmpeg_command(
+            input_files=[input_options + ['-ss', f"{start:.6f}", '-t', f"{duration:.6f}", source]],
+            output_file=segment_path,
+            options=options,
+            global_options=list(global_options) + ['-y']
+        )
+        progress_file, progress_fd = open_progress_pipe()
+        with tempfile.TemporaryFile(mode='w+') as stderr_file, progress_file:
+            try:
+                command = add_progress_args(command, progress_fd)
+                logger.info(f"Encoding segment {index} of {parent_task_id}: {format_command_for_display(command)}")
+                process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=stderr_file, pass_fds=(progress_fd,))
+            finally:
+                os.close(progress_fd)
+            cpu_scheduler.attach(self.request.id, process.pid)
+
+            parser = FfmpegProgressParser(duration)
+            last_update_time = 0
+            for line in progress_file:
+                snapshot = parser.feed(line)
+                if snapshot and snapshot['out_time_us'] is not None and time.time() - last_update_time >= 1.0:
+                    done_seconds = min(duration, snapshot['out_time_us'] / 1_000_000)
+                    _publish_segment_progress(parent_task_id, index, done_seconds, total_duration)
+                    last_update_time = time.time()
+
+            if process.wait() != 0:
+                stderr_file.seek(0)
+                stderr_tail = stderr_file.read()[-8192:]
+                raise RuntimeError(f"Segment {index} failed: {stderr_tail}")
+
+        object_name = f"{SEGMENT_OBJECT_PREFIX}{parent_task_id}/{index:05d}{extension}"
+        minio_client.fput_object(bucket_name, object_name, segment_path)
+        _publish_segment_progress(parent_task_id, index, duration, total_duration)
+        return {'index': index, 'object_name': object_name, 'duration': duration, 'cpu': cpu_allocation.to_dict()}
+
+
+def _remove_segments(parent_task_id: str):
+    prefix = f"{SEGMENT_OBJECT_PREFIX}{parent_task_id}/"
+    try:
+        for obj in minio_client.list_objects(bucket_name, prefix=prefix, recursive=True):
+            minio_client.remove_object(bucket_name, obj.object_name)
+    except Exception as e:
+        logger.error(f"Failed to remove segments under {prefix}: {str(e)}")
+    redis_client.delete(_PROGRESS_KEY.format(parent_task_id), _CHILDREN_KEY.format(parent_task_id))
+
+
+def concat_command(list_path: str, output_path: str, options: Dict[str, Any],
+                   audio_input: Optional[List[str]] = None, audio_options: Optional[Dict[str, Any]] = None) -> List[str]:
+    concat_input = ['-f', 'concat', '-safe', '0', list_path]
+    if audio_input is None or not audio_options:
+        concat_options = {'map': '0', 'c': 'copy'}
+    else:
+        audio_options = dict(audio_options)
+        concat_options = {'map': ['0'] + audio_options.pop('map'), 'c:v': 'copy', 'c:s': 'copy', **audio_options}
+    if options.get('movflags'):
+        concat_options['movflags'] = options['movflags']
+    return build_ffmpeg_command(
+        input_files=[concat_input] + ([audio_input] if audio_input is not None else []),
+        output_file=output_path,
+        options=concat_options,
+        global_options=['-y']
+    )
+
+
+@celery_app.task(bind=True)
+def concat_segments_task(self, segment_results: List[Dict[str, Any]], parent_task_id: str, output_file: str,
+                         options: Dict[str, Any], webhook_url: Optional[str] = None,
+                         render_fingerprint: Optional[str] = None, audio_input: Optional[List[str]] = None,
+                         audio_options: Optional[Dict[str, Any]] = None):
+    """Stitch encoded segments with the concat demuxer, without re-encoding the video
+
+    ``audio_input`` (input options followed by the source) is the source whose
+    audio is encoded in one pass with ``audio_options`` and muxed in.
+    """
+    segments = sorted(segment_results, key=lambda segment: segment['index'])
+    object_name = os.path.basename(output_file)
+    with tempfile.TemporaryDirectory(prefix="ffmpeg-concat-") as temp_dir:
+        list_path = os.path.join(temp_dir, 'segments.txt')
+        with open(list_path, 'w') as f:
+            for segment in segments:
+                local_path = os.path.join(temp_dir, os.path.basename(segment['object_name']))
+                minio_client.fget_object(bucket_name, segment['object_name'], local_path)
+                f.write(f"file '{local_path}'\n")
+
+        output_path = os.path.join(temp_dir, object_name)
+        command = concat_command(list_path, output_path, options, audio_input, audio_options)
+        formatted_command = format_command_for_display(command)
+        logger.info(f"Concatenating {len(segments)} segments of {parent_task_id}: {formatted_command}")
+
+        completed = subprocess.run(command, capture_output=True, text=True)
+        if completed.returncode != 0:
+            result = {
+                'success': False,
+                'error': completed.stderr,
+                'command': formatted_command,
+                'return_code': completed.returncode,
+            }
+        else:
+            minio_client.fput_object(bucket_name, object_name, output_path)
+            storage_url = f"{minio_public_endpoint}/{bucket_name}/{object_name}"
+            logger.info(f"File uploaded to MinIO: {storage_url}")
+            if render_fingerprint:
+                try:
+                    render_cache.store(render_fingerprint, object_name)
+                except Exception as cache_error:
+                    logger.error(f"Failed to store render {render_fingerprint} in cache: {str(cache_error)}")
+            result = {
+                'success': True,
+                'output_url': storage_url,
+                'command': formatted_command,
+                'message': 'FFmpeg processing and upload completed successfully',
+                'segments': len(segments),
+                'render_fingerprint': render_fingerprint,
+            }
+
+    _remove_segments(parent_task_id)
+    celery_app.backend.store_result(parent_task_id, result, 'SUCCESS')
+    publish_task_event(parent_task_id, 'SUCCESS', result)
+    mark_batch_task_done(parent_task_id)
+    record_job_outcome(parent_task_id, result['success'])
+    if webhook_url:
+        queue_webhook(webhook_url, {'task_id': parent_task_id, 'status': 'SUCCESS', 'result': result}, parent_task_id)
+    return result
+
+
+@celery_app.task
+def segment_failure_task(request, exc, traceback, parent_task_id: str, webhook_url: Optional[str] = None):
+    """Record a failed segment on the parent task, mirroring process_ffmpeg_task's failure result"""
+    logger.error(f"Segmented encode of {parent_task_id} failed: {exc}")
+    result = {
+        'success': False,
+        'error': str(exc),
+        'command': 'Segmented encode',
+    }
+    _remove_segments(parent_task_id)
+    celery_app.backend.store_result(parent_task_id, result, 'SUCCESS')
+    publish_task_event(parent_task_id, 'SUCCESS', result)
+    mark_batch_task_done(parent_task_id)
+    record_job_outcome(parent_task_id, result['success'])
+    if webhook_url:
+        queue_webhook(webhook_url, {'task_id': parent_task_id, 'status': 'SUCCESS', 'result': result}, parent_task_id)
@@ -0,0 +1,156 @@
+import logging
+import redis.asyncio as aioredis
+
+from typing import List, Dict, Any, Optional
+from celery import states
+from celery.result import AsyncResult
+from starlette.concurrency import run_in_threadpool
+
+from celery_worker import celery_app, result_backend
+
+logger = logging.getLogger(__name__)
+
+# Keys fetched per MGET; larger batches are split across one pipeline round trip
+STATUS_MGET_CHUNK = 500
+
+
+def project_task_status(task_id: str, state: str, info: Any) -> Optional[Dict[str, Any]]:
+    """Build the status payload returned by the task status endpoints
+
+    Args:
+        task_id: Task ID
+        state: Celery state of the task
+        info: Task meta result: the progress meta while running, the return
+            value on success or the exception on failure
+
+    Returns:
+        The status dict, or None when the task is unknown to the backend
+    """
+    if state == states.PENDING and not info:
+        return None
+
+    result = {
+        "task_id": task_id,
+        "status": state,
+    }
+
+    if state == 'PROGRESS' and isinstance(info, dict) and 'progress' in info:
+        result["progress"] = info['progress']
+        if info.get('cpu'):
+            result["cpu"] = info['cpu']
+
+    if state in states.READY_STATES:
+        if state == states.SUCCESS:
+            result["result"] = info
+            if isinstance(info, dict) and 'progress' in info:
+                result["progress"] = info['progress']
+        else:
+            result["error"] = str(info)
+            result["progress"] = {
+                'status': 'failed',
+                'progress_percent': 0.0
+            }
+    elif state == states.PENDING:
+        result["progress"] = {
+            'status': 'pending',
+            'progress_percent': 0.0
+        }
+
+    return result
+
+
+def _is_redis_backend() -> bool:
+    return hasattr(celery_app.backend, 'get_key_for_task') and result_backend.startswith(('redis://', 'rediss://', 'unix://'))
+
+
+def _decode_meta(payload: Optional[bytes]) -> Dict[str, Any]:
+    if payload is None:
+        return {'status': states.PENDING, 'result': None}
+    return celery_app.backend.decode_result(payload)
+
+
+def _queue_mgets(pipe, task_ids: List[str]):
+    for start in range(0, len(task_ids), STATUS_MGET_CHUNK):
+        chunk = task_ids[start:start + STATUS_MGET_CHUNK]
+        pipe.mget([celery_app.backend.get_key_for_task(task_id) for task_id in chunk])
+
+
+def fetch_task_metas(task_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Read the backend meta of many tasks in a single pipelined round trip
+
+    Falls back to one read per task on result backends that aren't Redis.
+    """
+    if not _is_redis_backend():
+        return {task_id: AsyncResult(task_id, app=celery_app)._get_task_meta() for task_id in task_ids}
+
+    pipe = celery_app.backend.client.pipeline(transaction=False)
+    _queue_mgets(pipe, task_ids)
+    payloads = [payload for values in pipe.execute() for payload in values]
+    return {task_id: _decode_meta(payload) for task_id, payload in zip(task_ids, payloads)}
+
+
+_async_client = None
+
+
+def _get_async_client():
+    # Created on first use so the connection pool belongs to the API's event loop
+    global _async_client
+    if _async_client is None:
+        _async_client = aioredis.from_url(result_backend, socket_timeout=5, socket_connect_timeout=5)
+    return _async_client
+
+
+async def afetch_task_meta(task_id: str) -> Dict[str, Any]:
+    """Read one task's backend meta with a single non-blocking GET"""
+    if not _is_redis_backend():
+        return await run_in_threadpool(lambda: AsyncResult(task_id, app=celery_app)._get_task_meta())
+    payload = await _get_async_client().get(celery_app.backend.get_key_for_task(task_id))
+    return _decode_meta(payload)
+
+
+async def afetch_task_metas(task_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Non-blocking variant of fetch_task_metas"""
+    if not _is_redis_backend():
+        return await run_in_threadpool(fetch_task_metas, task_ids)
+    pipe = _get_async_client().pipeline(transaction=False)
+    _queue_mgets(pipe, task_ids)
+    payloads = [payload for values in await pipe.execute() for payload in values]
+    return {task_id: _decode_meta(payload) for task_id, payload in zip(task_ids, payloads)}
+
+
+def get_task_statuses(task_ids: List[str], fields: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Status of many tasks, projected like the single task status endpoint
+
+    Args:
+        task_ids: Task IDs; duplicates are returned once
+        fields: Keys to keep in each status besides ``task_id``, all when None
+
+    Returns:
+        Dict with the statuses in request order under ``tasks`` and the IDs the
+        backend doesn't know under ``not_found``
+    """
+    task_ids = list(dict.fromkeys(task_ids))
+    return _project_statuses(task_ids, fetch_task_metas(task_ids), fields)
+
+
+async def aget_task_statuses(task_ids: List[str], fields: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Non-blocking variant of get_task_statuses"""
+    task_ids = list(dict.fromkeys(task_ids))
+    return _project_statuses(task_ids, await afetch_task_metas(task_ids), fields)
+
+
+def _project_statuses(task_ids: List[str], metas: Dict[str, Dict[str, Any]],
+                      fields: Optional[List[str]]) -> Dict[str, Any]:
+    tasks = []
+    not_found = []
+    for task_id in task_ids:
+        meta = metas[task_id]
+        status = project_task_status(task_id, meta['status'], meta.get('result'))
+        if status is None:
+            not_found.append(task_id)
+            continue
+        if fields is not None:
+            status = {key: value for key, value in status.items() if key == 'task_id' or key in fields}
+        tasks.append(status)
+
+    return {"tasks": tasks, "not_found": not_found}
@@ -0,0 +1,78 @@
+import pytest
+
+import font_utils
+from font_utils import FontEntry, resolve_filter_fonts
+
+
+def _token(text, terminators):
+    """One token of ``text`` the way FFmpeg's av_get_token reads it: quotes and backslashes removed"""
+    token, index, inside = [], 0, False
+    while index < len(text):
+        char = text[index]
+        if inside:
+            if char == "'":
+                inside = False
+            else:
+                token.append(char)
+        elif char == "'":
+            inside = True
+        elif char == "\\":
+            index += 1
+            token.append(text[index])
+        elif char in terminators:
+            break
+        else:
+            token.append(char)
+        index += 1
+    return "".join(token), text[index + 1:]
+
+
+def _drawtext_options(graph):
+    """drawtext's options as FFmpeg parses them: graph level first, then the option level"""
+    args, _ = _token(graph[len("drawtext="):], "[],;")
+    options = {}
+    while args:
+        key, _, rest = args.partition("=")
+        options[key], args = _token(rest, ":")
+    return options
+
+
+@pytest.fixture
+def font_path(monkeypatch):
+    def configure(path):
+        monkeypatch.setattr(
+            font_utils.font_registry, "resolve",
+            lambda name: FontEntry(family="Roboto", style="Bold", path=path, source="test") if name == "Roboto" else None,
+        )
+    return configure
+
+
+@pytest.mark.parametrize("path", ["/fonts/Roboto-Bold.ttf", "C:/Fonts/Roboto, Bold.ttf", "/fonts/O'Neil [b].ttf"])
+def test_unquoted_graph(font_path, path):
+    font_path(path)
+    graph = resolve_filter_fonts({"vf": "drawtext=fontfile=Roboto:text=hi,scale=1280:720"})["vf"]
+
+    drawtext, _, rest = graph.rpartition(",")
+    assert rest == "scale=1280:720"
+    assert _drawtext_options(drawtext) == {"fontfile": path, "text": "hi"}
+
+
+@pytest.mark.parametrize("path", ["/fonts/Roboto-Bold.ttf", "C:/Fonts/Roboto, Bold.ttf", "/fonts/O'Neil [b].ttf"])
+@pytest.mark.parametrize("fontfile", ["Roboto", "'Roboto'"])
+def test_quoted_graph_section(font_path, path, fontfile):
+    font_path(path)
+    graph = resolve_filter_fonts({"vf": f"drawtext='fontfile={fontfile}:text=hi'"})["vf"]
+
+    assert _drawtext_options(graph) == {"fontfile": path, "text": "hi"}
+
+
+def test_escaping_adds_no_quotes(font_path):
+    font_path("C:/Fonts/Roboto.ttf")
+    assert resolve_filter_fonts({"vf": "drawtext=fontfile=Roboto"})["vf"] == r"drawtext=fontfile=C\\:/Fonts/Roboto.ttf"
+    assert resolve_filter_fonts({"vf": "drawtext='fontfile=Roboto'"})["vf"] == r"drawtext='fontfile=C\:/Fonts/Roboto.ttf'"
+
+
+def test_paths_and_unknown_names_are_left_alone(font_path):
+    font_path("/fonts/Roboto-Bold.ttf")
+    graph = "drawtext=fontfile=fonts/Roboto.ttf,drawtext=fontfile=Unknown"
+    assert resolve_filter_fonts({"vf": graph})["vf"] == graph
@@ -0,0 +1,113 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from input_cache_utils import InputCache
+
+
+class Origin:
+    """HTTP origin serving one object, answering 304 to a matching If-None-Match"""
+
+    def __init__(self):
+        self.body = b"version one"
+        self.etag = '"v1"'
+        self.send_validators = True
+        self.requests = []
+        origin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                origin.requests.append(self.headers.get("If-None-Match"))
+                if origin.send_validators and self.headers.get("If-None-Match") == origin.etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                if origin.send_validators:
+                    self.send_header("ETag", origin.etag)
+                self.send_header("Content-Length", str(len(origin.body)))
+                self.end_headers()
+                self.wfile.write(origin.body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/input.mp4"
+
+
+@pytest.fixture
+def origin():
+    origin = Origin()
+    yield origin
+    origin.server.shutdown()
+    origin.server.server_close()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return InputCache(str(tmp_path / "cache"), max_bytes=1024 ** 2)
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_miss_then_revalidated_hit(origin, cache, tmp_path):
+    cache.fetch(origin.url, str(tmp_path / "first.mp4"))
+    path = cache.fetch(origin.url, str(tmp_path / "second.mp4"))
+
+    assert _read(path) == b"version one"
+    assert origin.requests == [None, '"v1"']
+    stats = cache.stats()
+    assert (stats["misses"], stats["hits"], stats["revalidations"]) == (1, 1, 1)
+
+
+def test_changed_origin_replaces_the_entry(origin, cache, tmp_path):
+    cache.fetch(origin.url, str(tmp_path / "first.mp4"))
+    origin.body, origin.etag = b"version two", '"v2"'
+
+    path = cache.fetch(origin.url, str(tmp_path / "second.mp4"))
+
+    assert _read(path) == b"version two"
+    # The first copy is a separate link and keeps the old content
+    assert _read(tmp_path / "first.mp4") == b"version one"
+
+
+def test_responses_without_validators_are_not_cached(origin, cache, tmp_path):
+    origin.send_validators = False
+    path = cache.fetch(origin.url, str(tmp_path / "out.mp4"))
+
+    assert _read(path) == b"version one"
+    assert not cache.contains(origin.url)
+
+
+def test_entry_evicted_during_revalidation_is_downloaded_once_more(origin, cache, tmp_path, monkeypatch):
+    cache.fetch(origin.url, str(tmp_path / "first.mp4"))
+
+    # Another worker evicts the entry between the conditional GET and the link, every time
+    def evicting_touch(key):
+        os.remove(cache._data_path(key))
+    monkeypatch.setattr(cache, "_touch", evicting_touch)
+
+    path = cache.fetch(origin.url, str(tmp_path / "second.mp4"))
+
+    assert _read(path) == b"version one"
+    # One revalidation, then one unconditional download: no retry loop
+    assert origin.requests == [None, '"v1"', None]
+
+
+def test_evict_removes_least_recently_used_entries(origin, tmp_path):
+    cache = InputCache(str(tmp_path / "cache"), max_bytes=len(origin.body) + 1)
+    first_url, second_url = origin.url, origin.url.replace("input", "other")
+    cache.fetch(first_url, str(tmp_path / "first.mp4"))
+    os.utime(cache._data_path(cache._key(first_url)), (1, 1))
+    cache.fetch(second_url, str(tmp_path / "second.mp4"))
+
+    assert not cache.contains(first_url)
+    assert cache.contains(second_url)
+    assert cache.stats()["evictions"] == 1
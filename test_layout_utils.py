@@ -0,0 +1,63 @@
+import pytest
+
+from layout_utils import fit_text
+
+FONT = "Roboto-Bold.ttf"
+TEXT = "The quick brown fox jumps over the lazy dog"
+
+
+def _fits(layout, box_width, box_height):
+    font = layout.font
+    return (
+        all(font.getlength(line) <= box_width for line in layout.lines)
+        and layout.height <= box_height
+    )
+
+
+@pytest.mark.parametrize("box", [(400, 200), (1000, 120), (150, 600)])
+def test_largest_size_that_fits(box):
+    layout = fit_text(TEXT, FONT, *box)
+
+    assert layout.fits
+    assert _fits(layout, *box)
+    assert " ".join(layout.lines) == TEXT
+    # One size up no longer fits the box
+    larger = fit_text(TEXT, FONT, *box, min_size=layout.font_size + 1)
+    assert not larger.fits
+
+
+def test_size_is_capped_at_max_size():
+    layout = fit_text("Hi", FONT, 2000, 2000, max_size=80)
+    assert layout.font_size == 80
+    assert layout.lines == ["Hi"]
+
+
+def test_newlines_force_breaks():
+    layout = fit_text("first line\nsecond", FONT, 2000, 2000)
+    assert layout.lines == ["first line", "second"]
+
+
+def test_max_lines_bounds_the_wrap():
+    unbounded = fit_text(TEXT, FONT, 400, 400)
+    bounded = fit_text(TEXT, FONT, 400, 400, max_lines=2)
+
+    assert len(unbounded.lines) > 2
+    assert len(bounded.lines) <= 2
+    assert bounded.font_size < unbounded.font_size
+
+
+def test_line_gap_counts_towards_the_height():
+    layout = fit_text(TEXT, FONT, 400, 200, line_gap=10)
+    size = layout.font_size
+    assert layout.line_pitch == pytest.approx(fit_text(TEXT, FONT, 400, 200, max_size=size, min_size=size).line_pitch + 10)
+    assert layout.height == pytest.approx(layout.line_pitch * len(layout.lines) - 10)
+    assert layout.height <= 200
+
+
+def test_overflow_returns_the_min_size_layout():
+    layout = fit_text("Supercalifragilistic word", FONT, 50, 20, min_size=10)
+
+    assert not layout.fits
+    assert layout.font_size == 10
+    # A word wider than the box gets a line of its own instead of being dropped
+    assert layout.lines == ["Supercalifragilistic", "word"]
@@ -0,0 +1,72 @@
+import pytest
+
+from prediction_utils import RUNTIME_DEFAULT_SECONDS, RUNTIME_MODEL_MIN_SAMPLES, RuntimePredictor
+from routing_utils import JobCost, codec_factor
+
+CODECS = ["libx264", "libx265", "libvpx-vp9"]
+
+
+def _runtime(duration, codec):
+    # Superlinear in duration, so a single runtime-to-cost ratio can't fit every job
+    return 0.5 * duration ** 1.3 * codec_factor(codec, None) ** 0.8
+
+
+def _job(duration, codec):
+    cost = duration * codec_factor(codec, None)
+    return JobCost(cost=cost, lane="standard", duration=duration, width=1920, height=1080, fps=30, codec=codec)
+
+
+def _history(count):
+    history = []
+    for index in range(count):
+        duration, codec = 10.0 + 7.0 * index, CODECS[index % len(CODECS)]
+        history.append({"estimate": _job(duration, codec).to_dict(), "runtime": _runtime(duration, codec), "success": True})
+    return history
+
+
+def _predictor(history):
+    predictor = RuntimePredictor(None, retrain_interval=3600, min_samples=RUNTIME_MODEL_MIN_SAMPLES)
+    predictor._model = predictor.train(history)
+    return predictor
+
+
+def test_cost_ratio_below_min_samples():
+    history = _history(RUNTIME_MODEL_MIN_SAMPLES - 1)
+    predictor = _predictor(history)
+    model = predictor.model()
+
+    assert model["weights"] is None
+    job = _job(1000.0, "libx265")
+    assert predictor.predict(job) == pytest.approx(job.cost * model["cost_ratio"], abs=0.01)
+
+
+def test_regression_from_min_samples():
+    predictor = _predictor(_history(RUNTIME_MODEL_MIN_SAMPLES))
+    model = predictor.model()
+    assert model["weights"] is not None
+    assert model["mape"] is not None
+
+    job = _job(1000.0, "libx265")
+    ratio_prediction = job.cost * model["cost_ratio"]
+    prediction = predictor.predict(job)
+    assert prediction == pytest.approx(_runtime(1000.0, "libx265"), rel=0.05)
+    assert abs(prediction - _runtime(1000.0, "libx265")) < abs(ratio_prediction - _runtime(1000.0, "libx265"))
+    assert predictor.describe()["regression"]
+
+
+def test_failed_and_unmeasured_jobs_are_not_samples():
+    history = _history(RUNTIME_MODEL_MIN_SAMPLES)
+    history[0]["success"] = False
+    history[1]["runtime"] = None
+    history[2]["estimate"]["duration"] = None
+
+    model = _predictor(history).model()
+    assert model["samples"] == RUNTIME_MODEL_MIN_SAMPLES - 3
+    assert model["weights"] is None
+
+
+def test_defaults_without_history():
+    predictor = _predictor([])
+    assert predictor.model()["cost_ratio"] == 1.0
+    assert predictor.predict(_job(60.0, "libx264")) == 60.0
+    assert predictor.predict(JobCost(cost=None, lane="standard")) == RUNTIME_DEFAULT_SECONDS
@@ -0,0 +1,88 @@
+import pytest
+
+import progress_utils
+from progress_utils import FfmpegProgressParser
+
+
+def _feed_block(parser, lines, progress="continue"):
+    for line in lines:
+        assert parser.feed(line) is None
+    return parser.feed(f"progress={progress}")
+
+
+def test_snapshot_only_when_a_block_completes():
+    parser = FfmpegProgressParser(expected_duration=10)
+    snapshot = _feed_block(parser, ["frame=120", "fps=30.0", "out_time_us=4000000", "out_time=00:00:04.000000", "speed=2.0x"])
+
+    assert snapshot["frame"] == 120
+    assert snapshot["time"] == "00:00:04.000000"
+    assert snapshot["speed"] == 2.0
+    assert snapshot["progress_percent"] == 40.0
+    # The next block starts empty
+    assert _feed_block(parser, [])["frame"] is None
+
+
+def test_out_time_ms_carries_microseconds():
+    parser = FfmpegProgressParser(expected_duration=10)
+    snapshot = _feed_block(parser, ["out_time_ms=2500000"])
+    assert snapshot["out_time_us"] == 2_500_000
+    assert snapshot["progress_percent"] == 25.0
+
+
+def test_out_time_us_wins_over_out_time_ms():
+    parser = FfmpegProgressParser(expected_duration=10)
+    snapshot = _feed_block(parser, ["out_time_us=5000000", "out_time_ms=1000"])
+    assert snapshot["out_time_us"] == 5_000_000
+
+
+def test_values_only_split_on_the_first_equals_sign():
+    parser = FfmpegProgressParser()
+    snapshot = _feed_block(parser, ["bitrate=1024.0kbits/s=x"])
+    assert snapshot["bitrate"] == "1024.0kbits/s=x"
+
+
+def test_not_available_values():
+    parser = FfmpegProgressParser(expected_duration=10)
+    snapshot = _feed_block(parser, ["out_time_us=N/A", "out_time_ms=N/A", "speed=N/A", "total_size=N/A", "fps=N/A"])
+
+    assert snapshot["out_time_us"] is None
+    assert snapshot["speed"] is None
+    assert snapshot["total_size"] is None
+    assert snapshot["fps"] is None
+    assert snapshot["progress_percent"] is None
+    assert snapshot["eta_seconds"] is None
+
+
+def test_eta_from_speed():
+    parser = FfmpegProgressParser(expected_duration=100)
+    snapshot = _feed_block(parser, ["out_time_us=40000000", "speed=2x"])
+    assert snapshot["eta_seconds"] == 30.0
+
+
+def test_eta_from_elapsed_time_without_speed(monkeypatch):
+    monkeypatch.setattr(progress_utils.time, "time", lambda: 1000.0)
+    parser = FfmpegProgressParser(expected_duration=100)
+    monkeypatch.setattr(progress_utils.time, "time", lambda: 1020.0)
+
+    snapshot = _feed_block(parser, ["out_time_us=40000000", "speed=0x"])
+    # 40 s of output in 20 s of wall clock: the remaining 60 s take 30 s
+    assert snapshot["eta_seconds"] == 30.0
+
+
+def test_progress_is_capped_and_end_finishes():
+    parser = FfmpegProgressParser(expected_duration=10)
+    assert _feed_block(parser, ["out_time_us=12000000"])["progress_percent"] == 100.0
+
+    snapshot = _feed_block(parser, ["out_time_us=9000000", "speed=1x"], progress="end")
+    assert snapshot["progress_percent"] == 100.0
+    assert snapshot["eta_seconds"] == 0.0
+
+
+@pytest.mark.parametrize("expected_duration", [None, 0, -5])
+def test_no_percent_or_eta_without_an_expected_duration(expected_duration):
+    parser = FfmpegProgressParser(expected_duration=expected_duration)
+    snapshot = _feed_block(parser, ["out_time_us=4000000", "speed=2x"])
+
+    assert parser.expected_duration is None
+    assert snapshot["progress_percent"] is None
+    assert snapshot["eta_seconds"] is None
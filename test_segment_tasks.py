@@ -0,0 +1,128 @@
+import pytest
+
+import segment_tasks
+from probe_utils import MediaInfo, StreamInfo
+
+
+@pytest.fixture
+def probed_source(monkeypatch):
+    """Stand in for ffprobe: a 20 s source with a keyframe every 2 s of its own timeline"""
+    def configure(start_time=0.0, duration=20.0, audio=False):
+        streams = [StreamInfo(index=0, codec_type="video", codec_name="h264", width=1920, height=1080)]
+        if audio:
+            streams.append(StreamInfo(index=1, codec_type="audio", codec_name="aac"))
+        info = MediaInfo(source="input.ts", duration=duration, start_time=start_time, streams=streams)
+        keyframes = [start_time + 2.0 * index for index in range(int(duration // 2))]
+        monkeypatch.setattr(segment_tasks, "probe_media", lambda source: info)
+        monkeypatch.setattr(segment_tasks, "probe_keyframe_times", lambda source: keyframes)
+    return configure
+
+
+def test_boundaries_are_relative_to_the_container_start_time(probed_source):
+    probed_source(start_time=1.4)
+    plan = segment_tasks.plan_segments(["input.ts"], {"c:v": "libx264"}, [], segment_duration=5)
+
+    starts = [segment["start"] for segment in plan["segments"]]
+    assert starts == pytest.approx([0.0, 6.0, 12.0])
+    # Consecutive segments neither overlap nor leave a gap, and cover the whole source
+    for segment, following in zip(plan["segments"], plan["segments"][1:]):
+        assert segment["start"] + segment["duration"] == pytest.approx(following["start"])
+    last = plan["segments"][-1]
+    assert last["start"] + last["duration"] == pytest.approx(20.0)
+
+
+def test_boundaries_without_start_time(probed_source):
+    probed_source(start_time=0.0)
+    plan = segment_tasks.plan_segments(["input.ts"], {}, [], segment_duration=5)
+    assert [segment["start"] for segment in plan["segments"]] == pytest.approx([0.0, 6.0, 12.0])
+
+
+@pytest.mark.parametrize("input_files", [["a.mp4", "b.mp4"], []])
+def test_multiple_inputs_are_not_segmented(probed_source, input_files):
+    probed_source()
+    assert segment_tasks.plan_segments(input_files, {}, [], segment_duration=5) is None
+
+
+@pytest.mark.parametrize("input_files, options, global_options", [
+    ([["-ss", "5", "input.ts"]], {}, []),
+    ([["-stream_loop", "-1", "input.ts"]], {}, []),
+    (["input.ts"], {}, ["-t 10"]),
+    (["input.ts"], {"to": "15"}, []),
+    (["input.ts"], {"frames:v": 100}, []),
+])
+def test_timeline_args_and_options_are_not_segmented(probed_source, input_files, options, global_options):
+    probed_source()
+    assert segment_tasks.plan_segments(input_files, options, global_options, segment_duration=5) is None
+
+
+@pytest.mark.parametrize("options", [
+    {"vf": "scale=1280:720,fade=in:0:30"},
+    {"filter_complex": "[0:v]minterpolate=fps=60[v]"},
+    {"vf": ["crop=100:100", "tpad=stop=10"]},
+])
+def test_unsafe_filters_are_not_segmented(probed_source, options):
+    probed_source()
+    assert segment_tasks.plan_segments(["input.ts"], options, [], segment_duration=5) is None
+    # Unless the caller vouches for them
+    assert segment_tasks.plan_segments(["input.ts"], options, [], segment_duration=5, segment_safe=True) is not None
+
+
+def test_safe_filters_are_segmented(probed_source):
+    probed_source()
+    options = {"vf": "scale=1280:720,format=yuv420p", "af": "volume=0.5"}
+    assert segment_tasks.plan_segments(["input.ts"], options, [], segment_duration=5) is not None
+
+
+def test_segment_safe_false_is_not_segmented(probed_source):
+    probed_source()
+    assert segment_tasks.plan_segments(["input.ts"], {}, [], segment_duration=5, segment_safe=False) is None
+
+
+@pytest.mark.parametrize("duration", [9.9, 0.0])
+def test_short_duration_is_not_segmented(probed_source, duration):
+    # Shorter than two segments
+    probed_source(duration=duration)
+    assert segment_tasks.plan_segments(["input.ts"], {}, [], segment_duration=5) is None
+
+
+@pytest.mark.parametrize("graph", ["[0:a]loudnorm[a]", "[0:v]scale=1280:720[v];[0:a]volume=2[a]", "[0:a]atempo=1.5[a]"])
+def test_audio_filter_complex_with_an_audio_stream_is_not_segmented(probed_source, graph):
+    probed_source(audio=True)
+    options = {"filter_complex": graph}
+    assert segment_tasks.plan_segments(["input.ts"], options, [], segment_duration=5, segment_safe=True) is None
+
+    # Without an audio stream there is no audio to keep in step
+    probed_source(audio=False)
+    plan = segment_tasks.plan_segments(["input.ts"], options, [], segment_duration=5, segment_safe=True)
+    assert plan is not None and not plan["has_audio"]
+
+
+def test_video_filter_complex_with_an_audio_stream_is_segmented(probed_source):
+    probed_source(audio=True)
+    plan = segment_tasks.plan_segments(["input.ts"], {"filter_complex": "[0:v]scale=1280:720[v]"}, [], segment_duration=5)
+    assert plan is not None and plan["has_audio"]
+
+
+def test_segments_are_encoded_without_audio():
+    segment_options, audio_options = segment_tasks.split_audio_options(
+        {"c:v": "libx264", "c:a": "aac", "b:a": "128k", "map": ["0:v", "0:a"]}
+    )
+    assert segment_options == {"c:v": "libx264", "map": ["0:v"], "an": True}
+    assert audio_options == {"c:a": "aac", "b:a": "128k", "map": ["1:a"]}
+
+
+def test_concat_encodes_the_audio_once_from_the_source():
+    _, audio_options = segment_tasks.split_audio_options({"c:a": "aac"})
+    command = segment_tasks.concat_command("segments.txt", "out.mp4", {}, ["input.mp4"], audio_options)
+    assert command == [
+        "ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", "segments.txt", "-i", "input.mp4",
+        "-map", "0", "-map", "1:a:0?", "-c:v", "copy", "-c:s", "copy", "-c:a", "aac", "out.mp4",
+    ]
+
+
+@pytest.mark.parametrize("options", [{"an": True}, {"map": ["0:v"]}])
+def test_jobs_without_audio_output_concat_by_copy(options):
+    _, audio_options = segment_tasks.split_audio_options(options)
+    assert audio_options is None
+    command = segment_tasks.concat_command("segments.txt", "out.mp4", options, None, audio_options)
+    assert command[-5:] == ["-map", "0", "-c", "copy", "out.mp4"]
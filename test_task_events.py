@@ -0,0 +1,63 @@
+import asyncio
+
+import app
+import events_utils
+
+
+class FakeHub:
+    """Event hub whose live subscription misses everything; only last_event() sees updates"""
+
+    def __init__(self, events):
+        self.events = list(events)
+        self.current = None
+        self.unsubscribed = False
+
+    async def subscribe(self, task_id):
+        return asyncio.Queue()
+
+    def unsubscribe(self, task_id, queue):
+        self.unsubscribed = True
+
+    async def last_event(self, task_id):
+        if self.events:
+            self.current = self.events.pop(0)
+        return self.current
+
+
+def _collect(monkeypatch, hub):
+    monkeypatch.setattr(app, "task_event_hub", hub)
+    monkeypatch.setattr(app, "SSE_KEEPALIVE_SECONDS", 0.01)
+
+    async def run():
+        return [event async for event in app._task_events("task-1")]
+
+    return asyncio.run(asyncio.wait_for(run(), timeout=5))
+
+
+def test_missed_final_event_is_picked_up_on_keepalive(monkeypatch):
+    progress = {"task_id": "task-1", "state": "PROGRESS", "meta": {}, "timestamp": 1.0}
+    success = {"task_id": "task-1", "state": "SUCCESS", "meta": {}, "timestamp": 2.0}
+    hub = FakeHub([progress, progress, success])
+
+    events = _collect(monkeypatch, hub)
+
+    assert [event["state"] for event in events if event] == ["PROGRESS", "SUCCESS"]
+    assert hub.unsubscribed
+
+
+def test_subscribe_waits_for_the_pattern_subscription():
+    async def run():
+        hub = events_utils.TaskEventHub("redis://127.0.0.1:1/0")
+
+        async def listen():
+            await asyncio.sleep(0.05)
+            hub._subscribed.set()
+            await asyncio.sleep(3600)
+
+        hub._listen = listen
+        await hub.subscribe("task-1")
+        subscribed = hub._subscribed.is_set()
+        hub._listener.cancel()
+        return subscribed
+
+    assert asyncio.run(run())
@@ -0,0 +1,115 @@
+import hashlib
+import hmac
+import json
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import webhook_utils
+from webhook_utils import WebhookError, post_webhook, retry_delay, sign_payload
+
+
+class Receiver:
+    """Webhook receiver answering with a configurable status and headers"""
+
+    def __init__(self):
+        self.status = 200
+        self.headers = {}
+        self.received = []
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8")
+                receiver.received.append((dict(self.headers), body))
+                self.send_response(receiver.status)
+                for name, value in receiver.headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/hook"
+
+
+@pytest.fixture
+def receiver():
+    receiver = Receiver()
+    yield receiver
+    receiver.server.shutdown()
+    receiver.server.server_close()
+
+
+BODY = json.dumps({"task_id": "task-1", "status": "SUCCESS"})
+
+
+def test_signature_is_hmac_of_timestamp_and_body():
+    expected = hmac.new(b"secret", f"1700000000.{BODY}".encode("utf-8"), hashlib.sha256).hexdigest()
+    assert sign_payload(BODY, "1700000000", "secret") == f"sha256={expected}"
+    assert sign_payload(BODY, "1700000001", "secret") != sign_payload(BODY, "1700000000", "secret")
+
+
+def test_delivery_is_signed(receiver, monkeypatch):
+    monkeypatch.setattr(webhook_utils, "WEBHOOK_SECRET", "secret")
+
+    assert post_webhook(receiver.url, BODY, "delivery-1", attempt=3) == 200
+
+    headers, body = receiver.received[0]
+    assert body == BODY
+    assert headers["X-Webhook-Id"] == "delivery-1"
+    assert headers["X-Webhook-Attempt"] == "3"
+    assert headers["X-Webhook-Signature"] == sign_payload(BODY, headers["X-Webhook-Timestamp"], "secret")
+
+
+def test_delivery_without_secret_is_unsigned(receiver, monkeypatch):
+    monkeypatch.setattr(webhook_utils, "WEBHOOK_SECRET", "")
+    post_webhook(receiver.url, BODY, "delivery-1")
+    assert "X-Webhook-Signature" not in receiver.received[0][0]
+
+
+@pytest.mark.parametrize("status, retryable", [(429, True), (503, True), (408, True), (400, False), (404, False)])
+def test_statuses(receiver, status, retryable):
+    receiver.status = status
+    with pytest.raises(WebhookError) as error:
+        post_webhook(receiver.url, BODY, "delivery-1")
+    assert error.value.retryable is retryable
+    assert error.value.retry_after is None
+
+
+@pytest.mark.parametrize("header, retry_after", [("120", 120.0), ("Wed, 21 Oct 2015 07:28:00 GMT", None)])
+def test_retry_after(receiver, header, retry_after):
+    receiver.status = 503
+    receiver.headers = {"Retry-After": header}
+    with pytest.raises(WebhookError) as error:
+        post_webhook(receiver.url, BODY, "delivery-1")
+    assert error.value.retry_after == retry_after
+
+
+def test_unreachable_receiver_is_retryable():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    with pytest.raises(WebhookError) as error:
+        post_webhook(f"http://127.0.0.1:{port}/hook", BODY, "delivery-1")
+    assert error.value.retryable
+
+
+def test_backoff_doubles_with_jitter_up_to_the_cap(monkeypatch):
+    monkeypatch.setattr(webhook_utils, "WEBHOOK_RETRY_BACKOFF", 2.0)
+    monkeypatch.setattr(webhook_utils, "WEBHOOK_RETRY_BACKOFF_MAX", 600.0)
+    for retries in range(12):
+        delay = min(2.0 * 2 ** retries, 600.0)
+        assert all(delay / 2 <= retry_delay(retries) <= delay for _ in range(20))
+
+
+def test_retry_after_replaces_the_backoff_up_to_the_cap(monkeypatch):
+    monkeypatch.setattr(webhook_utils, "WEBHOOK_RETRY_BACKOFF_MAX", 600.0)
+    assert retry_delay(0, retry_after=45.0) == 45.0
+    assert retry_delay(5, retry_after=0.0) == 0.0
+    assert retry_delay(0, retry_after=3600.0) == 600.0
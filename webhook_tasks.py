@@ -0,0 +1,122 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import redis
+
+from typing import Any, Optional
+
+from celery_worker import celery_app
+from metrics_utils import metrics
+from redis_utils import redis_client
+from webhook_utils import WEBHOOK_MAX_RETRIES, WebhookError, post_webhook, retry_delay
+
+logger = logging.getLogger(__name__)
+
+# Seconds completions for the same URL are collected into one delivery; 0 delivers each on its own
+WEBHOOK_COALESCE_SECONDS = float(os.environ.get('WEBHOOK_COALESCE_SECONDS', '0'))
+WEBHOOK_COALESCE_MAX_EVENTS = int(os.environ.get('WEBHOOK_COALESCE_MAX_EVENTS', '100'))
+
+_OUTBOX_KEY = 'webhook_outbox:{}'
+_OUTBOX_SCHEDULED_KEY = 'webhook_outbox:{}:scheduled'
+_DEAD_LETTER_KEY = 'webhook_dead_letters'
+_DEAD_LETTER_SIZE = 1000
+
+
+def _url_key(url: str) -> str:
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()[:32]
+
+
+def _dead_letter(url: str, body: str, delivery_id: str, error: str):
+    """Keep an undeliverable webhook for inspection or manual replay"""
+    entry = json.dumps({'url': url, 'body': body, 'delivery_id': delivery_id, 'error': error, 'failed_at': time.time()})
+    try:
+        pipe = redis_client.pipeline()
+        pipe.lpush(_DEAD_LETTER_KEY, entry)
+        pipe.ltrim(_DEAD_LETTER_KEY, 0, _DEAD_LETTER_SIZE - 1)
+        pipe.execute()
+    except redis.exceptions.RedisError as e:
+        logger.error(f"Failed to dead-letter webhook {delivery_id}: {str(e)}")
+
+
+@celery_app.task(bind=True, max_retries=WEBHOOK_MAX_RETRIES, ignore_result=True)
+def deliver_webhook_task(self, url: str, body: str, delivery_id: str):
+    """POST a webhook body, retrying with exponential backoff on network errors, 5xx and 429"""
+    attempt = self.request.retries + 1
+    try:
+        status_code = post_webhook(url, body, delivery_id, attempt)
+    except WebhookError as e:
+        if e.retryable and self.request.retries < self.max_retries:
+            countdown = retry_delay(self.request.retries, e.retry_after)
+            logger.warning(f"Webhook {delivery_id} to {url} failed ({str(e)}), attempt {attempt}, retrying in {countdown:.1f}s")
+            metrics.inc('ffmpeg_webhook_deliveries', outcome='retried')
+            raise self.retry(countdown=countdown)
+        logger.error(f"Giving up on webhook {delivery_id} to {url} after {attempt} attempts: {str(e)}")
+        metrics.inc('ffmpeg_webhook_deliveries', outcome='failed')
+        _dead_letter(url, body, delivery_id, str(e))
+        return
+    logger.info(f"Webhook {delivery_id} delivered to {url} (HTTP {status_code}, attempt {attempt})")
+    metrics.inc('ffmpeg_webhook_deliveries', outcome='delivered')
+
+
+def _schedule_flush(url: str, countdown: float):
+    # The marker expires, so a flush lost with a broker outage doesn't strand the outbox
+    key = _url_key(url)
+    if redis_client.set(_OUTBOX_SCHEDULED_KEY.format(key), 1, nx=True, ex=int(countdown) + 300):
+        flush_webhook_outbox_task.apply_async(args=[url], countdown=countdown)
+
+
+@celery_app.task(ignore_result=True)
+def flush_webhook_outbox_task(url: str):
+    """Deliver the completions collected for ``url`` as one batched webhook"""
+    key = _url_key(url)
+    outbox = _OUTBOX_KEY.format(key)
+    redis_client.delete(_OUTBOX_SCHEDULED_KEY.format(key))
+    pipe = redis_client.pipeline()
+    pipe.lrange(outbox, 0, WEBHOOK_COALESCE_MAX_EVENTS - 1)
+    pipe.ltrim(outbox, WEBHOOK_COALESCE_MAX_EVENTS, -1)
+    pipe.llen(outbox)
+    events, _, remaining = pipe.execute()
+    if remaining:
+        _schedule_flush(url, 0)
+    if not events:
+        return
+    # The events are already serialized; splice them in rather than decoding them again
+    body = '{"batched": true, "count": %d, "events": [%s]}' % (len(events), ','.join(event.decode('utf-8') for event in events))
+    deliver_webhook_task.apply_async(args=[url, body, str(uuid.uuid4())])
+
+
+def queue_webhook(url: str, payload: Any, source_id: Optional[str] = None) -> Optional[str]:
+    """Hand a webhook to the webhook workers instead of POSTing it from the caller
+
+    The payload is serialized here, so what is signed and retried is exactly
+    what the caller saw. With WEBHOOK_COALESCE_SECONDS set, payloads for the
+    same URL are collected and delivered together.
+
+    Returns:
+        The delivery id, sent as X-Webhook-Id unless the payload is coalesced
+        into a batch, or None if it couldn't be queued
+    """
+    body = json.dumps(payload, default=str)
+    delivery_id = str(uuid.uuid4())
+    try:
+        if WEBHOOK_COALESCE_SECONDS > 0:
+            try:
+                redis_client.rpush(_OUTBOX_KEY.format(_url_key(url)), body)
+            except redis.exceptions.RedisError as e:
+                logger.error(f"Webhook outbox unavailable, delivering {source_id} on its own: {str(e)}")
+            else:
+                try:
+                    _schedule_flush(url, WEBHOOK_COALESCE_SECONDS)
+                except Exception as e:
+                    logger.warning(f"Failed to schedule the outbox flush for {url}, a later webhook will: {str(e)}")
+                logger.info(f"Webhook for {source_id} to {url} added to the outbox")
+                return delivery_id
+        deliver_webhook_task.apply_async(args=[url, body, delivery_id])
+        logger.info(f"Webhook {delivery_id} for {source_id} to {url} queued")
+        return delivery_id
+    except Exception as e:
+        logger.error(f"Failed to queue webhook for {source_id} to {url}: {str(e)}")
+        return None
@@ -1,19 +1,115 @@
+import os
+import hmac
+import time
+import random
+import hashlib
 import logging
+import threading
 import requests
+
 from typing import Optional
+from requests.adapters import HTTPAdapter
 
 logger = logging.getLogger(__name__)
 
-def send_webhook_task(webhook_url: str, data: dict, task_id: Optional[str]) -> bool:
-    """Send a webhook to the given URL with the given data."""
+WEBHOOK_TIMEOUT = float(os.environ.get('WEBHOOK_TIMEOUT', '10'))
+# Delivery attempts after the first one, spaced by exponential backoff
+WEBHOOK_MAX_RETRIES = int(os.environ.get('WEBHOOK_MAX_RETRIES', '8'))
+WEBHOOK_RETRY_BACKOFF = float(os.environ.get('WEBHOOK_RETRY_BACKOFF', '2'))
+WEBHOOK_RETRY_BACKOFF_MAX = float(os.environ.get('WEBHOOK_RETRY_BACKOFF_MAX', '600'))
+# Shared secret for the X-Webhook-Signature HMAC, unsigned when empty
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET', '')
+# Keep-alive connections kept per receiving host
+WEBHOOK_POOL_SIZE = int(os.environ.get('WEBHOOK_POOL_SIZE', '10'))
+WEBHOOK_POOL_HOSTS = int(os.environ.get('WEBHOOK_POOL_HOSTS', '50'))
+
+# Statuses worth another attempt; other 4xx answers are final
+_RETRYABLE_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+
+class WebhookError(Exception):
+    """A failed delivery attempt"""
+
+    def __init__(self, message: str, retryable: bool, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+def _build_adapter() -> HTTPAdapter:
+    return HTTPAdapter(pool_connections=WEBHOOK_POOL_HOSTS, pool_maxsize=WEBHOOK_POOL_SIZE)
+
+
+# One connection pool per worker process, so deliveries to the same host reuse
+# connections. Sessions aren't thread-safe, so each delivery thread gets its own
+# session mounted on the shared adapter
+_adapter = _build_adapter()
+_local = threading.local()
+
+
+def _reset_after_fork():
+    global _adapter, _local
+    _adapter = _build_adapter()
+    _local = threading.local()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def webhook_session() -> requests.Session:
+    session = getattr(_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        session.mount('http://', _adapter)
+        session.mount('https://', _adapter)
+        _local.session = session
+    return session
+
+
+def sign_payload(body: str, timestamp: str, secret: str = WEBHOOK_SECRET) -> str:
+    """HMAC-SHA256 of ``<timestamp>.<body>``, as sent in X-Webhook-Signature"""
+    digest = hmac.new(secret.encode('utf-8'), f"{timestamp}.{body}".encode('utf-8'), hashlib.sha256).hexdigest()
+    return f"sha256={digest}"
+
+
+def post_webhook(url: str, body: str, delivery_id: str, attempt: int = 1) -> int:
+    """Make one delivery attempt of a JSON ``body``
+
+    Returns:
+        The receiver's HTTP status
+
+    Raises:
+        WebhookError: If the receiver could not be reached or didn't answer 2xx
+    """
+    timestamp = str(int(time.time()))
+    headers = {
+        'Content-Type': 'application/json',
+        'X-Webhook-Id': delivery_id,
+        'X-Webhook-Timestamp': timestamp,
+        'X-Webhook-Attempt': str(attempt),
+    }
+    if WEBHOOK_SECRET:
+        headers['X-Webhook-Signature'] = sign_payload(body, timestamp, WEBHOOK_SECRET)
     try:
-        response = requests.post(webhook_url, json=data, timeout=10)
-        response.raise_for_status()
-        logger.info(f"Successfully sent webhook notification to {webhook_url} for task {task_id}")
-        return True
+        response = webhook_session().post(url, data=body.encode('utf-8'), headers=headers, timeout=WEBHOOK_TIMEOUT)
     except requests.exceptions.RequestException as e:
-        logger.error(f"Failed to send webhook notification to {webhook_url} for task {task_id}: {str(e)}")
-        return False
-    except Exception as e:
-        logger.error(f"An unexpected error occurred while sending webhook notification to {webhook_url} for task {task_id}: {str(e)}")
-        return False
\ No newline at end of file
+        raise WebhookError(str(e), retryable=True)
+    # Drain the body so the connection goes back to the pool
+    response.content
+    if response.ok:
+        return response.status_code
+    retry_after = None
+    try:
+        retry_after = float(response.headers.get('Retry-After', ''))
+    except ValueError:
+        pass
+    raise WebhookError(f"HTTP {response.status_code}", retryable=response.status_code in _RETRYABLE_STATUSES,
+                       retry_after=retry_after)
+
+
+def retry_delay(retries: int, retry_after: Optional[float] = None) -> float:
+    """Seconds before retry number ``retries + 1``: exponential backoff with jitter, or the receiver's Retry-After"""
+    if retry_after is not None:
+        return min(retry_after, WEBHOOK_RETRY_BACKOFF_MAX)
+    delay = min(WEBHOOK_RETRY_BACKOFF * 2 ** retries, WEBHOOK_RETRY_BACKOFF_MAX)
+    return delay / 2 + random.uniform(0, delay / 2)